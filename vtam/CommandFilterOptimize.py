@@ -5,7 +5,10 @@ import subprocess
 import sys
 
 from vtam.utils.Logger import Logger
+from vtam.utils.ModelPartitionFingerprint import ModelPartitionFingerprint
+from vtam.utils.RunnerFilterChain import RunnerFilterChain
 from vtam.utils.RunnerWopmars import RunnerWopmars
+from vtam.utils.VTAMexception import VTAMexception
 from vtam.utils.constants import FilterLFNreference_records
 from vtam.utils.FileSampleInformation import FileSampleInformation
 
@@ -15,6 +18,16 @@ class CommandFilterOptimize(object):
     @staticmethod
     def main(arg_parser_dic):
 
+        # In fused mode, wopmars stops after VariantReadCount and the filters run in this process
+        is_fused = arg_parser_dic['command'] == 'filter' and arg_parser_dic.get('fused', False)
+        if is_fused:
+            # The in-memory chain always runs from FilterLFN to MakeAsvTable
+            for rule_argument in ['until', 'since']:
+                if arg_parser_dic.get(rule_argument, None) is not None:
+                    Logger.instance().error(VTAMexception(
+                        'The --fused argument is incompatible with the --{} argument.'.format(rule_argument)))
+                    sys.exit(1)
+
         ###################################################################
         #
         # Create FilterLFNreference table and fill it
@@ -41,6 +54,9 @@ class CommandFilterOptimize(object):
                         filter_lfn_reference.insert().values(
                             **filter_rec))
 
+        if is_fused:
+            arg_parser_dic['until'] = 'VariantReadCount'
+
         wopmars_runner = RunnerWopmars(command=arg_parser_dic['command'], cli_args_dic=arg_parser_dic)
         wopmars_command = wopmars_runner.get_wopmars_command()
 
@@ -53,8 +69,33 @@ class CommandFilterOptimize(object):
         # Some arguments will be passed through environmental variables
         if 'threads' in arg_parser_dic:
             os.environ['VTAM_THREADS'] = str(arg_parser_dic['threads'])
+        is_incremental = arg_parser_dic.get('incremental', False) and not arg_parser_dic.get('forceall', False)
+        if is_incremental:
+            os.environ['VTAM_INCREMENTAL'] = '1'
+        if arg_parser_dic.get('snapshot_filters', False):
+            os.environ['VTAM_SNAPSHOT_FILTERS'] = '1'
+        if 'asvtable_format' in arg_parser_dic:
+            os.environ['VTAM_ASVTABLE_FORMAT'] = arg_parser_dic['asvtable_format']
+        if arg_parser_dic['command'] == 'filter' and not is_fused and not arg_parser_dic.get('dryrun', False):
+            # The filter tables are rewritten by wopmars, so the partitions of the fused chain cannot be reused
+            ModelPartitionFingerprint(engine=engine, step=RunnerFilterChain.__name__).delete()
         Logger.instance().info(wopmars_command)
         run_result = subprocess.run(wopmars_command, shell=True)
 
+        ########################################################################################
+        #
+        # Run the filters in memory
+        #
+        ########################################################################################
+
+        if is_fused and run_result.returncode == 0 and not arg_parser_dic.get('dryrun', False):
+            RunnerFilterChain(
+                engine=engine, sortedinfo_tsv=arg_parser_dic['sortedinfo'],
+                params_dic=wopmars_runner.cli_args_and_numerical_params,
+                keep_table_list=arg_parser_dic.get('keep_table', None),
+                num_workers=arg_parser_dic.get('partition_workers', 1),
+                incremental=is_incremental).run(
+                asvtable_tsv_path=arg_parser_dic['asvtable'],
+                asvtable_format=arg_parser_dic.get('asvtable_format', 'wide'))
 
         sys.exit(run_result.returncode)
@@ -1,3 +1,4 @@
+import numpy
 import os
 import pandas
 import pathlib
@@ -175,29 +176,23 @@ class CommandPoolRunMarkers(object):
 
         ############################################################################################
         #
-        # Dictionnary with aggregation function
+        # Aggregate by centroid_variant_id
         # 'variant_id', 'run_name', 'marker_name', 'pooled_sequences': concatenante unique values
         # biosamples: aggregation with presence:absence or read_sum according to 'readcounts' options
         #
         ############################################################################################
 
-        # Drop some columns
-        def are_reads(x):
-            if self.readcounts:  # outputs sum
-                return int(sum(x))
-            else:  # outputs absence/presence
-                return int(sum(x) > 0)
+        sample_df = pooled_marker_df.groupby('centroid_variant_id')[self.sample_names].sum()
+        if self.readcounts:  # outputs sum
+            sample_df = sample_df.astype(int)
+        else:  # outputs absence/presence
+            sample_df = (sample_df > 0).astype(int)
 
-        agg_dic = {}
+        aggregated_df = pandas.DataFrame(index=sample_df.index)
         for k in ['variant_id', 'run_name', 'marker_name', 'pooled_sequences']:
-            agg_dic[k] = lambda x: ','.join(map(str, sorted(list(set(x)))))
-
-        for k in self.sample_names:
-            agg_dic[k] = are_reads
-
-        # Aggregate by centroid_variant_id
-
-        pooled_marker_df = pooled_marker_df.groupby('centroid_variant_id').agg(agg_dic).reset_index()
+            aggregated_df[k] = self.join_unique_values(pooled_marker_df, group_column='centroid_variant_id',
+                                                       value_column=k)
+        pooled_marker_df = pandas.concat([aggregated_df, sample_df], axis=1).reset_index()
 
         pooled_marker_df = pooled_marker_df.merge(centroid_df, on='centroid_variant_id')
         pooled_marker_df = pooled_marker_df.merge(self.asv_table_df[['variant_id', 'sequence']],
@@ -221,6 +216,83 @@ class CommandPoolRunMarkers(object):
         pooled_marker_df['sequence'] = sequence_centroid_list
         return pooled_marker_df
 
+    @staticmethod
+    def join_unique_values(df, group_column, value_column):
+
+        """Returns a Series indexed by the sorted values of group_column with the sorted unique values of
+        value_column in each group joined with ','
+
+        The values are deduplicated and sorted in one pass over the whole DataFrame and each group is then a
+        contiguous slice of the sorted values.
+        """
+
+        unique_df = df[[group_column, value_column]].drop_duplicates().sort_values(
+            by=[group_column, value_column], kind='mergesort')
+        group_array = unique_df[group_column].to_numpy()
+        value_list = unique_df[value_column].astype(str).tolist()
+        # Start of each group in the sorted values
+        start_array = numpy.flatnonzero(numpy.r_[True, group_array[1:] != group_array[:-1]])
+        end_list = start_array[1:].tolist() + [len(value_list)]
+        return pandas.Series([','.join(value_list[start:end]) for start, end in zip(start_array.tolist(), end_list)],
+                             index=pandas.Index(group_array[start_array], name=group_column))
+
+    @staticmethod
+    def prefix_biosample_columns_with_run(asv_table_df):
+
+        """Returns the ASV table with one 'run-biosample' column for each run and biosample column
+
+        The biosample read counts are scattered in one allocation into a block with the biosample columns of each run
+        side by side. Rows are grouped by run in order of appearance and biosample columns of other runs are 0.
+
+        :param asv_table_df: DataFrame with columns run_name, marker_name, variant_id, sequence_length, read_count,
+            the biosamples, clusterid, clustersize, chimera_borderline, sequence
+        :return: DataFrame with columns run_name, marker_name, variant_id, sequence_length, read_count, the
+            run-biosamples, clusterid, clustersize, chimera_borderline, sequence
+        """
+
+        head_column_list = ['run_name', 'marker_name', 'variant_id', 'sequence_length', 'read_count']
+        tail_column_list = ['clusterid', 'clustersize', 'chimera_borderline', 'sequence']
+        biosample_list = asv_table_df.iloc[:, 5:-4].columns.tolist()
+
+        run_code_array, run_name_array = pandas.factorize(asv_table_df.run_name)
+        row_order_array = numpy.argsort(run_code_array, kind='stable')
+        run_code_array = run_code_array[row_order_array]
+
+        biosample_array = asv_table_df[biosample_list].to_numpy()[row_order_array]
+        run_biosample_array = numpy.zeros((biosample_array.shape[0], len(run_name_array) * len(biosample_list)),
+                                          dtype=biosample_array.dtype)
+        column_index_array = run_code_array[:, None] * len(biosample_list) + numpy.arange(len(biosample_list))
+        run_biosample_array[numpy.arange(biosample_array.shape[0])[:, None], column_index_array] = biosample_array
+
+        index = asv_table_df.index[row_order_array]
+        run_biosample_df = pandas.DataFrame(
+            run_biosample_array, index=index,
+            columns=[run_name + '-' + biosample for run_name in run_name_array for biosample in biosample_list])
+
+        return pandas.concat([asv_table_df[head_column_list].iloc[row_order_array], run_biosample_df,
+                              asv_table_df[tail_column_list].iloc[row_order_array]], axis=1)
+
+    @staticmethod
+    def get_run_biosample_set(engine):
+
+        """Returns the set of 'run-biosample' names of the run and sample pairs in the SampleInformation table
+
+        The names are compared as whole column labels, so that run and biosample names can contain '-'.
+        """
+
+        sample_information_declarative_table = SampleInformation.__table__
+        run_declarative_table = Run.__table__
+        sample_declarative_table = Sample.__table__
+        stmt = sqlalchemy.select([run_declarative_table.c.name, sample_declarative_table.c.name])\
+            .select_from(sample_information_declarative_table
+                         .join(run_declarative_table,
+                               sample_information_declarative_table.c.run_id == run_declarative_table.c.id)
+                         .join(sample_declarative_table,
+                               sample_information_declarative_table.c.sample_id == sample_declarative_table.c.id))\
+            .distinct()
+        with engine.connect() as conn:
+            return {run_name + '-' + sample_name for run_name, sample_name in conn.execute(stmt).fetchall()}
+
     @classmethod
     def main(cls, db, pooled_marker_tsv, run_marker_tsv, params, readcounts):
 
@@ -290,46 +362,7 @@ class CommandPoolRunMarkers(object):
         #
         ############################################################################################
 
-        asv_table_2_df = asv_table_df.copy()
-
-        for run_name_i, run_name in enumerate(asv_table_df.run_name.unique()):
-            asv_table_runi_df = (asv_table_df.loc[asv_table_df.run_name == run_name]).copy()
-
-            for biosample in asv_table_runi_df.iloc[:, 5:-4].columns.tolist():
-                asv_table_runi_df.rename({biosample: run_name + '-' + biosample}, axis=1, inplace=True)
-
-            if run_name_i == 0:
-                asv_table_2_df = asv_table_runi_df
-            else:
-
-                asv_table_2_df = pandas.concat([asv_table_2_df, pandas.DataFrame(columns=asv_table_runi_df.columns)])
-                asv_table_2_df = asv_table_2_df.fillna(0)
-                asv_table_2_df = pandas.concat([asv_table_2_df, asv_table_runi_df], axis=0, join='outer')
-
-            del (asv_table_runi_df)
-
-        ############################################################################################
-        #
-        # Reorder columns
-        #
-        ############################################################################################
-
-        column_list = asv_table_2_df.columns.tolist()
-        column_list.remove("run_name")
-        column_list.insert(0, "run_name")
-
-        column_list.remove("clusterid")
-        column_list.remove("clustersize")
-        column_list.remove("chimera_borderline")
-        column_list.remove("sequence")
-        column_list = column_list + ['clusterid', 'clustersize', 'chimera_borderline', 'sequence']
-
-        column_list.remove("sequence_length")
-        column_list.remove("read_count")
-        column_list.insert(3, "sequence_length")
-        column_list.insert(4, "read_count")
-
-        asv_table_2_df = asv_table_2_df[column_list]
+        asv_table_2_df = CommandPoolRunMarkers.prefix_biosample_columns_with_run(asv_table_df)
 
         ############################################################################################
         #
@@ -351,7 +384,7 @@ class CommandPoolRunMarkers(object):
         pooled_marker_df.rename({'variant': 'variant_id'}, axis=1, inplace=True)  # prepare
         pooled_marker_df['read_count'] = pooled_marker_df.iloc[:, 4:-2].sum(axis=1)  # prepare
 
-        seq_clusterer_obj = SequenceClusterer(pooled_marker_df, cluster_identity=cluster_identity)
+        seq_clusterer_obj = SequenceClusterer(pooled_marker_df, cluster_identity=cluster_identity, engine=engine)
         cluster_count_df = seq_clusterer_obj.compute_clusters()
 
         pooled_marker_df = pooled_marker_df.merge(cluster_count_df, on='variant_id')
@@ -375,19 +408,9 @@ class CommandPoolRunMarkers(object):
         # verify here if the run-sample exists in the sampleinformation database
         # and drop if not
         run_biosample_cols = pooled_marker_df.columns[4:-4]
-        # run_biosample_item = run_biosample_cols[0]
-        from sqlalchemy.orm import sessionmaker
-        Session = sessionmaker(bind=engine)
-        session = Session()
-        for run_biosample_item in run_biosample_cols:
-            thisrun, thisbiosample = run_biosample_item.split('-')
-            rowcount = session.query(SampleInformation, Sample, Run).filter(
-                SampleInformation.sample_id == Sample.id).filter(
-                SampleInformation.run_id == Run.id).filter(
-                Run.name == thisrun).filter(Sample.name == thisbiosample).count()
-            if rowcount <= 0:
-                pooled_marker_df.drop([run_biosample_item], axis=1,
-                                      inplace=True)
+        run_biosample_set = CommandPoolRunMarkers.get_run_biosample_set(engine)
+        pooled_marker_df.drop([run_biosample_item for run_biosample_item in run_biosample_cols
+                               if run_biosample_item not in run_biosample_set], axis=1, inplace=True)
 
         #######################################################################
         #
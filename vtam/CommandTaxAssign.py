@@ -19,7 +19,7 @@ class CommandTaxAssign(object):
 
     @classmethod
     def main(cls, db, mode, asvtable_tsv, output, taxonomy_tsv, blastdb_dir_path, blastdbname_str,
-             num_threads=multiprocessing.cpu_count(), params=None):
+             num_threads=multiprocessing.cpu_count(), params=None, exact_match=False):
         """
 
         Parameters
@@ -34,6 +34,8 @@ class CommandTaxAssign(object):
         blastdbname_str
         num_threads
         params
+        exact_match: bool
+            Resolve variants contained in reference sequences before running Blast
 
         Returns
         -------
@@ -165,11 +167,12 @@ class CommandTaxAssign(object):
 
         blast_variant_df = pandas.DataFrame()
         ltg_blast_df = pandas.DataFrame()
+        # Shared by the LTG assignation and the tax lineages of the variant output file
+        taxonomy = Taxonomy(tsv=taxonomy_tsv)
 
         if len(variant_not_tax_assigned) > 0:  # Run blast for variants that need tax assignation
 
             blast_variant_df = pandas.DataFrame.from_records(variant_not_tax_assigned, index='id')
-            taxonomy = Taxonomy(tsv=taxonomy_tsv)
             sequence_list = blast_variant_df.sequence.tolist()
             tax_assign_runner = RunnerTaxAssign(
                 sequence_list=sequence_list,
@@ -177,7 +180,9 @@ class CommandTaxAssign(object):
                 blast_db_dir=blastdb_dir_path,
                 blast_db_name=blastdbname_str,
                 num_threads=num_threads,
-                params = None)
+                params = None,
+                engine=engine,
+                exact_match=exact_match)
             ltg_blast_df = tax_assign_runner.ltg_df
 
             ######################################################
@@ -307,7 +312,7 @@ class CommandTaxAssign(object):
                 __file__, inspect.currentframe().f_lineno))
 
         tax_id_list = variant_output_df.ltg_tax_id.unique().tolist()  # unique list of tax ids
-        tax_lineage = TaxLineage(taxonomic_tsv_path=taxonomy_tsv)
+        tax_lineage = TaxLineage(taxonomy=taxonomy)
         tax_lineage_df = tax_lineage.create_lineage_from_tax_id_list(
             tax_id_list=tax_id_list, tax_name=True)
 
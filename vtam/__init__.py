@@ -231,9 +231,11 @@ class VTAM(object):
             blastdbname_str = arg_parser_dic['blastdbname']
             num_threads = arg_parser_dic['threads']
             params = arg_parser_dic['params']
+            exact_match = arg_parser_dic['exact_match']
             CommandTaxAssign.main(db=db, mode=mode, asvtable_tsv=asvtable_tsv, output=output,
                                   taxonomy_tsv=taxonomy_tsv, blastdb_dir_path=blasdb_dir_path,
-                                  blastdbname_str=blastdbname_str, params=params, num_threads=num_threads)
+                                  blastdbname_str=blastdbname_str, params=params, num_threads=num_threads,
+                                  exact_match=exact_match)
 
         ############################################################################################
         #
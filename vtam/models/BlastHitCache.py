@@ -0,0 +1,18 @@
+from wopmars.Base import Base
+from sqlalchemy import Column, Float, Integer, String, Text, UniqueConstraint
+
+
+class BlastHitCache(Base):
+    __tablename__ = __qualname__
+    __table_args__ = (
+        UniqueConstraint('sequence_hash', 'blast_db_fingerprint', 'qcov_hsp_perc'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # sha256 of the variant sequence
+    sequence_hash = Column(String(64), nullable=False)
+    # sha256 of the names, sizes and modification times of the BLAST DB files
+    blast_db_fingerprint = Column(String(64), nullable=False)
+    qcov_hsp_perc = Column(Float, nullable=False)
+    # One line per filtered hit with tab-separated target_id, identity, evalue, coverage, target_tax_id
+    hit_list = Column(Text, nullable=False)
@@ -0,0 +1,16 @@
+from wopmars.Base import Base
+from sqlalchemy import Column, Integer, String, Text, UniqueConstraint
+
+
+class FilterChimeraCache(Base):
+    __tablename__ = __qualname__
+    __table_args__ = (
+        UniqueConstraint('uchime_input_hash'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # sha256 of the abundance-sorted uchime3_denovo input FASTA and the abskew parameter
+    uchime_input_hash = Column(String(64), nullable=False)
+    # Comma-separated variant IDs
+    chimera_variant_id_list = Column(Text, nullable=False)
+    borderline_variant_id_list = Column(Text, nullable=False)
@@ -0,0 +1,29 @@
+from wopmars.Base import Base
+from sqlalchemy import Column, ForeignKey, Integer, String, UniqueConstraint
+
+
+class PartitionFingerprint(Base):
+    __tablename__ = __qualname__
+    __table_args__ = (
+        UniqueConstraint('step', 'run_id', 'marker_id'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # Name of the step that produced the rows of this run-marker, eg VariantReadCount
+    step = Column(String(100), nullable=False)
+    run_id = Column(
+        Integer,
+        ForeignKey(
+            "Run.id",
+            onupdate="CASCADE",
+            ondelete="CASCADE"),
+        nullable=False)
+    marker_id = Column(
+        Integer,
+        ForeignKey(
+            "Marker.id",
+            onupdate="CASCADE",
+            ondelete="CASCADE"),
+        nullable=False)
+    # sha256 of the step inputs of this run-marker
+    fingerprint = Column(String(64), nullable=False)
@@ -0,0 +1,16 @@
+from wopmars.Base import Base
+from sqlalchemy import Column, Float, Integer, String, Text, UniqueConstraint
+
+
+class SequenceClustererCache(Base):
+    __tablename__ = __qualname__
+    __table_args__ = (
+        UniqueConstraint('cluster_input_hash', 'cluster_identity'),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # sha256 of the cluster_size input FASTA (ids, sizes and sequences in input order)
+    cluster_input_hash = Column(String(64), nullable=False)
+    cluster_identity = Column(Float, nullable=False)
+    # Comma-separated variant_id:clusterid pairs
+    variant_id_clusterid_list = Column(Text, nullable=False)
@@ -65,6 +65,53 @@ class TestAsvtableRunner(unittest.TestCase):
 
         self.assertTrue(filecmp.cmp(asvtable_default_path, asvtable_default_bak_path, shallow=True))
 
+    def test_asvtable_blocks(self):
+
+        asvtable_default_path = os.path.join(self.outdir_path, 'asvtable_default.tsv')
+        asvtable_default_bak_path = os.path.join(os.path.dirname(__file__), "asvtable_default.tsv")
+        asvtable_runner = RunnerAsvTable(variant_read_count_df=self.filter_codon_stop_df,
+                                         engine=self.engine, sample_list=self.sample_list, cluster_identity=0.97)
+        asvtable_runner.to_tsv(asvtable_default_path, block_size=5)
+
+        self.assertTrue(filecmp.cmp(asvtable_default_path, asvtable_default_bak_path, shallow=False))
+
+    def test_write_long(self):
+
+        asvtable_default_path = os.path.join(self.outdir_path, 'asvtable_default.tsv')
+        asvtable_default_bak_path = os.path.join(os.path.dirname(__file__), "asvtable_default.tsv")
+        asvtable_runner = RunnerAsvTable(variant_read_count_df=self.filter_codon_stop_df,
+                                         engine=self.engine, sample_list=self.sample_list, cluster_identity=0.97)
+        asvtable_runner.write(asvtable_default_path, asvtable_format='long')
+
+        # The wide TSV read by taxassign and pool is kept
+        self.assertTrue(filecmp.cmp(asvtable_default_path, asvtable_default_bak_path, shallow=False))
+        asvtable_long_df = pandas.read_csv(
+            os.path.join(self.outdir_path, 'asvtable_default.long.tsv'), sep="\t", header=0)
+        asvtable_bak_df = pandas.read_csv(asvtable_default_bak_path, sep="\t", header=0)
+        self.assertTrue(asvtable_long_df.read_count.sum() == asvtable_bak_df[self.sample_list].to_numpy().sum())
+
+    def test_get_asvtable_format_path(self):
+
+        self.assertTrue(RunnerAsvTable.get_asvtable_format_path('out/asvtable.tsv', 'wide') == 'out/asvtable.tsv')
+        self.assertTrue(RunnerAsvTable.get_asvtable_format_path('out/asvtable.tsv', 'long')
+                        == 'out/asvtable.long.tsv')
+        self.assertTrue(RunnerAsvTable.get_asvtable_format_path('out/asvtable.tsv', 'parquet')
+                        == 'out/asvtable.parquet')
+
+    def test_get_asvtable_sample_coo(self):
+
+        asvtable_default_bak_path = os.path.join(os.path.dirname(__file__), "asvtable_default.tsv")
+        asvtable_bak_df = pandas.read_csv(asvtable_default_bak_path, sep="\t", header=0)
+        asvtable_runner = RunnerAsvTable(variant_read_count_df=self.filter_codon_stop_df,
+                                         engine=self.engine, sample_list=self.sample_list + ['no_read_sample'],
+                                         cluster_identity=0.97)
+        row_code_array, sample_code_array, read_count_array = asvtable_runner.get_asvtable_sample_coo()
+
+        sample_bak_array = asvtable_bak_df[self.sample_list].to_numpy()
+        self.assertTrue(row_code_array.tolist() == sample_bak_array.nonzero()[0].tolist())
+        self.assertTrue(sample_code_array.tolist() == sample_bak_array.nonzero()[1].tolist())
+        self.assertTrue(read_count_array.tolist() == sample_bak_array[sample_bak_array.nonzero()].tolist())
+
     def tearDown(self):
 
         shutil.rmtree(self.outdir_path, ignore_errors=True)
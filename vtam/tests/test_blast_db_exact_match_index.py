@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+from vtam.utils.BlastDbExactMatchIndex import BlastDbExactMatchIndex
+
+
+class TestBlastDbExactMatchIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.outdir_path = tempfile.mkdtemp()
+        self.reference_list = [
+            'TTGGTGCTTGGGCAGGTATGGTAGGTACCTCATTAAGACTTTTAATTCGAGCCGAGTTGGGTAACCCGGGTTCATTAATTGGGGACGATCAAATTTATAACGTAATCG',
+            'GACTTTTAATTCGAGCCGAGTTGGGTAACCCGGGTTCATTAATTGGGGACGATCAAATTTATAACGTAATCGTAACTGCTCATGCCTTTATTATGATTTTTTTTATAG',
+            'ACGTNACGTACGT']
+        self.reference_tsv = os.path.join(self.outdir_path, 'blastdbcmd.tsv')
+        with open(self.reference_tsv, 'w') as fout:
+            fout.write("MF001\t189839\t{}\n".format(self.reference_list[0].lower()))
+            fout.write("MF002\t1469487;189839\t{}\n".format(self.reference_list[1]))
+            fout.write("MF003\tN/A\t{}\n".format(self.reference_list[2]))
+        with open(os.path.join(self.outdir_path, 'coi_blast_db.nsq'), 'w') as fout:
+            fout.write('sequences')
+        self.exact_match_index = BlastDbExactMatchIndex(blast_db_dir=self.outdir_path, blast_db_name='coi_blast_db')
+
+    def test_build(self):
+        self.assertFalse(self.exact_match_index.is_up_to_date())
+        self.assertTrue(self.exact_match_index.build(reference_tsv=self.reference_tsv))
+        self.assertTrue(self.exact_match_index.is_up_to_date())
+
+        # A new BLAST DB makes the index out of date
+        with open(os.path.join(self.outdir_path, 'coi_blast_db.nsq'), 'a') as fout:
+            fout.write('new sequences')
+        self.assertFalse(self.exact_match_index.is_up_to_date())
+
+    def test_get_hit_df(self):
+        self.exact_match_index.build(reference_tsv=self.reference_tsv)
+        shared_sequence = self.reference_list[0][36:]
+        sequence_list = [self.reference_list[1][5:90], shared_sequence, self.reference_list[0],
+                         self.reference_list[0][:62], self.reference_list[0][1:80].replace('T', 'A')]
+        hit_df = self.exact_match_index.get_hit_df(sequence_list)
+        self.assertEqual(list(zip(hit_df.variant_id, hit_df.target_id, hit_df.target_tax_id)), [
+            (sequence_list[0], 'MF002', 1469487), (shared_sequence, 'MF001', 189839),
+            (shared_sequence, 'MF002', 1469487), (sequence_list[2], 'MF001', 189839)])
+        self.assertEqual(hit_df.identity.tolist(), [100.0] * 4)
+
+    def test_get_hit_df_reverse_complement(self):
+        self.exact_match_index.build(reference_tsv=self.reference_tsv)
+        # Reverse complement of the sequence shared by both references, found on the minus strand of both
+        shared_sequence = self.reference_list[0][36:]
+        reverse_complement_sequence = shared_sequence.translate(str.maketrans('ACGT', 'TGCA'))[::-1]
+        hit_df = self.exact_match_index.get_hit_df([reverse_complement_sequence, shared_sequence])
+        self.assertEqual(list(zip(hit_df.variant_id, hit_df.target_id)), [
+            (reverse_complement_sequence, 'MF001'), (reverse_complement_sequence, 'MF002'),
+            (shared_sequence, 'MF001'), (shared_sequence, 'MF002')])
+
+    def test_get_hit_df_query_chunks(self):
+        self.exact_match_index.build(reference_tsv=self.reference_tsv)
+        shared_sequence = self.reference_list[0][36:]
+        sequence_list = [self.reference_list[1][5:90], shared_sequence, self.reference_list[0],
+                         shared_sequence.translate(str.maketrans('ACGT', 'TGCA'))[::-1]]
+        hit_df = self.exact_match_index.get_hit_df(sequence_list)
+        # One query by chunk
+        with unittest.mock.patch.object(BlastDbExactMatchIndex, 'query_chunk_size', 1):
+            self.assertTrue(self.exact_match_index.get_hit_df(sequence_list).equals(hit_df))
+        self.assertEqual(hit_df.shape[0], 6)
+
+    def tearDown(self):
+        shutil.rmtree(self.outdir_path, ignore_errors=True)
@@ -1,7 +1,12 @@
+import hashlib
 import os
 import pandas
+import sqlalchemy
+import subprocess
 import unittest
+import unittest.mock
 
+from vtam.models.SequenceClustererCache import SequenceClustererCache
 from vtam.utils.PathManager import PathManager
 from vtam.utils.SequenceClusterer import SequenceClusterer
 
@@ -32,3 +37,55 @@ class TestSequenceClusterer(unittest.TestCase):
          1]
         self.assertEqual(cluster_count_097_df.clustersize.tolist(), clustersize_097_list)
         self.assertNotEqual(cluster_count_095_df.clustersize.tolist(), clustersize_097_list)
+
+    def test_read_uc(self):
+
+        uc_path = os.path.join(PathManager.instance().get_tempdir(), 'test_read_uc.uc')
+        with open(uc_path, 'w') as fout:
+            fout.write("S\t0\t200\t*\t*\t*\t*\t*\t12;size=50\t*\n")
+            fout.write("H\t0\t200\t99.5\t+\t0\t0\t200M\t3;size=10\t12;size=50\n")
+            fout.write("S\t1\t200\t*\t*\t*\t*\t*\t7;size=5\t*\n")
+            fout.write("C\t0\t2\t*\t*\t*\t*\t*\t12;size=50\t*\n")
+            fout.write("C\t1\t1\t*\t*\t*\t*\t*\t7;size=5\t*\n")
+        self.assertEqual(SequenceClusterer.read_uc(uc_path), [(12, 12), (3, 12), (7, 7)])
+
+    def test_compute_clusters_cache(self):
+
+        engine = sqlalchemy.create_engine('sqlite://', echo=False)
+        variant_info_df = pandas.DataFrame({
+            'variant_id': [12, 3, 7], 'read_count': [50, 10, 5], 'sequence': ['ACGT', 'ACGA', 'TTTT']})
+        seq_clusterer_obj = SequenceClusterer(variant_info_df, cluster_identity=0.97, engine=engine)
+        fasta_str = ">12;size=50\nACGT\n>3;size=10\nACGA\n>7;size=5\nTTTT\n"
+        seq_clusterer_obj.insert_cache(
+            cluster_input_hash=hashlib.sha256(fasta_str.encode()).hexdigest(),
+            variant_id_clusterid_list=[(12, 12), (3, 12), (7, 7)])
+
+        # Assignments stored by another process in the meantime are kept
+        seq_clusterer_obj.insert_cache(
+            cluster_input_hash=hashlib.sha256(fasta_str.encode()).hexdigest(),
+            variant_id_clusterid_list=[(12, 12), (3, 3), (7, 7)])
+
+        # Cached clusters are returned without running vsearch
+        cluster_count_df = seq_clusterer_obj.compute_clusters()
+        self.assertEqual(cluster_count_df.variant_id.tolist(), [12, 3, 7])
+        self.assertEqual(cluster_count_df.clusterid.tolist(), [12, 12, 7])
+        self.assertEqual(cluster_count_df.clustersize.tolist(), [2, 2, 1])
+        self.assertTrue(SequenceClusterer(
+            variant_info_df, cluster_identity=0.95, engine=engine).get_cache(
+            hashlib.sha256(fasta_str.encode()).hexdigest()) is None)
+
+    def test_compute_clusters_vsearch_fails(self):
+
+        engine = sqlalchemy.create_engine('sqlite://', echo=False)
+        variant_info_df = pandas.DataFrame({
+            'variant_id': [12, 3], 'read_count': [50, 10], 'sequence': ['ACGT', 'ACGA']})
+        # Mapping of an earlier run
+        with open(os.path.join(PathManager.instance().get_tempdir(), 'cluster.uc'), 'w') as fout:
+            fout.write("S\t0\t200\t*\t*\t*\t*\t*\t12;size=50\t*\n")
+        seq_clusterer_obj = SequenceClusterer(variant_info_df, cluster_identity=0.97, engine=engine)
+        with unittest.mock.patch.object(
+                subprocess, 'run', return_value=subprocess.CompletedProcess(args=[], returncode=1)):
+            with self.assertRaises(SystemExit):
+                seq_clusterer_obj.compute_clusters()
+        with engine.connect() as conn:
+            self.assertTrue(conn.execute(SequenceClustererCache.__table__.select()).fetchall() == [])
@@ -0,0 +1,40 @@
+from unittest import TestCase
+
+import pandas
+
+from vtam.utils.DataframeVariantReadCountLike import DataframeVariantReadCountLike
+
+
+class TestDataframeVariantReadCountLike(TestCase):
+
+    def setUp(self):
+        self.variant_read_count_df = pandas.DataFrame({
+            'run_id': [1] * 5,
+            'marker_id': [1] * 5,
+            'sample_id': [1, 1, 2, 2, 2],
+            'replicate': [1, 2, 1, 2, 1],
+            'variant_id': [1, 1, 1, 2, 2],
+            'read_count': [156, 341, 99, 140, 1],
+        })
+
+    def test_get_N_i_df(self):
+        variant_read_count_like_obj = DataframeVariantReadCountLike(self.variant_read_count_df)
+        N_i_df = variant_read_count_like_obj.get_N_i_df()
+        self.assertTrue(N_i_df.columns.tolist() == ['run_id', 'marker_id', 'variant_id', 'N_i'])
+        self.assertTrue(N_i_df.N_i.tolist() == [596, 141])
+        # Callers get a copy of the cached aggregate
+        N_i_df['N_i'] = 0
+        self.assertTrue(variant_read_count_like_obj.get_N_i_df().N_i.tolist() == [596, 141])
+
+        # A new variant_read_count_df clears the cache
+        variant_read_count_like_obj.variant_read_count_df = self.variant_read_count_df.iloc[:3]
+        self.assertTrue(variant_read_count_like_obj.get_N_i_df().N_i.tolist() == [596])
+
+    def test_get_N_column(self):
+        variant_read_count_like_obj = DataframeVariantReadCountLike(self.variant_read_count_df)
+        self.assertTrue(variant_read_count_like_obj.get_N_column('N_jk').tolist() == [156, 341, 100, 140, 100])
+
+    def test_filter_out_below_global_read_count_cutoff(self):
+        variant_read_count_df = DataframeVariantReadCountLike(self.variant_read_count_df)\
+            .filter_out_below_global_read_count_cutoff(global_read_count_cutoff=200)
+        self.assertTrue(variant_read_count_df.read_count.tolist() == [156, 341, 99])
@@ -0,0 +1,77 @@
+import numpy
+import os
+import pandas
+import shutil
+import sqlalchemy
+import tempfile
+from unittest import TestCase
+
+from vtam.models.FilterLFN import FilterLFN
+from vtam.utils.FileSampleInformation import FileSampleInformation
+from vtam.utils.FileVariantReadCountSnapshot import FileVariantReadCountSnapshot
+
+
+class TestFileVariantReadCountSnapshot(TestCase):
+
+    def setUp(self):
+        self.outdir_path = tempfile.mkdtemp()
+        self.engine = sqlalchemy.create_engine(
+            'sqlite:///{}'.format(os.path.join(self.outdir_path, 'db.sqlite')), echo=False)
+        FilterLFN.__table__.create(bind=self.engine, checkfirst=True)
+        self.filter_lfn_df = pandas.DataFrame({
+            'run_id': [1] * 5,
+            'marker_id': [1] * 5,
+            'sample_id': [1, 1, 2, 2, 2],
+            'replicate': [1, 2, 1, 2, 1],
+            'variant_id': [1, 1, 2, 2, 3],
+            'read_count': [156, 341, 99, 140, 116],
+            'filter_id': [8, 8, 8, 8, 2],
+            'filter_delete': [False, True, False, False, True],
+        })
+        with self.engine.connect() as conn:
+            conn.execute(FilterLFN.__table__.insert(), self.filter_lfn_df.to_dict('records'))
+        self.snapshot_obj = FileVariantReadCountSnapshot(
+            engine=self.engine, variant_read_count_like_model=FilterLFN)
+
+    def test_write_read(self):
+        self.assertTrue(self.snapshot_obj.read() is None)
+        self.snapshot_obj.write()
+        snapshot_df = self.snapshot_obj.read()
+        self.assertTrue(snapshot_df.columns.tolist() == FileVariantReadCountSnapshot.column_list)
+        self.assertTrue(snapshot_df.read_count.tolist() == self.filter_lfn_df.read_count.tolist())
+        self.assertTrue(snapshot_df.filter_delete.tolist() == [0, 1, 0, 0, 1])
+        # Columns are the memory-mapped int32 files
+        self.assertTrue(snapshot_df.read_count.dtype == 'int32')
+        self.assertTrue(isinstance(snapshot_df.read_count.to_numpy().base, numpy.memmap))
+
+        # New rows make the snapshot out of date
+        with self.engine.connect() as conn:
+            conn.execute(FilterLFN.__table__.insert(), dict(self.filter_lfn_df.to_dict('records')[0], filter_id=2))
+        self.assertTrue(self.snapshot_obj.read() is None)
+
+        self.snapshot_obj.write()
+        self.snapshot_obj.invalidate()
+        self.assertFalse(os.path.isdir(self.snapshot_obj.snapshot_dir))
+
+    def test_get_nijk_df_from_snapshot(self):
+        self.snapshot_obj.write()
+        sample_info_ids_df = pandas.DataFrame({
+            'run_id': [1, 1, 1], 'marker_id': [1, 1, 1], 'sample_id': [2, 2, 1], 'replicate': [2, 1, 1]})
+
+        variant_read_count_df = FileSampleInformation.get_nijk_df_from_snapshot(
+            variant_read_count_like_model=FilterLFN, engine=self.engine, sample_info_ids_df=sample_info_ids_df,
+            filter_id=8)
+        self.assertTrue(variant_read_count_df.columns.tolist() == [
+            'run_id', 'marker_id', 'sample_id', 'replicate', 'variant_id', 'read_count'])
+        # Sample order of the sample information file
+        self.assertTrue(variant_read_count_df.read_count.tolist() == [140, 99, 156])
+        self.assertTrue((variant_read_count_df.dtypes == 'int64').all())
+
+    def test_in_memory_db(self):
+        snapshot_obj = FileVariantReadCountSnapshot(
+            engine=sqlalchemy.create_engine('sqlite://', echo=False), variant_read_count_like_model=FilterLFN)
+        snapshot_obj.write()
+        self.assertTrue(snapshot_obj.read() is None)
+
+    def tearDown(self):
+        shutil.rmtree(self.outdir_path, ignore_errors=True)
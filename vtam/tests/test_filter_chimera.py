@@ -1,6 +1,11 @@
 import multiprocessing
 import pathlib
+import sqlalchemy
+import subprocess
 from unittest import TestCase
+import unittest.mock
+
+from vtam.models.FilterChimeraCache import FilterChimeraCache
 from vtam.utils.PathManager import PathManager
 from vtam.utils.RunnerFilterChimera import RunnerFilterChimera
 import os
@@ -85,3 +90,57 @@ and 50 (2.9%) borderline sequences in 1750 total sequences"""
  'sample_id': {0: 1, 1: 1, 2: 1, 3: 1, 4: 1},
  'variant_id': {0: 1, 1: 2, 2: 3, 3: 4, 4: 5}}
         self.assertTrue(filter_output_bak_dict == filter_output_df.to_dict())
+
+    def test_read_uchimeout(self):
+        uchimeout_path = os.path.join(self.this_tempdir, 'uchimeout.tsv')
+        with open(uchimeout_path, 'w') as fout:
+            fout.write("0.0000\t1;size=650\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\tN\n")
+            fout.write("0.4000\t4;size=350\t2;size=700\t1;size=650\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\tY\n")
+            fout.write("0.2000\t5;size=50\t1;size=650\t2;size=700\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t?\n")
+        chimera_variant_id_set, borderline_variant_id_set = RunnerFilterChimera.read_uchimeout(uchimeout_path)
+        self.assertEqual(chimera_variant_id_set, {4})
+        self.assertEqual(borderline_variant_id_set, {5})
+
+    def test_cache(self):
+        engine = sqlalchemy.create_engine('sqlite://', echo=False)
+        FilterChimeraCache.__table__.create(bind=engine, checkfirst=True)
+        filter_chimera_runner = RunnerFilterChimera(
+            variant_read_count_df=self.variant_read_count_df, engine=engine)
+
+        uchime_fasta_path = os.path.join(self.this_tempdir, 'uchime.fasta')
+        with open(uchime_fasta_path, 'w') as fout:
+            fout.write(">2;size=700\nACGT\n>1;size=650\nACGA\n")
+        uchime_input_hash = RunnerFilterChimera.get_uchime_input_hash(uchime_fasta_path, 16)
+        self.assertEqual(uchime_input_hash, RunnerFilterChimera.get_uchime_input_hash(uchime_fasta_path, 16.0))
+        self.assertNotEqual(uchime_input_hash, RunnerFilterChimera.get_uchime_input_hash(uchime_fasta_path, 8))
+
+        self.assertEqual(filter_chimera_runner.get_cache_dic([uchime_input_hash]), {})
+        filter_chimera_runner.insert_cache({uchime_input_hash: ({4, 3}, set())})
+        self.assertEqual(filter_chimera_runner.get_cache_dic([uchime_input_hash]), {uchime_input_hash: ({3, 4}, set())})
+        # A hash stored by another process in the meantime is kept
+        filter_chimera_runner.insert_cache({uchime_input_hash: ({3}, set()), 'other_hash': (set(), {5})})
+        with unittest.mock.patch.object(RunnerFilterChimera, 'in_clause_size', 1):
+            self.assertEqual(filter_chimera_runner.get_cache_dic([uchime_input_hash, 'other_hash', 'missing_hash']),
+                             {uchime_input_hash: ({3, 4}, set()), 'other_hash': (set(), {5})})
+
+    def test_filter_chimera_vsearch_fails(self):
+        engine = sqlalchemy.create_engine('sqlite://', echo=False)
+        FilterChimeraCache.__table__.create(bind=engine, checkfirst=True)
+        filter_chimera_runner = RunnerFilterChimera(
+            variant_read_count_df=self.variant_read_count_df, num_threads=1, engine=engine)
+        # Uchimeout of an earlier run
+        uchimeout_path = os.path.join(self.this_tempdir, 'uchimeout_failed.tsv')
+        with open(uchimeout_path, 'w') as fout:
+            fout.write("0.4000\t4;size=350\t2;size=700\t1;size=650\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\tY\n")
+        with unittest.mock.patch.object(
+                subprocess, 'run', return_value=subprocess.CompletedProcess(args=[], returncode=1, stdout=b'')):
+            with self.assertRaises(SystemExit):
+                RunnerFilterChimera.run_uchime3_denovo(
+                    uchime_fasta_path=os.path.join(self.this_tempdir, 'uchime.fasta'),
+                    uchimeout_path=uchimeout_path, uchime3_denovo_abskew=16)
+            self.assertFalse(os.path.isfile(uchimeout_path))
+            with self.assertRaises(SystemExit):
+                filter_chimera_runner.get_variant_read_count_delete_df(
+                    variant_df=self.variant_df, uchime3_denovo_abskew=16)
+        with engine.connect() as conn:
+            self.assertTrue(conn.execute(FilterChimeraCache.__table__.select()).fetchall() == [])
@@ -1,7 +1,11 @@
 import pandas
+import sqlalchemy
 import unittest
+import unittest.mock
 import io
 
+from vtam.models.FilterCodonStopCache import FilterCodonStopCache
+from vtam.models.Variant import Variant
 from vtam.utils.RunnerFilterCodonStop import RunnerFilterCodonStop
 
 
@@ -139,3 +143,54 @@ seq_stop2_code5_stop5_code1_frame1_TAA_TAG_TGA	TAAGTATTTTGACTCCTTATGCCTGCTTTAATA
             'id', 'has_stop_codon']].to_string()
         self.assertTrue(variant_stop_codon_count_df_str ==
                         variant_stop_codon_count_df_bak_str)
+
+    def test_scan_stop_codon_in_all_frames(self):
+        sequence_list = self.variant_df.sequence.tolist() + ['TAATAGTGA', 'TAAT', '']
+        for genetic_code in [1, 2, 5]:
+            has_stop_codon_list = self.filter_codon_stop_runner_obj.scan_stop_codon_in_all_frames(
+                sequence_list=sequence_list, genetic_code=genetic_code).tolist()
+            has_stop_codon_bak_list = [all(self.filter_codon_stop_runner_obj.seq_has_codon_stop(
+                sequence=sequence, frame=frame, genetic_code=genetic_code) for frame in [1, 2, 3])
+                for sequence in sequence_list]
+            self.assertEqual(has_stop_codon_bak_list, has_stop_codon_list)
+
+    def test_annotate_stop_codon_count_cache(self):
+        engine = sqlalchemy.create_engine('sqlite://', echo=False)
+        Variant.__table__.create(bind=engine, checkfirst=True)
+        FilterCodonStopCache.__table__.create(bind=engine, checkfirst=True)
+        filter_codon_stop_runner_obj = RunnerFilterCodonStop(variant_read_count_df=None, engine=engine)
+
+        variant_df = self.variant_df.set_index(pandas.Index(range(1, 6)))
+        variant_has_stop_codon_bak_df = self.filter_codon_stop_runner_obj.annotate_stop_codon_count(
+            variant_df.copy(), genetic_code=5)
+
+        filter_codon_stop_runner_obj.annotate_stop_codon_count(variant_df.iloc[:3].copy(), genetic_code=5)
+        self.assertEqual(3, len(filter_codon_stop_runner_obj.get_cache_dic(
+            variant_id_list=variant_df.index.tolist(), genetic_code=5)))
+
+        variant_has_stop_codon_df = filter_codon_stop_runner_obj.annotate_stop_codon_count(
+            variant_df.copy(), genetic_code=5)
+        self.assertEqual(variant_has_stop_codon_bak_df.has_stop_codon.tolist(),
+                         variant_has_stop_codon_df.has_stop_codon.tolist())
+        self.assertEqual(variant_has_stop_codon_bak_df.has_stop_codon.astype(bool).to_dict(),
+                         filter_codon_stop_runner_obj.get_cache_dic(
+                             variant_id_list=variant_df.index.tolist(), genetic_code=5))
+        self.assertEqual({}, filter_codon_stop_runner_obj.get_cache_dic(
+            variant_id_list=variant_df.index.tolist(), genetic_code=1))
+        # Only the requested variants are read
+        with unittest.mock.patch.object(RunnerFilterCodonStop, 'in_clause_size', 2):
+            self.assertEqual([2, 5], sorted(filter_codon_stop_runner_obj.get_cache_dic(
+                variant_id_list=[5, 2, 9], genetic_code=5).keys()))
+
+    def test_insert_cache_twice(self):
+        engine = sqlalchemy.create_engine('sqlite://', echo=False)
+        FilterCodonStopCache.__table__.create(bind=engine, checkfirst=True)
+        filter_codon_stop_runner_obj = RunnerFilterCodonStop(variant_read_count_df=None, engine=engine)
+
+        filter_codon_stop_runner_obj.insert_cache(
+            variant_id_list=[1, 2], has_stop_codon_list=[True, False], genetic_code=5)
+        # Variants stored by another process in the meantime are kept
+        filter_codon_stop_runner_obj.insert_cache(
+            variant_id_list=[2, 3], has_stop_codon_list=[True, True], genetic_code=5)
+        self.assertEqual({1: True, 2: False, 3: True}, filter_codon_stop_runner_obj.get_cache_dic(
+            variant_id_list=[1, 2, 3], genetic_code=5))
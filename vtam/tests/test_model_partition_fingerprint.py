@@ -0,0 +1,46 @@
+from unittest import TestCase
+
+import pandas
+import sqlalchemy
+
+from vtam.utils.ModelPartitionFingerprint import ModelPartitionFingerprint
+
+
+class TestModelPartitionFingerprint(TestCase):
+
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine('sqlite://', echo=False)
+        self.variant_read_count_df = pandas.DataFrame({
+            'run_id': [1] * 4,
+            'marker_id': [1] * 2 + [2] * 2,
+            'sample_id': [1, 2, 1, 2],
+            'replicate': [1] * 4,
+            'variant_id': [1, 2, 3, 4],
+            'read_count': [156, 341, 99, 140],
+        })
+
+    def test_get_df_fingerprint(self):
+        fingerprint = ModelPartitionFingerprint.get_df_fingerprint(self.variant_read_count_df, 0.1)
+        # Independent of the row order
+        self.assertTrue(fingerprint == ModelPartitionFingerprint.get_df_fingerprint(
+            self.variant_read_count_df.iloc[::-1], 0.1))
+        self.assertFalse(fingerprint == ModelPartitionFingerprint.get_df_fingerprint(
+            self.variant_read_count_df, 0.2))
+        variant_read_count_df = self.variant_read_count_df.copy()
+        variant_read_count_df.loc[0, 'read_count'] = 157
+        self.assertFalse(fingerprint == ModelPartitionFingerprint.get_df_fingerprint(variant_read_count_df, 0.1))
+
+    def test_get_changed_run_marker_set(self):
+        partition_fingerprint_obj = ModelPartitionFingerprint(engine=self.engine, step='VariantReadCount')
+        fingerprint_dic = {(run_id, marker_id): ModelPartitionFingerprint.get_df_fingerprint(df)
+                           for (run_id, marker_id), df in self.variant_read_count_df.groupby(['run_id', 'marker_id'])}
+        self.assertTrue(partition_fingerprint_obj.get_changed_run_marker_set(fingerprint_dic) == {(1, 1), (1, 2)})
+
+        partition_fingerprint_obj.update(fingerprint_dic)
+        self.assertTrue(partition_fingerprint_obj.get_changed_run_marker_set(fingerprint_dic) == set())
+
+        fingerprint_dic[(1, 2)] = 'changed'
+        self.assertTrue(partition_fingerprint_obj.get_changed_run_marker_set(fingerprint_dic) == {(1, 2)})
+
+        partition_fingerprint_obj.delete([(1, 1)])
+        self.assertTrue(partition_fingerprint_obj.get_changed_run_marker_set(fingerprint_dic) == {(1, 1), (1, 2)})
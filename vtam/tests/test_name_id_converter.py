@@ -0,0 +1,40 @@
+from unittest import TestCase
+
+import numpy
+import sqlalchemy
+
+from vtam.models.FilterChimeraBorderline import FilterChimeraBorderline
+from vtam.models.Run import Run
+from vtam.models.Variant import Variant
+from vtam.utils.NameIdConverter import NameIdConverter
+
+
+class TestNameIdConverter(TestCase):
+
+    def setUp(self):
+        self.engine = sqlalchemy.create_engine('sqlite://', echo=False)
+        for model in [Run, Variant, FilterChimeraBorderline]:
+            model.__table__.create(bind=self.engine, checkfirst=True)
+        with self.engine.connect() as conn:
+            conn.execute(Run.__table__.insert(), [{'name': 'run1'}, {'name': '2020'}])
+            conn.execute(Variant.__table__.insert(), [{'sequence': 'ACGT'}, {'sequence': 'TTTT'}])
+
+    def test_to_names(self):
+        self.assertTrue(NameIdConverter([numpy.int64(2), 1, 2], engine=self.engine).to_names(Run)
+                        == ['2020', 'run1', '2020'])
+        # Numerical names are compared as strings, like in SQL
+        self.assertTrue(NameIdConverter(['run1', 2020], engine=self.engine).to_ids(Run) == [1, 2])
+
+    def test_to_ids_cache(self):
+        NameIdConverter(['run1'], engine=self.engine).to_ids(Run)
+        with self.engine.connect() as conn:
+            conn.execute(Run.__table__.insert(), [{'name': 'run3'}])
+        # Cached names are not queried again, new names are
+        self.assertTrue(NameIdConverter(['run3', 'run1'], engine=self.engine).to_ids(Run) == [3, 1])
+        with self.assertRaises(SystemExit):
+            NameIdConverter(['run4'], engine=self.engine).to_ids(Run)
+
+    def test_variant_id_to_sequence(self):
+        self.assertTrue(NameIdConverter([2, 1, 2], engine=self.engine).variant_id_to_sequence()
+                        == ['TTTT', 'ACGT', 'TTTT'])
+        self.assertTrue(NameIdConverter(['TTTT'], engine=self.engine).variant_sequence_to_id() == [2])
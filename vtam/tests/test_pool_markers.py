@@ -4,9 +4,13 @@ import sys
 
 import pandas
 import pathlib
+import sqlalchemy
 import unittest
 
 from vtam.CommandPoolRunMarkers import CommandPoolRunMarkers
+from vtam.models.Run import Run
+from vtam.models.Sample import Sample
+from vtam.models.SampleInformation import SampleInformation
 from vtam.utils.PathManager import PathManager
 from vtam.utils.RunnerVSearch import RunnerVSearch
 from vtam.utils.DataframeVariant import DataframeVariant
@@ -126,3 +130,50 @@ ATACCTATTATAATT
         pooled_marker_df = pool_marker_runner.get_pooled_marker_df()
 
         pandas.testing.assert_frame_equal(pooled_marker_df, pooled_marker_bak_df)
+
+
+class TestPoolMarkersJoinUniqueValues(unittest.TestCase):
+
+    def test_join_unique_values(self):
+        df = pandas.DataFrame({'centroid_variant_id': [836, 333, 836, 333, 333],
+                               'variant_id': [8368, 333, 836, 33, 33],
+                               'marker_name': ['ZFZR', 'ZFZR', 'MFZR', 'MFZR', 'MFZR']})
+        variant_sr = CommandPoolRunMarkers.join_unique_values(df, group_column='centroid_variant_id',
+                                                             value_column='variant_id')
+        # Numerical values are sorted as numbers
+        self.assertEqual(variant_sr.to_dict(), {333: '33,333', 836: '836,8368'})
+        marker_sr = CommandPoolRunMarkers.join_unique_values(df, group_column='centroid_variant_id',
+                                                            value_column='marker_name')
+        self.assertEqual(marker_sr.tolist(), ['MFZR,ZFZR', 'MFZR,ZFZR'])
+
+
+class TestPoolMarkersPrefixBiosampleColumns(unittest.TestCase):
+
+    def test_prefix_biosample_columns_with_run(self):
+        asv_table_df = pandas.DataFrame({
+            'run_name': ['run2', 'run1', 'run2'], 'marker_name': ['MFZR'] * 3, 'variant_id': [3, 33, 333],
+            'sequence_length': [4] * 3, 'read_count': [3, 7, 11], 'sample1': [1, 3, 5], 'sample2': [2, 4, 6],
+            'clusterid': [3, 33, 333], 'clustersize': [1] * 3, 'chimera_borderline': [False] * 3,
+            'sequence': ['ACGT', 'ACGA', 'ACGC']})
+        asv_table_2_df = CommandPoolRunMarkers.prefix_biosample_columns_with_run(asv_table_df)
+        self.assertEqual(asv_table_2_df.columns.tolist()[5:-4],
+                         ['run2-sample1', 'run2-sample2', 'run1-sample1', 'run1-sample2'])
+        self.assertEqual(asv_table_2_df.variant_id.tolist(), [3, 333, 33])
+        self.assertEqual(asv_table_2_df.iloc[:, 5:-4].values.tolist(), [[1, 2, 0, 0], [5, 6, 0, 0], [0, 0, 3, 4]])
+
+
+class TestPoolMarkersRunBiosample(unittest.TestCase):
+
+    def test_get_run_biosample_set(self):
+        engine = sqlalchemy.create_engine('sqlite://', echo=False)
+        for model in [Run, Sample, SampleInformation]:
+            model.__table__.create(bind=engine, checkfirst=True)
+        with engine.connect() as conn:
+            conn.execute(Run.__table__.insert(), [{'name': 'prerun'}, {'name': 'run-2'}])
+            conn.execute(Sample.__table__.insert(), [{'name': 'tpos1-prerun'}, {'name': 'tnegtag'}])
+            conn.execute(SampleInformation.__table__.insert(), [
+                {'run_id': 1, 'marker_id': 1, 'sample_id': 1, 'replicate': 1, 'sortedreadfile_id': 1},
+                {'run_id': 1, 'marker_id': 1, 'sample_id': 1, 'replicate': 2, 'sortedreadfile_id': 2},
+                {'run_id': 2, 'marker_id': 1, 'sample_id': 2, 'replicate': 1, 'sortedreadfile_id': 3}])
+        self.assertEqual(CommandPoolRunMarkers.get_run_biosample_set(engine),
+                         {'prerun-tpos1-prerun', 'run-2-tnegtag'})
@@ -0,0 +1,42 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from vtam.utils.RunnerBlast import RunnerBlast
+
+
+class TestRunnerBlast(unittest.TestCase):
+
+    def setUp(self):
+        self.outdir_path = tempfile.mkdtemp()
+        self.fasta_path = os.path.join(self.outdir_path, 'variant.fasta')
+        with open(self.fasta_path, 'w') as fout:
+            for variant_i in range(7):
+                fout.write(">variant{}\nACGT\nTTTT\n".format(variant_i))
+
+    def test_split_fasta(self):
+        shard_fasta_list = RunnerBlast.split_fasta(
+            fasta_path=self.fasta_path, num_shards=3, shard_dir=self.outdir_path)
+        self.assertEqual(len(shard_fasta_list), 3)
+        shard_content_list = []
+        for shard_fasta in shard_fasta_list:
+            with open(shard_fasta) as fin:
+                shard_content_list.append(fin.read())
+        self.assertEqual([shard_content.count('>') for shard_content in shard_content_list], [2, 2, 3])
+        # Shards are contiguous records in the input order
+        with open(self.fasta_path) as fin:
+            self.assertEqual(''.join(shard_content_list), fin.read())
+
+    def test_split_fasta_one_shard(self):
+        self.assertEqual(RunnerBlast.split_fasta(
+            fasta_path=self.fasta_path, num_shards=1, shard_dir=self.outdir_path), [])
+
+    def test_num_shards(self):
+        self.assertEqual(RunnerBlast(self.fasta_path, self.outdir_path, 'coi_blast_db', num_threads=64,
+                                     qcov_hsp_perc=80).num_shards, 16)
+        self.assertEqual(RunnerBlast(self.fasta_path, self.outdir_path, 'coi_blast_db', num_threads=2,
+                                     qcov_hsp_perc=80).num_shards, 1)
+
+    def tearDown(self):
+        shutil.rmtree(self.outdir_path, ignore_errors=True)
@@ -0,0 +1,135 @@
+from unittest import TestCase
+import filecmp
+import os
+import pathlib
+import shlex
+import shutil
+import sqlalchemy
+import subprocess
+import sys
+
+import pandas
+
+from vtam.CommandFilterOptimize import CommandFilterOptimize
+from vtam.utils import pip_install_vtam_for_tests
+from vtam.utils.PathManager import PathManager
+from vtam.utils.RunnerFilterChain import RunnerFilterChain
+
+
+class TestRunnerFilterChain(TestCase):
+
+    def setUp(self):
+        self.filter_delete_df = pandas.DataFrame({
+            'run_id': [1] * 5,
+            'marker_id': [1] * 5,
+            'sample_id': [1] * 2 + [2] * 3,
+            'replicate': [1, 2] + [1, 2] + [3],
+            'variant_id': [1] * 2 + [2] * 3,
+            'read_count': [156, 341, 99, 140, 116],
+            'filter_delete': [False, True, False, False, True],
+        })
+
+    def test_get_passed_df(self):
+        passed_df = RunnerFilterChain.get_passed_df(self.filter_delete_df)
+
+        self.assertTrue(passed_df.columns.tolist() == [
+            'run_id', 'marker_id', 'sample_id', 'replicate', 'variant_id', 'read_count'])
+        self.assertTrue(passed_df.read_count.tolist() == [156, 99, 140])
+
+    def test_persist_table_list(self):
+        runner_filter_chain = RunnerFilterChain(
+            engine=None, sortedinfo_tsv=None, params_dic={}, keep_table_list=['FilterLFN', 'FilterCodonStop'])
+
+        self.assertTrue(runner_filter_chain.persist_table_list == [
+            'FilterChimeraBorderline', 'FilterCodonStop', 'ReadCountAverageOverReplicates', 'FilterLFN'])
+
+
+class TestCommandFilterOptimizeFused(TestCase):
+
+    def test_fused_until_since(self):
+        # The fused chain cannot stop at or start from a filter
+        for rule_argument in ['until', 'since']:
+            with self.assertRaises(SystemExit):
+                CommandFilterOptimize.main(arg_parser_dic={
+                    'command': 'filter', 'fused': True, rule_argument: 'FilterPCRerror', 'db': 'db.sqlite'})
+
+
+class TestCommandFilterFusedSorted(TestCase):
+    """Runs vtam filter --fused on the sorted test files, duplicated in two runs to get two run-marker partitions"""
+
+    @classmethod
+    def setUpClass(cls):
+
+        pip_install_vtam_for_tests()  # vtam needs to be in the path
+
+    def setUp(self):
+
+        self.test_path = PathManager.get_test_path()
+        self.outdir_path = os.path.join(self.test_path, 'outdir')
+        shutil.rmtree(self.outdir_path, ignore_errors=True)
+        pathlib.Path(self.outdir_path).mkdir(parents=True, exist_ok=True)
+
+        self.sorteddir = os.path.join(self.test_path, 'test_files', 'sorted')
+        sortedinfo_df = pandas.read_csv(os.path.join(self.sorteddir, 'sortedinfo.tsv'), sep='\t', header=0)
+        sortedinfo_run2_df = sortedinfo_df.copy()
+        sortedinfo_run2_df['run'] = 'run2'
+        self.sortedinfo = os.path.join(self.outdir_path, 'sortedinfo_2runs.tsv')
+        pandas.concat([sortedinfo_df, sortedinfo_run2_df], axis=0).to_csv(self.sortedinfo, sep='\t', index=False)
+        # The sorted test files have less than 10 reads by variant
+        self.params = os.path.join(self.outdir_path, 'params.yml')
+        with open(self.params, 'w') as fout:
+            fout.write("lfn_read_count_cutoff: 2\n")
+
+    def run_vtam_filter(self, db_name, asvtable_name, option_str):
+
+        cmd = "vtam filter --db {} --sortedinfo {} --sorteddir {} --asvtable {} --params {} {}".format(
+            db_name, self.sortedinfo, self.sorteddir, asvtable_name, self.params, option_str)
+        if sys.platform.startswith("win"):
+            args = cmd
+        else:
+            args = shlex.split(cmd)
+        result = subprocess.run(args=args, cwd=self.outdir_path)
+        self.assertEqual(result.returncode, 0)
+
+    def read_table_df(self, db_name, table_name):
+        """Returns the rows of a table without the id column and in a fixed order"""
+
+        engine = sqlalchemy.create_engine('sqlite:///{}'.format(os.path.join(self.outdir_path, db_name)), echo=False)
+        with engine.connect() as conn:
+            table_df = pandas.read_sql(sqlalchemy.text('SELECT * FROM {}'.format(table_name)), con=conn)
+        table_df = table_df.drop(columns=['id'], errors='ignore')
+        table_df = table_df[sorted(table_df.columns)]
+        return table_df.sort_values(by=table_df.columns.tolist()).reset_index(drop=True)
+
+    def test_partition_workers(self):
+
+        # All the filter tables are written
+        keep_table_str = ' '.join([table_name for table_name in RunnerFilterChain.table_model_dic
+                                   if table_name not in RunnerFilterChain.final_table_list])
+        self.run_vtam_filter('db_1.sqlite', 'asvtable_1.tsv',
+                             '--fused --partition_workers 1 --keep_table {}'.format(keep_table_str))
+        self.run_vtam_filter('db_2.sqlite', 'asvtable_2.tsv',
+                             '--fused --partition_workers 2 --keep_table {}'.format(keep_table_str))
+
+        self.assertTrue(self.read_table_df('db_1.sqlite', 'FilterLFN').shape[0] > 0)
+        for table_name in RunnerFilterChain.table_model_dic:
+            pandas.testing.assert_frame_equal(self.read_table_df('db_1.sqlite', table_name),
+                                              self.read_table_df('db_2.sqlite', table_name))
+        self.assertTrue(filecmp.cmp(os.path.join(self.outdir_path, 'asvtable_1.tsv'),
+                                    os.path.join(self.outdir_path, 'asvtable_2.tsv'), shallow=False))
+
+    def test_fused_per_filter(self):
+
+        self.run_vtam_filter('db_filter.sqlite', 'asvtable_filter.tsv', '')
+        self.run_vtam_filter('db_fused.sqlite', 'asvtable_fused.tsv', '--fused')
+
+        for table_name in RunnerFilterChain.final_table_list:
+            table_filter_df = self.read_table_df('db_filter.sqlite', table_name)
+            self.assertTrue(table_filter_df.shape[0] > 0)
+            pandas.testing.assert_frame_equal(table_filter_df, self.read_table_df('db_fused.sqlite', table_name))
+        self.assertTrue(filecmp.cmp(os.path.join(self.outdir_path, 'asvtable_filter.tsv'),
+                                    os.path.join(self.outdir_path, 'asvtable_fused.tsv'), shallow=False))
+
+    def tearDown(self):
+
+        shutil.rmtree(self.outdir_path, ignore_errors=True)
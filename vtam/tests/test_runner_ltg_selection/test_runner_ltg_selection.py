@@ -1,9 +1,11 @@
 import os
 import shutil
 
+import numpy
 import pandas
 import pathlib
 import unittest
+import unittest.mock
 
 from vtam.utils.RunnerLTGselection import RunnerLTGselection
 from vtam.utils.PathManager import PathManager
@@ -45,3 +47,47 @@ class TestRunnerLTGselection(unittest.TestCase):
 
     def tearDown(self):
         shutil.rmtree(self.outdir_path, ignore_errors=True)
+
+
+class TestRunnerLTGselectionVectorized(unittest.TestCase):
+
+    def setUp(self):
+
+        test_path = os.path.join(PathManager.get_test_path())
+        self.variantid_identity_lineage_df = pandas.read_csv(os.path.join(test_path, "test_runner_ltg_selection", "variantid_identity_lineage.tsv"), sep="\t", header=0)
+        self.ltg_bak_df = pandas.read_csv(os.path.join(test_path, "test_runner_ltg_selection", "ltg_bak.tsv"), sep="\t")
+        # Names of the expected LTGs only
+        self.taxonomy_df = self.ltg_bak_df[['ltg_tax_id', 'ltg_tax_name']].drop_duplicates().rename(
+            columns={'ltg_tax_name': 'name_txt'}).set_index('ltg_tax_id')
+
+    def test_several_variants_to_ltg(self):
+
+        runner_ltg_selection = RunnerLTGselection(
+            variant_identity_lineage_df=self.variantid_identity_lineage_df, taxonomy_df=self.taxonomy_df, params=None)
+        ltg_df = runner_ltg_selection.several_variants_to_ltg()
+        pandas._testing.assert_frame_equal(self.ltg_bak_df, ltg_df)
+        # Same LTGs as one variant at a time
+        for row in ltg_df.itertuples():
+            self.assertTrue(runner_ltg_selection.one_variant_to_ltg(row.variant_id) == {
+                'identity': row.identity, 'ltg_tax_id': row.ltg_tax_id, 'ltg_tax_name': row.ltg_tax_name,
+                'ltg_rank': row.ltg_rank})
+
+    def test_several_variants_to_ltg_processes(self):
+
+        # Partitions of a few hundred hits across two forked processes
+        with unittest.mock.patch.object(RunnerLTGselection, 'process_hit_count', 300):
+            runner_ltg_selection = RunnerLTGselection(
+                variant_identity_lineage_df=self.variantid_identity_lineage_df, taxonomy_df=self.taxonomy_df,
+                params=None, num_threads=2)
+            ltg_df = runner_ltg_selection.several_variants_to_ltg()
+        pandas._testing.assert_frame_equal(self.ltg_bak_df, ltg_df)
+        self.assertTrue(RunnerLTGselection.fork_shared_dic == {})
+
+    def test_get_group_mode(self):
+
+        # Tied values keep the first one, like value_counts
+        group_array, value_array, count_array = RunnerLTGselection.get_group_mode(
+            numpy.array([0, 0, 0, 0, 2, 2]), numpy.array([5, 3, 3, 5, 1, 4]))
+        self.assertTrue(group_array.tolist() == [0, 2])
+        self.assertTrue(value_array.tolist() == [5, 1])
+        self.assertTrue(count_array.tolist() == [2, 1])
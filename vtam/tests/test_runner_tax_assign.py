@@ -0,0 +1,87 @@
+import hashlib
+import os
+import pandas
+import shutil
+import sqlalchemy
+import tempfile
+import unittest
+from unittest import mock
+
+from vtam.utils.BlastDbExactMatchIndex import BlastDbExactMatchIndex
+from vtam.utils.RunnerBlast import RunnerBlast
+from vtam.utils.RunnerTaxAssign import RunnerTaxAssign
+from vtam.utils.Taxonomy import Taxonomy
+
+
+class TestRunnerTaxAssign(unittest.TestCase):
+
+    def setUp(self):
+        self.outdir_path = tempfile.mkdtemp()
+        self.engine = sqlalchemy.create_engine('sqlite://', echo=False)
+        self.taxonomy = Taxonomy(df=pandas.DataFrame({
+            'tax_id': [1, 131567, 10190, 10191, 10193, 10194],
+            'parent_tax_id': [1, 1, 131567, 10190, 10191, 10191],
+            'rank': ['no rank', 'no rank', 'phylum', 'family', 'genus', 'genus'],
+            'name_txt': ['root', 'cellular organisms', 'Rotifera', 'Philodinidae', 'Rotaria', 'Philodina'],
+            'old_tax_id': [None] * 6}))
+        self.sequence_list = ['ACGTACGT', 'TTTTACGT', 'GGGGACGT']
+        self.blast_output_str = "ACGTACGT\tMF001\t100.0\t1e-80\t100\t10193\n" \
+                                "ACGTACGT\tMF002\t99.5\t2.5e-79\t100\t10194;10193\n" \
+                                "GGGGACGT\tMF003\t85.0\t1e-20\t90\t10191\n"
+
+    def run_local_blast(self):
+        blast_output_tsv = os.path.join(self.outdir_path, 'blast_output.tsv')
+        with open(blast_output_tsv, 'w') as fout:
+            fout.write(self.blast_output_str)
+        return blast_output_tsv
+
+    def test_blast_hit_cache(self):
+        with mock.patch.object(RunnerBlast, 'run_local_blast', autospec=True,
+                               side_effect=lambda runner_blast: self.run_local_blast()) as run_local_blast:
+            ltg_df = RunnerTaxAssign(self.sequence_list, self.taxonomy, self.outdir_path, 'coi_blast_db',
+                                     num_threads=1, params=None, engine=self.engine).ltg_df
+            self.assertEqual(run_local_blast.call_count, 1)
+
+            # Hits of all the variants, including those without hits, are cached
+            runner_tax_assign = RunnerTaxAssign(self.sequence_list, self.taxonomy, self.outdir_path, 'coi_blast_db',
+                                                num_threads=1, params=None, engine=self.engine)
+            ltg_cached_df = runner_tax_assign.ltg_df
+            self.assertEqual(run_local_blast.call_count, 1)
+        pandas.testing.assert_frame_equal(ltg_df, ltg_cached_df)
+
+        # Hits stored by another process in the meantime are kept
+        runner_tax_assign.insert_blast_hit_cache(pandas.DataFrame(
+            columns=['variant_id', 'target_id', 'identity', 'evalue', 'coverage', 'target_tax_id']), self.sequence_list)
+        sequence_hash = hashlib.sha256(self.sequence_list[0].encode()).hexdigest()
+        self.assertTrue(runner_tax_assign.get_blast_hit_cache_dic([sequence_hash])[sequence_hash].startswith('MF001'))
+
+    def test_exact_match(self):
+        reference_sequence = 'TTGGTGCTTGGGCAGGTATGGTAGGTACCTCATTAAGACTTTTAATTCGAGCCGAGTTGGGTAACCCGGGTTCATTAATTGGGGACG'
+        with open(os.path.join(self.outdir_path, 'blastdbcmd.tsv'), 'w') as fout:
+            fout.write("MF004\t10194\t{}\n".format(reference_sequence))
+        BlastDbExactMatchIndex(blast_db_dir=self.outdir_path, blast_db_name='coi_blast_db').build(
+            reference_tsv=os.path.join(self.outdir_path, 'blastdbcmd.tsv'))
+
+        blasted_sequence_list = []
+
+        def run_local_blast(runner_blast):
+            with open(runner_blast.variant_fasta) as fin:
+                blasted_sequence_list.extend([line.strip() for line in fin if not line.startswith('>')])
+            return self.run_local_blast()
+
+        with mock.patch.object(RunnerBlast, 'run_local_blast', autospec=True, side_effect=run_local_blast):
+            ltg_df = RunnerTaxAssign(self.sequence_list + [reference_sequence[2:80]], self.taxonomy, self.outdir_path,
+                                     'coi_blast_db', num_threads=1, params=None, exact_match=True).ltg_df
+        self.assertEqual(blasted_sequence_list, self.sequence_list)
+        self.assertEqual(ltg_df.loc[ltg_df.variant_id == reference_sequence[2:80], 'ltg_tax_id'].tolist(), [10194])
+
+    def test_hit_list_to_df(self):
+        blast_output_tsv = self.run_local_blast()
+        blast_output_df = RunnerBlast.read_blast_result(blast_output_tsv)
+        hit_list_dic = {'h1': "MF001\t100.0\t1e-80\t100\t10193\nMF002\t99.5\t2.5e-79\t100\t10194",
+                        'h2': '', 'h3': "MF003\t85.0\t1e-20\t90\t10191"}
+        pandas.testing.assert_frame_equal(
+            RunnerTaxAssign.hit_list_to_df(hit_list_dic, self.sequence_list, ['h1', 'h2', 'h3']), blast_output_df)
+
+    def tearDown(self):
+        shutil.rmtree(self.outdir_path, ignore_errors=True)
@@ -0,0 +1,37 @@
+from unittest import TestCase
+
+import numpy
+import pandas
+
+from vtam.utils.TaxLineage import TaxLineage
+from vtam.utils.Taxonomy import Taxonomy
+
+
+class TestTaxLineage(TestCase):
+
+    def setUp(self):
+        taxonomy_df = pandas.DataFrame({
+            'tax_id': [1, 10, 20, 30, 40, 50],
+            'parent_tax_id': [1, 1, 10, 20, 30, 99],
+            'rank': ['no rank', 'phylum', 'order', 'genus', 'species', 'species'],
+            'name_txt': ['root', 'phylum10', 'order20', 'genus30', 'species40', 'species50'],
+            'old_tax_id': [numpy.nan, numpy.nan, numpy.nan, 31, numpy.nan, numpy.nan],
+        })
+        self.tax_lineage = TaxLineage(taxonomy=Taxonomy(df=taxonomy_df))
+
+    def test_create_lineage_from_one_tax_id(self):
+        self.assertTrue(self.tax_lineage.create_lineage_from_one_tax_id(31, tax_name=True)
+                        == {'tax_id': 31, 'phylum': 'phylum10', 'order': 'order20', 'genus': 'genus30'})
+        self.assertTrue(self.tax_lineage.create_lineage_from_one_tax_id(50) is None)
+        self.assertTrue(self.tax_lineage.create_lineage_from_one_tax_id(numpy.nan) is None)
+
+    def test_create_lineage_from_tax_id_list(self):
+        tax_lineage_df = self.tax_lineage.create_lineage_from_tax_id_list([40, 50, None, 31, 2], tax_name=False)
+        self.assertTrue(tax_lineage_df.columns.tolist() == ['phylum', 'order', 'genus', 'species', 'tax_id'])
+        self.assertTrue(tax_lineage_df.tax_id.tolist() == [40, 31])
+        self.assertTrue(tax_lineage_df.genus.tolist() == [30, 31])
+        self.assertTrue(numpy.isnan(tax_lineage_df.species[1]))
+
+        tax_lineage_df = self.tax_lineage.create_lineage_from_tax_id_list([40, 31], tax_name=True)
+        self.assertTrue(tax_lineage_df.genus.tolist() == ['genus30', 'genus30'])
+        self.assertTrue(tax_lineage_df.tax_id.dtype == 'object')
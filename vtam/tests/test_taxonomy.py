@@ -0,0 +1,64 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy
+import pandas
+
+from vtam.utils.Taxonomy import Taxonomy
+
+
+class TestTaxonomy(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.taxonomy_tsv = os.path.join(self.tempdir, 'taxonomy.tsv')
+        pandas.DataFrame({
+            'tax_id': [1, 10, 20, 30, 40, 50, 60],
+            'parent_tax_id': [1, 1, 10, 20, 30, 99, 20],
+            'rank': ['no rank', 'phylum', 'order', 'genus', 'species', 'species', 'no rank'],
+            'name_txt': ['root', 'phylum10', 'order20', 'genus30', 'species40', 'species50', 'clade60'],
+            'old_tax_id': [numpy.nan, numpy.nan, numpy.nan, numpy.nan, 41, numpy.nan, numpy.nan],
+        }).to_csv(self.taxonomy_tsv, sep='\t', index=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_get_one_tax_id_lineage(self):
+        taxonomy = Taxonomy(tsv=self.taxonomy_tsv)
+        self.assertTrue(taxonomy.get_one_tax_id_lineage(40)
+                        == {'phylum': 10, 'order': 20, 'genus': 30, 'species': 40})
+        # Old tax_id
+        self.assertTrue(taxonomy.get_one_tax_id_lineage(41)
+                        == {'phylum': 10, 'order': 20, 'genus': 30, 'species': 41})
+        # Missing parent and missing tax_id
+        self.assertTrue(taxonomy.get_one_tax_id_lineage(50) == {'species': 50})
+        self.assertTrue(taxonomy.get_one_tax_id_lineage(1000) == {})
+
+    def test_get_several_tax_id_lineages(self):
+        tax_id_lineage_df = Taxonomy(tsv=self.taxonomy_tsv).get_several_tax_id_lineages([40, 60, 50])
+        self.assertTrue(tax_id_lineage_df.index.tolist() == [40, 60, 50])
+        self.assertTrue(tax_id_lineage_df.columns.tolist() == ['no rank', 'phylum', 'order', 'genus', 'species'])
+        self.assertTrue(tax_id_lineage_df.loc[60, 'no rank'] == 60)
+        self.assertTrue(numpy.isnan(tax_id_lineage_df.loc[60, 'genus']))
+
+    def test_lineage_array_file(self):
+        lineage_array = Taxonomy(tsv=self.taxonomy_tsv).get_lineage_array()
+        self.assertTrue(os.path.isfile(self.taxonomy_tsv + '.lineage.json'))
+        # The next Taxonomy memory-maps the same array
+        lineage_mmap = Taxonomy(tsv=self.taxonomy_tsv).get_lineage_array()
+        self.assertTrue(isinstance(lineage_mmap, numpy.memmap))
+        self.assertTrue((lineage_mmap == lineage_array).all())
+        lineage_npy_inode = os.stat(self.taxonomy_tsv + '.lineage.npy').st_ino
+        # The array is built again after a change of the TSV
+        with open(self.taxonomy_tsv, 'a') as fout:
+            fout.write("70\t1\tphylum\tphylum70\t\n")
+        lineage_array_new = Taxonomy(tsv=self.taxonomy_tsv).get_lineage_array()
+        self.assertTrue(lineage_array_new.shape[0] == 71)
+        self.assertTrue(lineage_array_new[70, Taxonomy.lineage_rank_list.index('phylum')] == 70)
+        # The file memory-mapped before is replaced, not overwritten
+        self.assertTrue(os.stat(self.taxonomy_tsv + '.lineage.npy').st_ino != lineage_npy_inode)
+        self.assertTrue((lineage_mmap == lineage_array).all())
+        self.assertTrue(sorted(os.listdir(self.tempdir)) == [
+            'taxonomy.tsv', 'taxonomy.tsv.lineage.json', 'taxonomy.tsv.lineage.npy'])
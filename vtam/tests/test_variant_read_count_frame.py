@@ -0,0 +1,62 @@
+from unittest import TestCase
+
+import numpy
+import pandas
+
+from vtam.utils.VariantReadCountFrame import VariantReadCountFrame
+
+
+class TestVariantReadCountFrame(TestCase):
+
+    def setUp(self):
+        random_state = numpy.random.RandomState(0)
+        self.variant_read_count_df = pandas.DataFrame({
+            'run_id': random_state.randint(1, 3, 200),
+            'marker_id': random_state.randint(1, 4, 200),
+            'sample_id': random_state.randint(1, 6, 200),
+            'replicate': random_state.randint(1, 4, 200),
+            'variant_id': random_state.randint(1, 5000000, 200),
+            'read_count': random_state.randint(1, 1000, 200),
+        }).drop_duplicates(['run_id', 'marker_id', 'sample_id', 'replicate', 'variant_id'])
+
+    def test_aggregate_read_count(self):
+        variant_read_count_frame = VariantReadCountFrame(self.variant_read_count_df)
+        self.assertTrue(variant_read_count_frame.code_df.read_count.dtype == 'uint32')
+        self.assertTrue(variant_read_count_frame.code_df.run_id.dtype == 'uint8')
+
+        for column_list in [['run_id', 'marker_id', 'variant_id'], ['run_id', 'marker_id', 'sample_id', 'replicate']]:
+            expected_df = self.variant_read_count_df.groupby(column_list).read_count.sum().reset_index()\
+                .rename(columns={'read_count': 'N'})
+            pandas.testing.assert_frame_equal(
+                variant_read_count_frame.aggregate_read_count(column_list=column_list, aggregate_name='N'),
+                expected_df)
+
+    def test_aggregate_read_count_sequence(self):
+        # The VariantReadCount wrapper aggregates the read counts of the variant sequences
+        variant_read_count_df = self.variant_read_count_df.copy()
+        variant_read_count_df['variant_id'] = variant_read_count_df.variant_id.map('ACGT{}'.format)
+        variant_read_count_frame = VariantReadCountFrame(variant_read_count_df)
+
+        expected_df = variant_read_count_df.groupby(['variant_id']).read_count.sum().reset_index()\
+            .rename(columns={'read_count': 'N_i'})
+        pandas.testing.assert_frame_equal(
+            variant_read_count_frame.aggregate_read_count(column_list=['variant_id'], aggregate_name='N_i'),
+            expected_df)
+
+    def test_aggregate_read_count_unpackable(self):
+        variant_read_count_frame = VariantReadCountFrame(self.variant_read_count_df)
+        # Pretend that the codes do not fit in 64 bits
+        variant_read_count_frame.bit_length_dic['variant_id'] = 63
+        column_list = ['run_id', 'marker_id', 'variant_id', 'sample_id']
+        self.assertTrue(variant_read_count_frame.get_key(column_list) is None)
+
+        expected_df = self.variant_read_count_df.groupby(column_list).read_count.count().reset_index()\
+            .rename(columns={'read_count': 'replicate_count'})
+        pandas.testing.assert_frame_equal(variant_read_count_frame.aggregate_read_count(
+            column_list=column_list, aggregate_name='replicate_count', func='count'), expected_df)
+
+    def test_transform_read_count(self):
+        variant_read_count_frame = VariantReadCountFrame(self.variant_read_count_df)
+        column_list = ['run_id', 'marker_id', 'variant_id', 'replicate']
+        self.assertTrue(variant_read_count_frame.transform_read_count(column_list).tolist()
+                        == self.variant_read_count_df.groupby(column_list).read_count.transform('sum').tolist())
@@ -442,6 +442,64 @@ class ArgParser:
             1. SampleInformation, 2. VariantReadCount, 3. FilterLFN, 4. FilterMinReplicateNumber, 5. FilterPCRerror, 6. FilterChimera, 7. FilterMinReplicateNumber2, 8. FilterRenkonen, 9. FilterMinReplicateNumber3, 10. FilterIndel, 11. FilterCodonStop, 12. ReadCountAverageOverReplicates, 13. MakeAsvTable""",
             required=False)
 
+        parser_vtam_filter.add_argument(
+            '--fused',
+            action='store_true',
+            help="if set, VTAM will run the rules from FilterLFN to MakeAsvTable in one process and only write the "
+                 "FilterChimeraBorderline, FilterCodonStop and ReadCountAverageOverReplicates tables to the database. "
+                 "Incompatible with --until and --since",
+            required=False,
+            default=False)
+
+        parser_vtam_filter.add_argument(
+            '--keep_table',
+            dest='keep_table',
+            nargs='+',
+            default=None,
+            choices=['FilterLFN', 'FilterMinReplicateNumber', 'FilterPCRerror', 'FilterChimera',
+                     'FilterMinReplicateNumber2', 'FilterRenkonen', 'FilterMinReplicateNumber3', 'FilterIndel'],
+            help="with --fused, intermediate filter tables also written to the database",
+            required=False)
+
+        parser_vtam_filter.add_argument(
+            '--partition_workers',
+            dest='partition_workers',
+            action='store',
+            default=1,
+            type=int,
+            help="with --fused, number of worker processes running the run-marker partitions in parallel",
+            required=False)
+
+        parser_vtam_filter.add_argument(
+            '--incremental',
+            action='store_true',
+            help="if set, VTAM will only recompute the run-markers whose sorted reads or parameters changed since "
+                 "the last run. With --fused, this also applies to the filters from FilterLFN to "
+                 "FilterMinReplicateNumber3",
+            required=False,
+            default=False)
+
+        parser_vtam_filter.add_argument(
+            '--asvtable_format',
+            dest='asvtable_format',
+            action='store',
+            default='wide',
+            choices=['wide', 'long', 'parquet'],
+            help="format of the ASV table: 'wide' TSV with one column per sample, 'long' TSV with one row per "
+                 "variant and sample with reads, or 'parquet', the long format in a Parquet file (requires pyarrow). "
+                 "The wide TSV is always written to --asvtable, and the 'long' or 'parquet' table next to it, eg "
+                 "asvtable.long.tsv or asvtable.parquet",
+            required=False)
+
+        parser_vtam_filter.add_argument(
+            '--snapshot_filters',
+            action='store_true',
+            help="if set, VTAM will also write a columnar snapshot of each filter table next to the database, "
+                 "which the next filter reads instead of querying the table. The VariantReadCount table always "
+                 "has a snapshot",
+            required=False,
+            default=False)
+
         # This attribute will trigger the good command
         parser_vtam_filter.set_defaults(command='filter')
 
@@ -497,6 +555,14 @@ class ArgParser:
         'vtam taxonomy -o taxonomy.tsv' creates the 'taxonomy.tsv' file in the current directory""",
             required=True,
             type=ArgParserChecker.check_taxassign_taxonomy)
+        parser_vtam_taxassign.add_argument(
+            '--exact_match',
+            action='store_true',
+            help="if set, variants contained in reference sequences of the Blast database are assigned from these "
+                 "references without running Blast. The index of the reference sequences is built once next to the "
+                 "Blast database files",
+            required=False,
+            default=False)
 
         # This attribute will trigger the good command
         parser_vtam_taxassign.set_defaults(command='taxassign')
@@ -0,0 +1,276 @@
+import json
+import numpy
+import os
+import pandas
+import pathlib
+import shlex
+import shutil
+import subprocess
+import sys
+
+from vtam.utils.Logger import Logger
+from vtam.utils.RunnerBlast import RunnerBlast
+
+
+class BlastDbExactMatchIndex(object):
+    """Hashed index of the reference sequences of a BLAST DB, which finds the references that contain a variant
+    exactly without running Blast
+
+    The index is built once from the export of the BLAST DB and stored in the '<blast_db_name>.exact_match' directory
+    next to the DB files:
+
+    - reference.tsv: accession, tax_id and sequence of each reference, one per line
+    - reference_offset.npy: byte offset of each line of reference.tsv
+    - kmer_hash.npy, kmer_reference.npy, kmer_position.npy: 2-bit encoded k-mers of the references at every step-th
+      position, sorted by k-mer
+    - meta.json: k-mer length, step and fingerprint of the BLAST DB, written last
+
+    A variant of at least kmer_length + step - 1 nucleotides that is contained in a reference has one of its first
+    step k-mers at a sampled position of this reference. These k-mers give the candidate references, which are then
+    verified by comparing the sequences. Only the forward strand of the references is indexed, so the reverse
+    complement of each variant is looked up too, like Blast searches both strands.
+    """
+
+    kmer_length = 32
+    step = 32
+    # Number of references encoded at once when building the index
+    chunk_size = 100000
+    # Number of queries encoded at once when looking up the variants. Each query takes step k-mers of kmer_length
+    # uint64 codes, about 8 KB
+    query_chunk_size = 10000
+    complement_table = str.maketrans('ACGT', 'TGCA')
+
+    def __init__(self, blast_db_dir, blast_db_name):
+
+        self.blast_db_dir = blast_db_dir
+        self.blast_db_name = blast_db_name
+        self.index_dir = os.path.join(blast_db_dir, blast_db_name + '.exact_match')
+        self.meta_json = os.path.join(self.index_dir, 'meta.json')
+
+        # 2-bit code of each nucleotide, 255 for other characters
+        self.code_array = numpy.full(256, 255, dtype='uint8')
+        for code, nucleotide in enumerate('ACGT'):
+            self.code_array[ord(nucleotide)] = code
+        self.shift_array = numpy.arange(2 * (self.kmer_length - 1), -1, -2, dtype='uint64')
+
+    def get_meta_dic(self):
+
+        return {'kmer_length': self.kmer_length, 'step': self.step,
+                'blast_db_fingerprint': RunnerBlast.get_blast_db_fingerprint(self.blast_db_dir, self.blast_db_name)}
+
+    def is_up_to_date(self):
+        """Returns True if the index exists and was built with the current BLAST DB files"""
+
+        if not os.path.isfile(self.meta_json):
+            return False
+        with open(self.meta_json) as fin:
+            return json.load(fin) == self.get_meta_dic()
+
+    def get_kmer_hash(self, code_array, start_array):
+        """Returns the 2-bit encoded k-mers starting at start_array in code_array and a mask of the k-mers with
+        only A, C, G, T
+
+        :param code_array: numpy.ndarray of nucleotide codes of concatenated sequences
+        :param start_array: numpy.ndarray of k-mer starts
+        :return: tuple (kmer_hash_array, is_valid_array)
+        """
+
+        kmer_code_array = code_array[start_array[:, None] + numpy.arange(self.kmer_length)]
+        is_valid_array = (kmer_code_array != 255).all(axis=1)
+        kmer_hash_array = numpy.bitwise_or.reduce(
+            kmer_code_array.astype('uint64') << self.shift_array, axis=1) if kmer_code_array.shape[0] > 0 \
+            else numpy.zeros(0, dtype='uint64')
+        return kmer_hash_array, is_valid_array
+
+    def encode_sequences(self, sequence_list):
+        """Returns the nucleotide codes of the concatenated sequences and the start of each sequence"""
+
+        length_array = numpy.array([len(sequence) for sequence in sequence_list], dtype='int64')
+        code_array = self.code_array[numpy.frombuffer(''.join(sequence_list).encode(), dtype='uint8')]
+        start_array = numpy.concatenate([[0], numpy.cumsum(length_array)[:-1]]).astype('int64')
+        return code_array, start_array, length_array
+
+    def build(self, reference_tsv=None):
+        """Builds the index
+
+        :param reference_tsv: TSV export of the BLAST DB with accession, tax ID(s) and sequence. If None, the DB is
+            exported with blastdbcmd
+        :return: True if the index was built
+        """
+
+        Logger.instance().debug("Build exact match index of the BLAST DB in {}".format(self.index_dir))
+        try:
+            shutil.rmtree(self.index_dir, ignore_errors=True)
+            pathlib.Path(self.index_dir).mkdir(parents=True, exist_ok=True)
+
+            if reference_tsv is None:
+                reference_tsv = os.path.join(self.index_dir, 'blastdbcmd.tsv')
+                cmd = 'blastdbcmd -db {} -entry all -outfmt "%a\t%T\t%s" -out {}'.format(
+                    self.blast_db_name, reference_tsv)
+                if sys.platform.startswith("win"):
+                    args = cmd
+                else:
+                    args = shlex.split(cmd)
+                run_result = subprocess.run(args=args, cwd=self.blast_db_dir, env=dict(
+                    os.environ, BLASTDB=self.blast_db_dir))
+                if run_result.returncode != 0:
+                    Logger.instance().warning("The BLAST DB could not be exported with blastdbcmd: the exact match "
+                                              "index is not built")
+                    shutil.rmtree(self.index_dir, ignore_errors=True)
+                    return False
+
+            offset_list = []
+            kmer_hash_array_list = [numpy.zeros(0, dtype='uint64')]
+            kmer_reference_array_list = [numpy.zeros(0, dtype='uint32')]
+            kmer_position_array_list = [numpy.zeros(0, dtype='uint32')]
+            offset = 0
+            reference_i = 0
+            sequence_list = []
+            with open(reference_tsv) as fin, open(os.path.join(self.index_dir, 'reference.tsv'), 'w') as fout:
+                for line in fin:
+                    accession, tax_id, sequence = line.rstrip('\n').split('\t')
+                    reference_line = '{}\t{}\t{}\n'.format(accession, tax_id.split(';')[0], sequence.upper())
+                    fout.write(reference_line)
+                    offset_list.append(offset)
+                    offset += len(reference_line.encode())
+                    sequence_list.append(sequence.upper())
+                    if len(sequence_list) == self.chunk_size:
+                        self.append_kmers(sequence_list, reference_i, kmer_hash_array_list,
+                                          kmer_reference_array_list, kmer_position_array_list)
+                        reference_i += len(sequence_list)
+                        sequence_list = []
+            self.append_kmers(sequence_list, reference_i, kmer_hash_array_list, kmer_reference_array_list,
+                              kmer_position_array_list)
+            if os.path.join(self.index_dir, 'blastdbcmd.tsv') == reference_tsv:
+                os.remove(reference_tsv)
+
+            kmer_hash_array = numpy.concatenate(kmer_hash_array_list)
+            order_array = numpy.argsort(kmer_hash_array, kind='stable')
+            numpy.save(os.path.join(self.index_dir, 'reference_offset.npy'), numpy.array(offset_list, dtype='int64'))
+            numpy.save(os.path.join(self.index_dir, 'kmer_hash.npy'), kmer_hash_array[order_array])
+            numpy.save(os.path.join(self.index_dir, 'kmer_reference.npy'),
+                       numpy.concatenate(kmer_reference_array_list)[order_array])
+            numpy.save(os.path.join(self.index_dir, 'kmer_position.npy'),
+                       numpy.concatenate(kmer_position_array_list)[order_array])
+            with open(self.meta_json, 'w') as fout:
+                json.dump(self.get_meta_dic(), fout)
+        except OSError as os_error:
+            Logger.instance().warning("The exact match index could not be written in {}: {}".format(
+                self.index_dir, os_error))
+            shutil.rmtree(self.index_dir, ignore_errors=True)
+            return False
+        return True
+
+    def append_kmers(self, sequence_list, reference_i, kmer_hash_array_list, kmer_reference_array_list,
+                     kmer_position_array_list):
+        """Appends the k-mers at every step-th position of these references to the lists"""
+
+        if len(sequence_list) == 0:
+            return
+        code_array, start_array, length_array = self.encode_sequences(sequence_list)
+        kmer_count_array = numpy.maximum((length_array - self.kmer_length) // self.step + 1, 0)
+        kmer_reference_array = numpy.repeat(numpy.arange(len(sequence_list)), kmer_count_array)
+        kmer_first_array = numpy.concatenate([[0], numpy.cumsum(kmer_count_array)[:-1]]).astype('int64')
+        kmer_position_array = (numpy.arange(kmer_reference_array.shape[0])
+                               - kmer_first_array[kmer_reference_array]) * self.step
+        kmer_hash_array, is_valid_array = self.get_kmer_hash(
+            code_array, start_array[kmer_reference_array] + kmer_position_array)
+        kmer_hash_array_list.append(kmer_hash_array[is_valid_array])
+        kmer_reference_array_list.append((kmer_reference_array[is_valid_array] + reference_i).astype('uint32'))
+        kmer_position_array_list.append(kmer_position_array[is_valid_array].astype('uint32'))
+
+    def get_candidate_df(self, query_list, query_i, kmer_hash_index_array, kmer_reference_index_array,
+                         kmer_position_index_array):
+        """Returns the references and positions where the first step k-mers of these queries are found
+
+        :param query_list: list of query sequences
+        :param query_i: index of the first of these queries
+        :return: DataFrame with the columns variant (query index), reference and start
+        """
+
+        code_array, start_array, length_array = self.encode_sequences(query_list)
+        variant_array = numpy.repeat(numpy.arange(len(query_list)), self.step)
+        kmer_offset_array = numpy.tile(numpy.arange(self.step), len(query_list))
+        kmer_hash_array, is_valid_array = self.get_kmer_hash(
+            code_array, start_array[variant_array] + kmer_offset_array)
+        variant_array = variant_array[is_valid_array]
+        kmer_offset_array = kmer_offset_array[is_valid_array]
+        kmer_hash_array = kmer_hash_array[is_valid_array]
+
+        left_array = numpy.searchsorted(kmer_hash_index_array, kmer_hash_array, side='left')
+        match_count_array = numpy.searchsorted(kmer_hash_index_array, kmer_hash_array, side='right') - left_array
+        match_first_array = numpy.concatenate([[0], numpy.cumsum(match_count_array)[:-1]]).astype('int64')
+        kmer_index_array = numpy.repeat(left_array, match_count_array) + numpy.arange(match_count_array.sum()) \
+            - numpy.repeat(match_first_array, match_count_array)
+        candidate_df = pandas.DataFrame({
+            'variant': numpy.repeat(variant_array, match_count_array) + query_i,
+            'reference': kmer_reference_index_array[kmer_index_array].astype('int64'),
+            'start': kmer_position_index_array[kmer_index_array].astype('int64')
+            - numpy.repeat(kmer_offset_array, match_count_array)})
+        return candidate_df.loc[candidate_df.start >= 0]
+
+    def get_hit_df(self, sequence_list):
+        """Returns the references that contain the variant sequences or their reverse complements as hits with 100%
+        identity and coverage
+
+        :param sequence_list: list of variant sequences
+        :return: DataFrame with the columns of RunnerBlast.read_blast_result, one row per variant and reference
+        """
+
+        hit_list = []
+        sequence_list = [sequence for sequence in dict.fromkeys(sequence_list)
+                         if len(sequence) >= self.kmer_length + self.step - 1]
+        # Both strands of each variant are looked up: query query_i is variant query_i % len(sequence_list)
+        query_list = sequence_list + [sequence.translate(self.complement_table)[::-1] for sequence in sequence_list]
+        if len(sequence_list) > 0:
+
+            ########################################################################################
+            #
+            # Candidate references and positions from the first step k-mers of each variant
+            #
+            ########################################################################################
+
+            kmer_hash_index_array = numpy.load(os.path.join(self.index_dir, 'kmer_hash.npy'), mmap_mode='r')
+            kmer_reference_index_array = numpy.load(os.path.join(self.index_dir, 'kmer_reference.npy'), mmap_mode='r')
+            kmer_position_index_array = numpy.load(os.path.join(self.index_dir, 'kmer_position.npy'), mmap_mode='r')
+
+            # The queries are encoded by chunk to bound the memory of their k-mers
+            candidate_df_list = []
+            for query_i in range(0, len(query_list), self.query_chunk_size):
+                candidate_df_list.append(self.get_candidate_df(
+                    query_list[query_i:query_i + self.query_chunk_size], query_i, kmer_hash_index_array,
+                    kmer_reference_index_array, kmer_position_index_array))
+            candidate_df = pandas.concat(candidate_df_list, axis=0).drop_duplicates()\
+                .sort_values(['reference', 'variant', 'start'])
+
+            ########################################################################################
+            #
+            # Verify the candidates with the reference sequences
+            #
+            ########################################################################################
+
+            reference_offset_array = numpy.load(os.path.join(self.index_dir, 'reference_offset.npy'), mmap_mode='r')
+            with open(os.path.join(self.index_dir, 'reference.tsv'), 'rb') as fin:
+                for reference_i, reference_candidate_df in candidate_df.groupby('reference', sort=False):
+                    fin.seek(int(reference_offset_array[reference_i]))
+                    accession, tax_id, reference_sequence = fin.readline().decode().rstrip('\n').split('\t')
+                    variant_i_set = set()  # One hit per variant and reference, whatever the strand
+                    for query_i, start in zip(reference_candidate_df.variant.tolist(),
+                                              reference_candidate_df.start.tolist()):
+                        variant_i = query_i % len(sequence_list)
+                        query_sequence = query_list[query_i]
+                        if variant_i not in variant_i_set \
+                                and reference_sequence[start:start + len(query_sequence)] == query_sequence:
+                            variant_i_set.add(variant_i)
+                            hit_list.append((variant_i, sequence_list[variant_i], accession, tax_id))
+
+        hit_df = pandas.DataFrame(hit_list, columns=['variant', 'variant_id', 'target_id', 'target_tax_id'])
+        hit_df = hit_df.sort_values(['variant'], kind='stable').drop('variant', axis=1).reset_index(drop=True)
+        hit_df['identity'] = 100.0
+        hit_df['evalue'] = 0.0
+        hit_df['coverage'] = 100
+        # Remove references without tax ID, which are 'N/A' or 0
+        hit_df['target_tax_id'] = pandas.to_numeric(hit_df.target_tax_id, errors='coerce').fillna(0).astype('int')
+        hit_df = hit_df.loc[hit_df.target_tax_id != 0]
+        return hit_df[['variant_id', 'target_id', 'identity', 'evalue', 'coverage', 'target_tax_id']]\
+            .reset_index(drop=True)
@@ -1,7 +1,10 @@
+import pandas
 import sys
 
+from vtam.utils.FileVariantReadCountSnapshot import FileVariantReadCountSnapshot
 from vtam.utils.Logger import Logger
 from vtam.utils.VTAMexception import VTAMexception
+from vtam.utils.VariantReadCountFrame import VariantReadCountFrame
 
 
 class DataframeVariantReadCountLike(object):
@@ -10,8 +13,19 @@ class DataframeVariantReadCountLike(object):
     the different LFN calculation, that is N_i, N_ik, ...
 
     N_ijk stands for the read count for each variant_id i, sample_id j and replicate k
+
+    The N aggregates are computed once per variant_read_count_df and cached until variant_read_count_df is replaced.
+    Call clear_cache after modifying variant_read_count_df in place.
     """
 
+    # Columns over which N_ijk is aggregated for each N
+    N_column_list_dic = {
+        'N_i': ['run_id', 'marker_id', 'variant_id'],
+        'N_ij': ['run_id', 'marker_id', 'variant_id', 'sample_id'],
+        'N_ik': ['run_id', 'marker_id', 'variant_id', 'replicate'],
+        'N_jk': ['run_id', 'marker_id', 'sample_id', 'replicate'],
+    }
+
     def __init__(self, variant_read_count_df):
         """
 
@@ -39,6 +53,22 @@ class DataframeVariantReadCountLike(object):
 
         self.variant_read_count_df = variant_read_count_df
 
+    @property
+    def variant_read_count_df(self):
+        return self._variant_read_count_df
+
+    @variant_read_count_df.setter
+    def variant_read_count_df(self, variant_read_count_df):
+        self._variant_read_count_df = variant_read_count_df
+        self.clear_cache()
+
+    def clear_cache(self):
+        """Forgets the N aggregates computed for the current variant_read_count_df"""
+
+        self.variant_read_count_frame = None
+        self.N_df_dic = {}
+        self.N_array_dic = {}
+
     def filter_out_below_global_read_count_cutoff(
             self, global_read_count_cutoff):
         """ Returns variants with read_count across all samples with read_count above global_read_count_cutoff
@@ -55,18 +85,71 @@ class DataframeVariantReadCountLike(object):
         # nijk_df.drop_duplicates(inplace=True)
         return variant_read_count_df
 
+    def get_filter_delete_df(self, delete_key_df):
+        """Returns a copy of variant_read_count_df with a 'filter_delete' column. Rows whose keys are found in
+        delete_key_df are set to True in one single pass.
+
+        :param delete_key_df: DataFrame with the keys of the rows to delete. Its columns must be a subset of
+            run_id, marker_id, sample_id, replicate, variant_id
+        :return: DataFrame: variant_read_count_df with filter_delete column
+        """
+
+        key_column_list = [
+            col for col in self.column_list[:-1] if col in delete_key_df.columns]
+
+        filter_delete_df = self.variant_read_count_df.copy()
+        if delete_key_df.shape[0] == 0:
+            filter_delete_df['filter_delete'] = False
+            return filter_delete_df
+
+        variant_read_count_index = pandas.MultiIndex.from_frame(
+            filter_delete_df[key_column_list])
+        delete_index = pandas.MultiIndex.from_frame(
+            delete_key_df[key_column_list].drop_duplicates())
+        filter_delete_df['filter_delete'] = variant_read_count_index.isin(
+            delete_index)
+
+        return filter_delete_df
+
+    def get_variant_read_count_frame(self):
+        """Returns the integer-coded VariantReadCountFrame of variant_read_count_df used for the N aggregations"""
+
+        if self.variant_read_count_frame is None:
+            self.variant_read_count_frame = VariantReadCountFrame(self.variant_read_count_df)
+        return self.variant_read_count_frame
+
+    def get_N_df(self, N_name):
+        """Returns a copy of the cached N_name aggregate, that is a DataFrame with the columns of
+        N_column_list_dic[N_name] and N_name, sorted by these columns
+
+        :param N_name: one of N_i, N_ij, N_ik, N_jk
+        """
+
+        if N_name not in self.N_df_dic:
+            self.N_df_dic[N_name] = self.get_variant_read_count_frame().aggregate_read_count(
+                column_list=self.N_column_list_dic[N_name], aggregate_name=N_name)
+        return self.N_df_dic[N_name].copy()
+
+    def get_N_column(self, N_name):
+        """Returns the cached N_name aggregate of each row of variant_read_count_df, like a groupby transform. It
+        can be assigned as a column without merging with the output of get_N_df
+
+        :param N_name: one of N_i, N_ij, N_ik, N_jk
+        :return: numpy.ndarray of int64 aligned with the rows of variant_read_count_df
+        """
+
+        if N_name not in self.N_array_dic:
+            self.N_array_dic[N_name] = self.get_variant_read_count_frame().transform_read_count(
+                column_list=self.N_column_list_dic[N_name])
+        return self.N_array_dic[N_name]
+
     def get_N_i_df(self):
-        """Returns N_i_df, that is a DataFrame with columns run_id, marker_id, sample_id, N_ijk
+        """Returns N_i_df, that is a DataFrame with columns run_id, marker_id, variant_id, N_i
         N_i = sum aggregation of N_ijk over variants i
 
         """
 
-        N_i_df = self.variant_read_count_df.groupby(
-            by=['run_id', 'marker_id', 'variant_id']).agg({'read_count': sum}) .reset_index()
-        N_i_df = N_i_df.rename(columns={'read_count': 'N_i'})
-        N_i_df.drop_duplicates(inplace=True)
-
-        return N_i_df
+        return self.get_N_df('N_i')
 
     def get_N_ij_df(self):
         """Returns N_ij_df, that is a DataFrame with columns run_id, marker_id, variant_id, sample_id, N_ij
@@ -74,38 +157,23 @@ class DataframeVariantReadCountLike(object):
 
         """
 
-        N_ij_df = self.variant_read_count_df.groupby(
-            by=['run_id', 'marker_id', 'variant_id', 'sample_id']).agg({'read_count': sum}) .reset_index()
-        N_ij_df = N_ij_df.rename(columns={'read_count': 'N_ij'})
-        N_ij_df.drop_duplicates(inplace=True)
-
-        return N_ij_df
+        return self.get_N_df('N_ij')
 
     def get_N_ik_df(self):
-        """Returns N_ik_df, that is a DataFrame with columns run_id, marker_id, sample_id, N_ijk
+        """Returns N_ik_df, that is a DataFrame with columns run_id, marker_id, variant_id, replicate, N_ik
         N_k = sum aggregation of N_ijk over variants i and replicate k
 
         """
 
-        N_ik_df = self.variant_read_count_df.groupby(
-            by=['run_id', 'marker_id', 'variant_id', 'replicate']).agg({'read_count': sum}) .reset_index()
-        N_ik_df = N_ik_df.rename(columns={'read_count': 'N_ik'})
-        N_ik_df.drop_duplicates(inplace=True)
-
-        return N_ik_df
+        return self.get_N_df('N_ik')
 
     def get_N_jk_df(self):
-        """Returns N_i_df, that is a DataFrame with columns run_id, marker_id, sample_id, N_ijk
+        """Returns N_jk_df, that is a DataFrame with columns run_id, marker_id, sample_id, replicate, N_jk
         N_kj = sum aggregation of N_ijk over sample j and replicate k
 
         """
 
-        N_jk_df = self.variant_read_count_df.groupby(
-            by=['run_id', 'marker_id', 'sample_id', 'replicate']).agg({'read_count': sum}) .reset_index()
-        N_jk_df = N_jk_df.rename(columns={'read_count': 'N_jk'})
-        N_jk_df.drop_duplicates(inplace=True)
-
-        return N_jk_df
+        return self.get_N_df('N_jk')
 
     def to_sql(self, engine, variant_read_count_like_model):
         """Convert DF to list of dictionaries to use in an sqlalchemy core insert"""
@@ -140,3 +208,5 @@ class DataframeVariantReadCountLike(object):
             conn.execute(
                 variant_read_count_like_model.__table__.insert(),
                 record_list)
+        FileVariantReadCountSnapshot.write_if_enabled(
+            engine=engine, variant_read_count_like_model=variant_read_count_like_model)
@@ -5,6 +5,7 @@ import sys
 import pandas
 import sqlalchemy
 
+from vtam.utils.FileVariantReadCountSnapshot import FileVariantReadCountSnapshot
 from vtam.utils.Logger import Logger
 from vtam.utils.VTAMexception import VTAMexception
 
@@ -29,6 +30,8 @@ class FileSampleInformation:
         sample_record_list = sample_information_df.to_dict('records')
         sample_column_list = sample_information_df.columns.tolist()
 
+        FileVariantReadCountSnapshot(
+            engine=engine, variant_read_count_like_model=variant_read_count_like_model).invalidate()
         with engine.connect() as conn:
             stmt = variant_read_count_like_model.__table__.delete()
             stmt = stmt.where(
@@ -57,11 +60,58 @@ class FileSampleInformation:
         """
 
         variant_read_count_like_table = variant_read_count_like_model.__table__
+        sample_info_ids_df = self.to_identifier_df(engine=engine)
+
+        variant_read_count_df = self.get_nijk_df_from_snapshot(
+            variant_read_count_like_model=variant_read_count_like_model, engine=engine,
+            sample_info_ids_df=sample_info_ids_df, filter_id=filter_id)
+        if variant_read_count_df is None:
+            variant_read_count_df = self.get_nijk_df_from_sql(
+                variant_read_count_like_table=variant_read_count_like_table, engine=engine,
+                sample_info_ids_df=sample_info_ids_df, filter_id=filter_id)
+
+        # Exit if no variants for analysis
+        try:
+            assert variant_read_count_df.shape[0] > 0
+        except AssertionError:
+            Logger.instance().warning(
+                VTAMexception(
+                    "No variants available after this filter. "
+                    "The pipeline will stop here.".format(
+                        self.__class__.__name__)))
+            sys.exit(0)
+        return variant_read_count_df
+
+    @staticmethod
+    def get_nijk_df_from_snapshot(variant_read_count_like_model, engine, sample_info_ids_df, filter_id=None):
+        """Returns the variant_read_count_input_df from the columnar snapshot of the table or None if there is no
+        up-to-date snapshot. Rows come in the same order as get_nijk_df_from_sql"""
+
+        nijk_snapshot_df = FileVariantReadCountSnapshot(
+            engine=engine, variant_read_count_like_model=variant_read_count_like_model).read()
+        if nijk_snapshot_df is None:
+            return None
+
+        if 'filter_delete' in nijk_snapshot_df.columns:
+            nijk_snapshot_df = nijk_snapshot_df.loc[nijk_snapshot_df.filter_delete == 0]
+        if filter_id is not None:
+            nijk_snapshot_df = nijk_snapshot_df.loc[nijk_snapshot_df.filter_id == filter_id]
+
+        key_column_list = ['run_id', 'marker_id', 'sample_id', 'replicate']
+        variant_read_count_df = sample_info_ids_df[key_column_list].astype('int64').merge(
+            nijk_snapshot_df[FileVariantReadCountSnapshot.key_column_list], on=key_column_list, how='inner')\
+            .astype('int64')
+        Logger.instance().debug(
+            "Read {} from its snapshot".format(variant_read_count_like_model.__tablename__))
+        return variant_read_count_df.drop_duplicates().reset_index(drop=True)
+
+    @staticmethod
+    def get_nijk_df_from_sql(variant_read_count_like_table, engine, sample_info_ids_df, filter_id=None):
+        """Returns the variant_read_count_input_df with one query per sample replicate"""
 
         variant_read_count_list = []
         # for sample_instance in self.get_fasta_information_record_list():
-        for sample_instance_row in self.to_identifier_df(
-                engine=engine).itertuples():
+        for sample_instance_row in sample_info_ids_df.itertuples():
             run_id = sample_instance_row.run_id
             marker_id = sample_instance_row.marker_id
             sample_id = sample_instance_row.sample_id
@@ -101,17 +151,6 @@ class FileSampleInformation:
                 'replicate',
                 'variant_id',
                 'read_count'])
-
-        # Exit if no variants for analysis
-        try:
-            assert variant_read_count_df.shape[0] > 0
-        except AssertionError:
-            Logger.instance().warning(
-                VTAMexception(
-                    "No variants available after this filter. "
-                    "The pipeline will stop here.".format(
-                        self.__class__.__name__)))
-            sys.exit(0)
         return variant_read_count_df
 
     def to_identifier_df(self, engine):
@@ -0,0 +1,116 @@
+import json
+import numpy
+import os
+import pandas
+import shutil
+import sqlalchemy
+
+from vtam.utils.Logger import Logger
+
+
+class FileVariantReadCountSnapshot(object):
+    """Columnar snapshot of a variant_read_count like table next to the SQLite DB
+
+    Each column is written as one int32 .npy file in <db>.nijk/<table name>/, which is memory-mapped when read.
+    A snapshot is only used if the row count and maximal id of the table are the same as when it was written.
+
+    This state does not detect a table emptied and refilled with the same number of rows, because SQLite then
+    reuses the same ids. Snapshots are therefore only valid if every writer of the table calls invalidate() before
+    deleting rows and write() after inserting them, like ModelVariantReadCountLike and FileSampleInformation do.
+    """
+
+    key_column_list = ['run_id', 'marker_id', 'sample_id', 'replicate', 'variant_id', 'read_count']
+    column_list = key_column_list + ['filter_id', 'filter_delete']
+
+    def __init__(self, engine, variant_read_count_like_model):
+        """
+        :param engine: sqlalchemy engine. Snapshots are disabled for in-memory databases
+        :param variant_read_count_like_model: SQLalchemy model with at least run_id, marker_id, sample_id,
+            replicate, variant_id, read_count columns
+        """
+
+        self.engine = engine
+        self.variant_read_count_like_model = variant_read_count_like_model
+
+        self.snapshot_dir = None
+        db_path = engine.url.database
+        if engine.url.get_backend_name() == 'sqlite' and not (db_path in [None, '', ':memory:']):
+            self.snapshot_dir = os.path.join(
+                os.path.abspath(db_path) + '.nijk', variant_read_count_like_model.__tablename__)
+        self.meta_path = None if self.snapshot_dir is None else os.path.join(self.snapshot_dir, 'meta.json')
+
+    @classmethod
+    def write_if_enabled(cls, engine, variant_read_count_like_model):
+        """Writes the snapshot of a filter table if 'vtam filter --snapshot_filters' is set"""
+
+        if os.getenv('VTAM_SNAPSHOT_FILTERS') == '1':
+            cls(engine=engine, variant_read_count_like_model=variant_read_count_like_model).write()
+
+    def get_table_state(self):
+        """Returns the row count and maximal id of the table, that identify the version of a snapshot"""
+
+        variant_read_count_like_table = self.variant_read_count_like_model.__table__
+        stmt = sqlalchemy.select([
+            sqlalchemy.func.count(variant_read_count_like_table.c.id),
+            sqlalchemy.func.max(variant_read_count_like_table.c.id)])
+        with self.engine.connect() as conn:
+            row_count, id_max = conn.execute(stmt).first()
+        return {'row_count': row_count, 'id_max': id_max}
+
+    def write(self):
+        """Fetches the whole table in one query and writes one .npy file per column"""
+
+        if self.snapshot_dir is None:
+            return
+
+        variant_read_count_like_table = self.variant_read_count_like_model.__table__
+        # Eg ReadCountAverageOverReplicates without replicate column is not read as nijk table
+        if not set(self.key_column_list) <= set(variant_read_count_like_table.c.keys()):
+            return
+        column_list = [column for column in self.column_list if column in variant_read_count_like_table.c]
+
+        self.invalidate()
+        table_state_dic = self.get_table_state()
+        with self.engine.connect() as conn:
+            record_list = conn.execute(sqlalchemy.select(
+                [variant_read_count_like_table.c[column] for column in column_list])).fetchall()
+
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        column_array_list = numpy.array(record_list, dtype='int32').reshape(len(record_list), len(column_list)).T
+        for column, column_array in zip(column_list, column_array_list):
+            numpy.save(os.path.join(self.snapshot_dir, '{}.npy'.format(column)),
+                       numpy.ascontiguousarray(column_array))
+
+        # Written last: a snapshot without meta.json is not valid
+        table_state_dic['column_list'] = column_list
+        with open(self.meta_path, 'w') as fout:
+            json.dump(table_state_dic, fout)
+        Logger.instance().debug(
+            "Snapshot of {}: {} rows in {}".format(
+                self.variant_read_count_like_model.__tablename__, len(record_list), self.snapshot_dir))
+
+    def invalidate(self):
+        """Removes the snapshot, eg after rows were deleted from the table"""
+
+        if self.snapshot_dir is None:
+            return
+        if os.path.isfile(self.meta_path):
+            os.remove(self.meta_path)  # First, so that an interrupted removal leaves no valid snapshot
+        shutil.rmtree(self.snapshot_dir, ignore_errors=True)
+
+    def read(self):
+        """Returns the table as DataFrame with the memory-mapped int32 column files as columns, without copy, or None
+        if there is no snapshot or it is out of date. Callers upcast the rows that they keep"""
+
+        if self.snapshot_dir is None or not os.path.isfile(self.meta_path):
+            return None
+
+        with open(self.meta_path) as fin:
+            meta_dic = json.load(fin)
+        table_state_dic = self.get_table_state()
+        if meta_dic['row_count'] != table_state_dic['row_count'] or meta_dic['id_max'] != table_state_dic['id_max']:
+            return None
+
+        return pandas.DataFrame({column: numpy.load(
+            os.path.join(self.snapshot_dir, '{}.npy'.format(column)), mmap_mode='r')
+            for column in meta_dic['column_list']}, columns=meta_dic['column_list'], copy=False)
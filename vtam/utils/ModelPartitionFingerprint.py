@@ -0,0 +1,92 @@
+import hashlib
+import pandas
+import sqlalchemy
+
+from vtam.models.PartitionFingerprint import PartitionFingerprint
+
+
+class ModelPartitionFingerprint(object):
+    """Reads and writes the input fingerprints of the run-marker partitions of one step in the PartitionFingerprint
+    table. A step only recomputes the run-markers whose fingerprint changed since the last run."""
+
+    def __init__(self, engine, step):
+        """
+        :param engine: sqlalchemy engine
+        :param step: step name, eg VariantReadCount
+        """
+
+        self.engine = engine
+        self.step = step
+        PartitionFingerprint.__table__.create(bind=self.engine, checkfirst=True)
+
+    def get_fingerprint_dic(self):
+        """Returns the dictionary (run_id, marker_id): fingerprint of the last run of this step"""
+
+        partition_fingerprint_table = PartitionFingerprint.__table__
+        stmt = sqlalchemy.select([
+            partition_fingerprint_table.c.run_id,
+            partition_fingerprint_table.c.marker_id,
+            partition_fingerprint_table.c.fingerprint]).where(partition_fingerprint_table.c.step == self.step)
+        with self.engine.connect() as conn:
+            return {(row[0], row[1]): row[2] for row in conn.execute(stmt).fetchall()}
+
+    def get_changed_run_marker_set(self, fingerprint_dic):
+        """Returns the set of (run_id, marker_id) of fingerprint_dic whose fingerprint is new or changed"""
+
+        fingerprint_previous_dic = self.get_fingerprint_dic()
+        return {run_marker for run_marker, fingerprint in fingerprint_dic.items()
+                if fingerprint_previous_dic.get(run_marker, None) != fingerprint}
+
+    def update(self, fingerprint_dic):
+        """Replaces the fingerprints of these run-markers
+
+        :param fingerprint_dic: dictionary (run_id, marker_id): fingerprint
+        """
+
+        if len(fingerprint_dic) == 0:
+            return
+
+        record_list = [{'step': self.step, 'run_id': int(run_id), 'marker_id': int(marker_id),
+                        'fingerprint': fingerprint} for (run_id, marker_id), fingerprint in fingerprint_dic.items()]
+        partition_fingerprint_table = PartitionFingerprint.__table__
+        with self.engine.connect() as conn:
+            stmt = partition_fingerprint_table.delete()\
+                .where(partition_fingerprint_table.c.step == sqlalchemy.bindparam('step'))\
+                .where(partition_fingerprint_table.c.run_id == sqlalchemy.bindparam('run_id'))\
+                .where(partition_fingerprint_table.c.marker_id == sqlalchemy.bindparam('marker_id'))
+            conn.execute(stmt, [{k: record[k] for k in ['step', 'run_id', 'marker_id']} for record in record_list])
+            conn.execute(partition_fingerprint_table.insert(), record_list)
+
+    def delete(self, run_marker_list=None):
+        """Deletes the fingerprints of these run-markers, or all the fingerprints of this step if None. Steps
+        computed without fingerprints call it so that a later incremental run does not reuse their rows."""
+
+        partition_fingerprint_table = PartitionFingerprint.__table__
+        with self.engine.connect() as conn:
+            stmt = partition_fingerprint_table.delete().where(partition_fingerprint_table.c.step == self.step)
+            if run_marker_list is None:
+                conn.execute(stmt)
+            elif len(run_marker_list) > 0:
+                stmt = stmt.where(partition_fingerprint_table.c.run_id == sqlalchemy.bindparam('run_id_'))\
+                    .where(partition_fingerprint_table.c.marker_id == sqlalchemy.bindparam('marker_id_'))
+                conn.execute(stmt, [{'run_id_': int(run_id), 'marker_id_': int(marker_id)}
+                                    for run_id, marker_id in run_marker_list])
+
+    @staticmethod
+    def get_df_fingerprint(df, *extra_list):
+        """Returns the sha256 hex digest of the DataFrame rows, independently of the row order, and of the
+        string representations of extra_list
+
+        :param df: DataFrame
+        :param extra_list: other inputs, eg parameter values
+        :return: str
+        """
+
+        fingerprint = hashlib.sha256()
+        if df.shape[0] > 0:
+            df = df[sorted(df.columns)].sort_values(by=sorted(df.columns))
+            fingerprint.update(pandas.util.hash_pandas_object(df, index=False).values.tobytes())
+        fingerprint.update(repr(sorted(df.columns)).encode())
+        for extra in extra_list:
+            fingerprint.update(repr(extra).encode())
+        return fingerprint.hexdigest()
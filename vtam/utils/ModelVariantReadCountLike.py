@@ -1,6 +1,8 @@
 import pandas
 import sqlalchemy
 
+from vtam.utils.FileVariantReadCountSnapshot import FileVariantReadCountSnapshot
+
 
 class ModelVariantReadCountLike(object):
     """Takes a any type of VariantReadCount models/table with at least run_id, marker_id, sample_id, replicate, variant_id
@@ -18,6 +20,8 @@ class ModelVariantReadCountLike(object):
         sample_column_list = pandas.DataFrame(
             sample_record_list).columns.tolist()
 
+        FileVariantReadCountSnapshot(
+            engine=self.engine, variant_read_count_like_model=self.variant_read_count_like_model).invalidate()
         with self.engine.connect() as conn:
             stmt = self.variant_read_count_like_model.__table__.delete()
             stmt = stmt.where(
@@ -41,26 +45,10 @@ class ModelVariantReadCountLike(object):
 
     @staticmethod
     def filter_delete_df_to_dict(filter_df):
-        """Convert DF to list of dictionaries to use in an sqlalchemy core insert"""
-        records = []
-        for row in filter_df.itertuples():
-            run_id = row.run_id
-            marker_id = row.marker_id
-            sample_id = row.sample_id
-            variant_id = row.variant_id
-            read_count = row.read_count
-            instance = {'run_id': run_id, 'marker_id': marker_id,
-                                                         'variant_id': variant_id, 'sample_id': sample_id,
-                                                         'read_count': read_count}
-            if 'filter_delete' in dir(row):
-                instance['filter_delete'] = row.filter_delete
-            if 'filter_id' in dir(row):
-                instance['filter_id'] = row.filter_id
-            if 'replicate' in dir(row):
-                instance['replicate'] = row.replicate
-            if 'replicate_count' in dir(row):
-                instance['replicate_count'] = row.replicate_count
-            if 'read_count_average' in dir(row):
-                instance['read_count_average'] = row.read_count_average
-            records.append(instance)
-        return records
+        """Convert DF to list of dictionaries to use in an sqlalchemy core insert
+
+        The columns are converted in bulk: to_dict returns python ints and floats, as needed by the sqlite driver"""
+
+        column_list = ['run_id', 'marker_id', 'variant_id', 'sample_id', 'read_count', 'filter_delete', 'filter_id',
+                       'replicate', 'replicate_count', 'read_count_average']
+        return filter_df[[column for column in column_list if column in filter_df.columns]].to_dict('records')
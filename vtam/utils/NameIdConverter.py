@@ -1,14 +1,27 @@
 import sys
+import weakref
 
 import sqlalchemy
 
 from vtam.models.FilterChimeraBorderline import FilterChimeraBorderline
+from vtam.models.Marker import Marker
+from vtam.models.Run import Run
+from vtam.models.Sample import Sample
 from vtam.models.Variant import Variant
 from vtam.utils.Logger import Logger
 
 
 class NameIdConverter:
-    """Takes a list of names or IDs and returns the complementeary"""
+    """Takes a list of names or IDs and returns the complementeary
+
+    Each distinct name or ID is looked up once with IN queries and the values are mapped back to the input list.
+    The maps of the small Run, Marker and Sample tables are cached for each engine during the whole process."""
+
+    # Maximal number of values in one IN clause, below the SQLite limit of host parameters
+    in_clause_size = 900
+    cached_model_list = [Run, Marker, Sample]
+    # engine: {(table name, key column, value column): {key: value}}
+    engine_cache_dic = weakref.WeakKeyDictionary()
 
     def __init__(self, id_name_or_sequence_list, engine):
 
@@ -17,70 +30,73 @@ class NameIdConverter:
 
     def to_ids(self, declarative_model):
 
-        id_lst = []
-        with self.engine.connect() as conn:
-            for name in self.id_name_or_sequence_list:
-                result = conn.execute(
-                    sqlalchemy.select([declarative_model.__table__.c.id]).where(
-                        declarative_model.__table__.c.name == name)).first()
-                if result is None:
-                    Logger.instance().error("Name {} not found in table {}".format(name, str(declarative_model.__table__)))
-                    sys.exit(1)
-                id_lst.append(result[0])
-        return id_lst
+        return self.convert(
+            key_column=declarative_model.__table__.c.name, value_column=declarative_model.__table__.c.id,
+            not_found_message="Name {} not found in table " + str(declarative_model.__table__),
+            is_cached=declarative_model in self.cached_model_list)
 
     def to_names(self, declarative_model):
 
-        nameid_lst = []
-        with self.engine.connect() as conn:
-            for idx in self.id_name_or_sequence_list:
-                result = conn.execute(
-                    sqlalchemy.select([declarative_model.__table__.c.name]).where(
-                        declarative_model.__table__.c.id == idx)).first()
-                if result is None:
-                    Logger.instance().error("Id {} not found in table {}".format(idx, str(declarative_model.__table__)))
-                    sys.exit(1)
-                nameid_lst.append(result[0])
-        return nameid_lst
+        return self.convert(
+            key_column=declarative_model.__table__.c.id, value_column=declarative_model.__table__.c.name,
+            not_found_message="Id {} not found in table " + str(declarative_model.__table__),
+            is_cached=declarative_model in self.cached_model_list)
 
     def variant_id_to_sequence(self):
 
-        sequence_lst = []
-        with self.engine.connect() as conn:
-            for variant_id in self.id_name_or_sequence_list:
-                result = conn.execute(
-                    sqlalchemy.select([Variant.__table__.c.sequence]).where(
-                        Variant.__table__.c.id == variant_id)).first()
-                if result is None:
-                    Logger.instance().error("Variant ID {} not found in table {}".format(variant_id, str(Variant.__table__)))
-                    sys.exit(1)
-                sequence_lst.append(result[0])
-        return sequence_lst
+        return self.convert(
+            key_column=Variant.__table__.c.id, value_column=Variant.__table__.c.sequence,
+            not_found_message="Variant ID {} not found in table " + str(Variant.__table__))
 
     def variant_sequence_to_id(self):
 
-        variant_id_lst = []
-        with self.engine.connect() as conn:
-            for sequence in self.id_name_or_sequence_list:
-                result = conn.execute(
-                    sqlalchemy.select([Variant.__table__.c.id]).where(
-                        Variant.__table__.c.sequence == sequence)).first()
-                if result is None:
-                    Logger.instance().error("Sequence {} not found in table {}".format(sequence, str(Variant.__table__)))
-                    sys.exit(1)
-                variant_id_lst.append(result[0])
-        return variant_id_lst
+        return self.convert(
+            key_column=Variant.__table__.c.sequence, value_column=Variant.__table__.c.id,
+            not_found_message="Sequence {} not found in table " + str(Variant.__table__))
 
     def variant_id_is_chimera_borderline(self):
 
-        chimera_borderline_lst = []
+        return self.convert(
+            key_column=FilterChimeraBorderline.__table__.c.variant_id,
+            value_column=FilterChimeraBorderline.__table__.c.filter_delete,
+            not_found_message="Variant ID {} not found in table FilterChimeraBorderline")
+
+    def convert(self, key_column, value_column, not_found_message, is_cached=False):
+        """Returns the values of value_column for id_name_or_sequence_list in key_column. If a key has several rows,
+        the value of the first row returned is kept, like with one query per key.
+
+        :param key_column: sqlalchemy column of the keys, eg Run.__table__.c.name
+        :param value_column: sqlalchemy column of the values, eg Run.__table__.c.id
+        :param not_found_message: error message with a placeholder for the missing key
+        :param is_cached: if True, the map is kept for the other converters with the same engine
+        :return: list
+        """
+
+        # Keys with the python type of the column, eg numpy integers to int or numerical run names to str, as SQLite
+        # would compare them
+        python_type = key_column.type.python_type
+        key_list = []
+        for key in self.id_name_or_sequence_list:
+            try:
+                key_list.append(python_type(key))
+            except (TypeError, ValueError):
+                key_list.append(key)
+
+        value_dic = {}
+        if is_cached:
+            value_dic = NameIdConverter.engine_cache_dic.setdefault(self.engine, {}).setdefault(
+                (key_column.table.name, key_column.key, value_column.key), {})
+
+        missing_key_list = [key for key in dict.fromkeys(key_list) if key not in value_dic]
         with self.engine.connect() as conn:
-            for variant_id in self.id_name_or_sequence_list:
-                result = conn.execute(
-                    sqlalchemy.select([FilterChimeraBorderline.__table__.c.filter_delete]).where(
-                        FilterChimeraBorderline.__table__.c.variant_id == variant_id).distinct()).first()
-                if result is None:
-                    Logger.instance().error("Variant ID {} not found in table FilterChimeraBorderline".format(variant_id))
-                    sys.exit(1)
-                chimera_borderline_lst.append(result[0])
-        return chimera_borderline_lst
+            for i in range(0, len(missing_key_list), self.in_clause_size):
+                stmt = sqlalchemy.select([key_column, value_column])\
+                    .where(key_column.in_(missing_key_list[i:i + self.in_clause_size]))
+                for key, value in conn.execute(stmt).fetchall():
+                    value_dic.setdefault(key, value)
+
+        try:
+            return [value_dic[key] for key in key_list]
+        except KeyError as key_error:
+            Logger.instance().error(not_found_message.format(key_error.args[0]))
+            sys.exit(1)
@@ -1,35 +1,118 @@
+import numpy
+import os
+import pandas
+import sys
+
 from vtam.models.Sample import Sample
 from vtam.models.Marker import Marker
 from vtam.models.Run import Run
+from vtam.utils.Logger import Logger
 from vtam.utils.NameIdConverter import NameIdConverter
 from vtam.utils.SequenceClusterer import SequenceClusterer
 from vtam.utils.DataframeVariantReadCountLike import DataframeVariantReadCountLike
+from vtam.utils.VTAMexception import VTAMexception
 
 
 class RunnerAsvTable(object):
 
+    """Builds the ASV table, with one row per run, marker and variant and one column per sample.
+
+    The read counts per sample are kept in a sparse long format, that is only the non-zero N_ij. The wide table is
+    written in blocks of rows, so that the dense sample columns of all the variants never are in memory at once.
+    """
+
+    # Formats of 'vtam filter --asvtable_format'
+    asvtable_format_list = ['wide', 'long', 'parquet']
+
     def __init__(self, variant_read_count_df, engine, sample_list, cluster_identity, known_occurrences_df=None):
 
         self.variant_read_count_df = variant_read_count_df
+        # Shares the N_i and N_ij aggregates between the ASV table parts
+        self.variant_read_count_like_obj = DataframeVariantReadCountLike(variant_read_count_df)
         self.engine = engine
         self.sample_list = sample_list
         self.cluster_identity = cluster_identity
         self.known_occurrences_df = known_occurrences_df
 
-    def to_tsv(self, asvtable_path):
-
-        asvtable_df = self.create_asvtable_df()
-        asvtable_df.to_csv(asvtable_path, sep="\t", header=True, index=False)
+    @staticmethod
+    def get_asvtable_format_path(asvtable_path, asvtable_format):
+        """Returns the path of the ASV table in asvtable_format, next to the wide TSV, eg asvtable.long.tsv or
+        asvtable.parquet for asvtable.tsv"""
+
+        if asvtable_format == 'wide':
+            return asvtable_path
+        asvtable_path_root = os.path.splitext(asvtable_path)[0]
+        if asvtable_format == 'long':
+            return asvtable_path_root + '.long.tsv'
+        return asvtable_path_root + '.' + asvtable_format
+
+    def write(self, asvtable_path, asvtable_format='wide', block_size=10000):
+        """Writes the wide ASV table and, for the other asvtable_format_list formats, the ASV table in this format
+        next to it, because the taxassign and pool commands read the wide TSV
+
+        :param asvtable_path: output path of the wide TSV
+        :param asvtable_format: 'wide' TSV with one column per sample, 'long' TSV with one row per variant and
+            sample with reads or 'parquet', the long format in a Parquet file
+        :param block_size: number of variants per block of rows of the wide format
+        """
+
+        if not (asvtable_format in self.asvtable_format_list):
+            Logger.instance().error(VTAMexception("Unknown ASV table format: {}".format(asvtable_format)))
+            sys.exit(1)
+
+        self.to_tsv(asvtable_path=asvtable_path, block_size=block_size)
+        asvtable_format_path = self.get_asvtable_format_path(asvtable_path, asvtable_format)
+        if asvtable_format == 'long':
+            self.create_asvtable_long_df().to_csv(asvtable_format_path, sep="\t", header=True, index=False)
+        elif asvtable_format == 'parquet':
+            try:
+                self.create_asvtable_long_df().to_parquet(asvtable_format_path, index=False)
+            except ImportError:
+                Logger.instance().error(VTAMexception(
+                    "The Parquet ASV table format requires the 'pyarrow' or 'fastparquet' python package"))
+                sys.exit(1)
+
+    def to_tsv(self, asvtable_path, block_size=10000):
+        """Writes the wide ASV table in blocks of block_size rows"""
+
+        asvtable_row_df = self.get_asvtable_rows()
+        with open(asvtable_path, 'w') as fout:
+            for block_i, asvtable_block_df in enumerate(self.iter_asvtable_blocks(asvtable_row_df, block_size)):
+                asvtable_block_df.to_csv(fout, sep="\t", header=(block_i == 0), index=False)
 
     def create_asvtable_df(self):
 
         """Merge asvtable information and reorder columns"""
 
-        asvtable_variant_info_df = self.get_asvtable_variants()
-        asvtable_samples_df = self.get_asvtable_samples()
+        asvtable_row_df = self.get_asvtable_rows()
+        return next(self.iter_asvtable_blocks(asvtable_row_df, block_size=max(asvtable_row_df.shape[0], 1)))
+
+    def create_asvtable_long_df(self):
+        """Returns the ASV table in long format, that is the variant columns of the wide format and the sample and
+        read_count of each sample with reads of this variant, instead of one column per sample"""
+
+        asvtable_row_df = self.get_asvtable_rows()
+        row_code_array, sample_code_array, read_count_array = self.get_asvtable_sample_coo()
+        # One row per row of the wide format and sample with reads, without the read count over all samples
+        asvtable_row_df = asvtable_row_df.drop('read_count', axis=1)
+        row_code_to_row_df = pandas.DataFrame({'row_code': row_code_array, 'sample': numpy.array(
+            self.sample_list, dtype=object)[sample_code_array], 'read_count': read_count_array})
+        asvtable_long_df = asvtable_row_df.merge(row_code_to_row_df, on='row_code', sort=False)
+        column_list = asvtable_row_df.columns.tolist()
+        column_list.remove('row_code')
+        return asvtable_long_df[column_list[:3] + ['sample', 'read_count'] + column_list[3:]]
+
+    def get_asvtable_rows(self):
+
+        """Returns the ASV table without the sample columns in the final order of the rows and columns. The
+        row_code column gives the position of the run_id, marker_id, variant_id of the row in the sorted N_i"""
 
-        # Merge variant and sample sides of asvtables
-        asvtable_df = asvtable_variant_info_df.merge(asvtable_samples_df, on=['run_id', 'marker_id', 'variant_id'])
+        asvtable_variant_info_df = self.get_asvtable_variants()
+        key_column_list = ['run_id', 'marker_id', 'variant_id']
+        asvtable_variant_info_df['row_code'] = pandas.MultiIndex.from_frame(
+            self.variant_read_count_like_obj.get_N_i_df()[key_column_list]).get_indexer(
+            pandas.MultiIndex.from_frame(asvtable_variant_info_df[key_column_list]))
+        asvtable_df = asvtable_variant_info_df
 
         ############################################################################################
         #
@@ -39,9 +122,10 @@ class RunnerAsvTable(object):
 
         if not (self.known_occurrences_df is None):
 
-            sample_name = NameIdConverter(id_name_or_sequence_list=self.known_occurrences_df.sample_id.tolist(), engine=self.engine).to_names(Sample)
-            self.known_occurrences_df.sample_id = ['keep_{}'.format(x) for x in sample_name]
-            variant_keep_info_df = self.known_occurrences_df.pivot_table(index=['run_id', 'marker_id', 'variant_id'], columns='sample_id', values='action', aggfunc='first', fill_value=0).reset_index()
+            known_occurrences_df = self.known_occurrences_df.copy()
+            sample_name = NameIdConverter(id_name_or_sequence_list=known_occurrences_df.sample_id.tolist(), engine=self.engine).to_names(Sample)
+            known_occurrences_df.sample_id = ['keep_{}'.format(x) for x in sample_name]
+            variant_keep_info_df = known_occurrences_df.pivot_table(index=['run_id', 'marker_id', 'variant_id'], columns='sample_id', values='action', aggfunc='first', fill_value=0).reset_index()
             variant_keep_info_df.replace(to_replace='keep', value=1, inplace=True)
             asvtable_df = asvtable_df.merge(variant_keep_info_df, on=['run_id', 'marker_id', 'variant_id'], how='left')
             asvtable_df.fillna(0, inplace=True)
@@ -68,6 +152,7 @@ class RunnerAsvTable(object):
         ############################################################################################
 
         column_list = asvtable_df.columns.tolist()
+        column_list.remove("row_code")
         column_list.remove("clusterid")
         column_list.remove("clustersize")
         column_list.remove("chimera_borderline")
@@ -79,10 +164,41 @@ class RunnerAsvTable(object):
         column_list.insert(3, "sequence_length")
         column_list.insert(4, "read_count")
 
-        asvtable_df = asvtable_df[column_list]
+        asvtable_df = asvtable_df[column_list + ['row_code']]
 
         return asvtable_df
 
+    def iter_asvtable_blocks(self, asvtable_row_df, block_size):
+        """Yields the wide ASV table in blocks of block_size rows, with the sample columns after read_count
+
+        :param asvtable_row_df: output of get_asvtable_rows
+        :param block_size: number of rows per block
+        """
+
+        row_code_array, sample_code_array, read_count_array = self.get_asvtable_sample_coo()
+        # Sparse rows: the sample counts of row code i are at positions row_pointer_array[i]:row_pointer_array[i+1]
+        row_pointer_array = numpy.searchsorted(
+            row_code_array, numpy.arange(self.variant_read_count_like_obj.get_N_i_df().shape[0] + 1))
+
+        for block_start in range(0, max(asvtable_row_df.shape[0], 1), block_size):
+            asvtable_block_df = asvtable_row_df.iloc[block_start:block_start + block_size]
+            block_row_code_array = asvtable_block_df.row_code.to_numpy()
+            sample_block_array = numpy.zeros((asvtable_block_df.shape[0], len(self.sample_list)), dtype='int64')
+
+            # Positions of the sample counts of the rows of this block
+            start_array = row_pointer_array[block_row_code_array]
+            length_array = row_pointer_array[block_row_code_array + 1] - start_array
+            block_row_array = numpy.repeat(numpy.arange(asvtable_block_df.shape[0]), length_array)
+            entry_array = numpy.repeat(start_array - numpy.cumsum(length_array) + length_array, length_array) \
+                + numpy.arange(length_array.sum())
+            sample_block_array[block_row_array, sample_code_array[entry_array]] = read_count_array[entry_array]
+
+            asvtable_block_df = asvtable_block_df.drop('row_code', axis=1)
+            sample_block_df = pandas.DataFrame(
+                sample_block_array, columns=self.sample_list, index=asvtable_block_df.index)
+            yield pandas.concat([asvtable_block_df.iloc[:, :5], sample_block_df, asvtable_block_df.iloc[:, 5:]],
+                                axis=1)
+
     def get_asvtable_variants(self):
 
         """This function gets variant-related data such sequence, sequence length and chimera
@@ -97,7 +213,7 @@ class RunnerAsvTable(object):
 4        1          1        1309         755  CTTATATTTTATTTTTGGTGCTTGATCAGGGATAGTGGGAACTTCT...              175               False       1309            2
             """
 
-        asvtable_variant_info_df = DataframeVariantReadCountLike(self.variant_read_count_df).get_N_i_df()
+        asvtable_variant_info_df = self.variant_read_count_like_obj.get_N_i_df()
         asvtable_variant_info_df.rename({'N_i': 'read_count'}, axis=1, inplace=True)
 
         asvtable_variant_info_df['sequence'] = NameIdConverter(
@@ -116,47 +232,41 @@ class RunnerAsvTable(object):
         #
         #######################################################################
 
-        seq_clusterer_obj = SequenceClusterer(asvtable_variant_info_df, cluster_identity=self.cluster_identity)
+        seq_clusterer_obj = SequenceClusterer(
+            asvtable_variant_info_df, cluster_identity=self.cluster_identity, engine=self.engine)
         cluster_count_df = seq_clusterer_obj.compute_clusters()
 
         asvtable_variant_info_df = asvtable_variant_info_df.merge(cluster_count_df, on='variant_id')
 
         return asvtable_variant_info_df
 
-    def get_asvtable_samples(self):
+    def get_asvtable_sample_coo(self):
 
-        """This function gets sample-related data such as run, marker, variants and read_count per sample
+        """Returns the read counts per sample in sparse coordinate format, that is three arrays with the row code,
+        position in sample_list and N_ij of each variant and sample with reads. Arrays are sorted by row code, that
+        is the position of the run_id, marker_id and variant_id in the sorted N_i. Samples absent from sample_list are
+        ignored.
 
-        Example:
-sample  run_id  marker_id  variant_id  tpos1_run1  tnegtag_run1  14ben01  14ben02
-0               1          1          95         563             0        0        0
-1               1          1         271        3471             0        0        0
-2               1          1         603         489             0        0        0
-3               1          1         954       34970             0        0        0
-4               1          1        1309         755             0        0        0
-5               1          1        2371        9124             0        0        0
-6               1          1        2684           0             0        0     5343
-7               1          1        4134           0             0        0      990
+        Example, with sample_list ['tpos1_run1', 'tnegtag_run1', '14ben01', '14ben02']:
+row_code  sample_code  read_count
+       0            0         563
+       1            0        3471
+       6            3        5343
             """
 
-        asvtable_2nd_df = DataframeVariantReadCountLike(self.variant_read_count_df).get_N_ij_df()
-        asvtable_2nd_df.sample_id = NameIdConverter(id_name_or_sequence_list=asvtable_2nd_df.sample_id.tolist(), engine=self.engine)\
-            .to_names(Sample)
-        asvtable_2nd_df.rename({'sample_id': 'sample'}, axis=1, inplace=True)
-        asvtable_2nd_df = asvtable_2nd_df.pivot_table(index=['run_id', 'marker_id', 'variant_id'], columns='sample',
-                            values='N_ij', fill_value=0).reset_index()
-
-        ############################################################################################
-        #
-        # Set order and fill 0-read count samples with Zeros
-        #
-        ############################################################################################
+        N_ij_df = self.variant_read_count_like_obj.get_N_ij_df()
+        key_array = N_ij_df[['run_id', 'marker_id', 'variant_id']].to_numpy()
+        # N_ij_df is sorted like N_i_df, so the row code increases with each new run_id, marker_id, variant_id
+        row_code_array = numpy.cumsum(numpy.r_[True, (key_array[1:] != key_array[:-1]).any(axis=1)]) - 1 \
+            if N_ij_df.shape[0] > 0 else numpy.zeros(0, dtype='int64')
 
-        asvtable_2nd_2_df = (asvtable_2nd_df.copy())[['run_id', 'marker_id', 'variant_id']]
-        for sample_name in self.sample_list:
-            if sample_name in asvtable_2nd_df.columns:  # sample with read counts
-                asvtable_2nd_2_df[sample_name] = asvtable_2nd_df[sample_name].tolist()
-            else:  # sample without read counts
-                asvtable_2nd_2_df[sample_name] = [0] * asvtable_2nd_df.shape[0]
+        sample_id_array = N_ij_df.sample_id.unique()
+        sample_name_list = NameIdConverter(id_name_or_sequence_list=sample_id_array.tolist(), engine=self.engine)\
+            .to_names(Sample)
+        sample_id_to_code_sr = pandas.Series(
+            pandas.Index(self.sample_list).get_indexer(sample_name_list), index=sample_id_array)
+        sample_code_array = sample_id_to_code_sr.loc[N_ij_df.sample_id].to_numpy()
 
-        return asvtable_2nd_2_df
+        is_in_sample_list = sample_code_array >= 0
+        return row_code_array[is_in_sample_list], sample_code_array[is_in_sample_list], \
+            N_ij_df.N_ij.to_numpy()[is_in_sample_list]
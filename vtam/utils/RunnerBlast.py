@@ -1,6 +1,10 @@
+import concurrent.futures
+import glob
+import hashlib
 import inspect
 import os
 import pathlib
+import shutil
 import sys
 
 import pandas
@@ -13,10 +17,21 @@ from Bio.Blast.Applications import NcbiblastnCommandline
 
 
 class RunnerBlast(object):
-    """Runs Blast. Used by Taxassign"""
+    """Runs Blast. Used by Taxassign
+
+    The variant FASTA is split into contiguous shards that are blasted by concurrent blastn processes, each with a
+    share of num_threads, because a single blastn does not scale to many threads. The shard outputs are concatenated
+    in the order of the shards, so the output is the same as with one blastn.
+    """
+
+    # Number of blastn threads per shard. blastn gains little above a few threads
+    shard_num_threads = 4
 
     def __init__(self, variant_fasta, blast_db_dir, blast_db_name, num_threads,
-            qcov_hsp_perc):
+            qcov_hsp_perc, num_shards=None):
+        """
+        :param num_shards: Number of concurrent blastn processes. Default num_threads/shard_num_threads
+        """
 
         self.variant_fasta = variant_fasta
         self.blast_db_dir = blast_db_dir
@@ -24,9 +39,13 @@ class RunnerBlast(object):
         # self.ltg_rule_threshold = ltg_rule_threshold
         # self.include_prop = include_prop
         # self.min_number_of_taxa = min_number_of_taxa
-        self.num_threads = num_threads
+        self.num_threads = int(num_threads)
         self.qcov_hsp_perc = qcov_hsp_perc
 
+        if num_shards is None:
+            num_shards = self.num_threads // self.shard_num_threads
+        self.num_shards = max(min(int(num_shards), self.num_threads), 1)
+
         self.this_temp_dir = os.path.join(PathManager.instance().get_tempdir(),
             os.path.basename(__file__))
         pathlib.Path(self.this_temp_dir).mkdir(exist_ok=True, parents=True)
@@ -49,14 +68,46 @@ class RunnerBlast(object):
         # get blast db dir and filename prefix from NHR file
         os.environ['BLASTDB'] = self.blast_db_dir
 
+        shard_fasta_list = RunnerBlast.split_fasta(
+            fasta_path=self.variant_fasta, num_shards=self.num_shards, shard_dir=self.this_temp_dir)
+        if len(shard_fasta_list) <= 1:
+            self.run_blastn(query_fasta=self.variant_fasta, blast_output_tsv=blast_output_tsv,
+                            num_threads=self.num_threads)
+            return blast_output_tsv
+
+        #######################################################################
+        #
+        # Run one blastn per shard and concatenate the outputs in shard order
+        #
+        #######################################################################
+
+        num_threads_list = [self.num_threads // len(shard_fasta_list)
+                            + (shard_i < self.num_threads % len(shard_fasta_list))
+                            for shard_i in range(len(shard_fasta_list))]
+        shard_output_list = [os.path.splitext(shard_fasta)[0] + '_blast_output.tsv'
+                             for shard_fasta in shard_fasta_list]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(shard_fasta_list)) as executor:
+            # list() raises the errors of the jobs
+            list(executor.map(self.run_blastn, shard_fasta_list, shard_output_list, num_threads_list))
+
+        with open(blast_output_tsv, 'w') as fout:
+            for shard_output in shard_output_list:
+                with open(shard_output) as fin:
+                    shutil.copyfileobj(fin, fout)
+        return blast_output_tsv
+
+    def run_blastn(self, query_fasta, blast_output_tsv, num_threads):
+
+        """Runs blastn of query_fasta against the blast DB and writes the hits to blast_output_tsv"""
+
         blastn_cline = NcbiblastnCommandline(
-            query=self.variant_fasta,
+            query=query_fasta,
             db=self.blast_db_name,
             evalue=1e-5,
             outfmt='"6 qseqid sacc pident evalue qcovhsp staxids"',
             dust='yes',
             qcov_hsp_perc=self.qcov_hsp_perc,
-            num_threads=self.num_threads,
+            num_threads=num_threads,
             out=blast_output_tsv)
         Logger.instance().debug(
             "file: {}; line: {}; {}".format(
@@ -68,23 +119,83 @@ class RunnerBlast(object):
         stdout, stderr = blastn_cline()
         return blast_output_tsv
 
+    @staticmethod
+    def split_fasta(fasta_path, num_shards, shard_dir):
+        """Splits a FASTA file into at most num_shards FASTA files of contiguous records with the same number of
+        records, plus or minus one
+
+        :param fasta_path: path to the FASTA file
+        :param num_shards: maximal number of shards
+        :param shard_dir: directory of the shard FASTA files
+        :return: list of the shard FASTA paths in the order of the records. Empty if there are less than two shards
+        """
+
+        with open(fasta_path) as fin:
+            record_count = sum(1 for line in fin if line.startswith('>'))
+        num_shards = min(num_shards, record_count)
+        if num_shards <= 1:
+            return []
+
+        shard_fasta_list = [os.path.join(shard_dir, 'variant_shard_{}.fasta'.format(shard_i))
+                            for shard_i in range(num_shards)]
+        # Number of records in the shards before each shard, and after the last one
+        shard_start_list = [shard_i * record_count // num_shards for shard_i in range(num_shards + 1)]
+
+        record_i = -1
+        shard_i = -1
+        fout = None
+        with open(fasta_path) as fin:
+            for line in fin:
+                if line.startswith('>'):
+                    record_i += 1
+                    if record_i == shard_start_list[shard_i + 1]:
+                        if fout is not None:
+                            fout.close()
+                        shard_i += 1
+                        fout = open(shard_fasta_list[shard_i], 'w')
+                if fout is not None:
+                    fout.write(line)
+        fout.close()
+        return shard_fasta_list
+
+    @staticmethod
+    def get_blast_db_fingerprint(blast_db_dir, blast_db_name):
+        """Returns the sha256 of the names, sizes and modification times of the files of this BLAST DB, which
+        changes when the DB is downloaded or built again"""
+
+        blast_db_fingerprint = hashlib.sha256(blast_db_name.encode())
+        for blast_db_file in sorted(glob.glob(os.path.join(blast_db_dir, blast_db_name + '.*'))):
+            if not os.path.isfile(blast_db_file):  # Eg the exact match index directory
+                continue
+            blast_db_file_stat = os.stat(blast_db_file)
+            blast_db_fingerprint.update('{}\t{}\t{}\n'.format(
+                os.path.basename(blast_db_file), blast_db_file_stat.st_size,
+                blast_db_file_stat.st_mtime_ns).encode())
+        return blast_db_fingerprint.hexdigest()
+
     @staticmethod
     def process_blast_result(blast_output_tsv):
         """Reads blast_output_tsv and creates a DF that is compatible to the following taxassign. If this DF is empty, vtam will exit with a warning
 
         """
 
+        blast_output_df = RunnerBlast.read_blast_result(blast_output_tsv)
+        RunnerBlast.exit_if_no_hit(blast_output_df)
+        return blast_output_df
+
+    @staticmethod
+    def read_blast_result(blast_output_tsv):
+        """Reads blast_output_tsv and returns the DF of hits with a target tax id, possibly empty"""
+
         Logger.instance().debug(
             "file: {}; line: {}; Reading Blast output from: {}".format(
                 __file__, inspect.currentframe().f_lineno, blast_output_tsv))
-        blast_output_df = pandas.read_csv(blast_output_tsv, sep='\t',
-                                          header=None, names=[
-                'variant_id',
-                'target_id',
-                'identity',
-                'evalue',
-                'coverage',
-                'target_tax_id'])
+        blast_output_column_list = ['variant_id', 'target_id', 'identity', 'evalue', 'coverage', 'target_tax_id']
+        if os.path.getsize(blast_output_tsv) == 0:  # No hit
+            blast_output_df = pandas.DataFrame(columns=blast_output_column_list)
+        else:
+            blast_output_df = pandas.read_csv(blast_output_tsv, sep='\t', dtype={'target_id': 'str'},
+                                              header=None, names=blast_output_column_list)
         # Remove null target tax ids
         blast_output_df = blast_output_df.loc[~blast_output_df.target_tax_id.isnull()]
 
@@ -92,8 +203,7 @@ class RunnerBlast(object):
         # first convert as string
         blast_output_df.target_tax_id = blast_output_df.target_tax_id.astype('str')
         # split by ';' to keep just one target_tax_id and reassign in DF
-        blast_output_df.target_tax_id = blast_output_df.target_tax_id.str.split(pat=';', n=1,
-                                                                                expand=True)
+        blast_output_df.target_tax_id = blast_output_df.target_tax_id.str.split(pat=';', n=1).str[0]
         # Convert back to numeric/int
         blast_output_df.target_tax_id = blast_output_df.target_tax_id.astype('float').astype('int')
         # blast_output_df = (pandas.concat([
@@ -109,9 +219,14 @@ class RunnerBlast(object):
 4           2  KU9559321    98.857  7.520000e-85       100         189839
 """
 
+        return blast_output_df
+
+    @staticmethod
+    def exit_if_no_hit(blast_output_df):
+        """Exits with a warning if Blast did not find any target"""
+
         if blast_output_df.shape[0] == 0:
             Logger.instance().warning(
                 VTAMexception("Blast did not find any target. "
                               "VTAM will stop here."))
             sys.exit(0)
-        return blast_output_df
\ No newline at end of file
@@ -0,0 +1,507 @@
+import concurrent.futures
+import multiprocessing
+import os
+import pandas
+import pathlib
+import sqlalchemy
+import tempfile
+
+from vtam.models.FilterChimera import FilterChimera
+from vtam.models.FilterChimeraBorderline import FilterChimeraBorderline
+from vtam.models.FilterChimeraCache import FilterChimeraCache
+from vtam.models.FilterCodonStop import FilterCodonStop
+from vtam.models.FilterCodonStopCache import FilterCodonStopCache
+from vtam.models.FilterIndel import FilterIndel
+from vtam.models.FilterLFN import FilterLFN
+from vtam.models.FilterMinReplicateNumber import FilterMinReplicateNumber
+from vtam.models.FilterMinReplicateNumber2 import FilterMinReplicateNumber2
+from vtam.models.FilterMinReplicateNumber3 import FilterMinReplicateNumber3
+from vtam.models.FilterPCRerror import FilterPCRerror
+from vtam.models.FilterRenkonen import FilterRenkonen
+from vtam.models.ReadCountAverageOverReplicates import ReadCountAverageOverReplicates
+from vtam.models.Variant import Variant
+from vtam.models.VariantReadCount import VariantReadCount
+from vtam.utils.FileCutoffSpecific import FileCutoffSpecific
+from vtam.utils.FileKnownOccurrences import FileKnownOccurrences
+from vtam.utils.FileSampleInformation import FileSampleInformation
+from vtam.utils.FileVariantReadCountSnapshot import FileVariantReadCountSnapshot
+from vtam.utils.Logger import Logger
+from vtam.utils.ModelPartitionFingerprint import ModelPartitionFingerprint
+from vtam.utils.ModelVariantReadCountLike import ModelVariantReadCountLike
+from vtam.utils.PathManager import PathManager
+from vtam.utils.RunnerAsvTable import RunnerAsvTable
+from vtam.utils.RunnerFilterChimera import RunnerFilterChimera
+from vtam.utils.RunnerFilterCodonStop import RunnerFilterCodonStop
+from vtam.utils.RunnerFilterIndel import RunnerFilterIndel
+from vtam.utils.RunnerFilterLFN import RunnerFilterLFN
+from vtam.utils.RunnerFilterMinReplicateNumber import RunnerFilterMinReplicateNumber
+from vtam.utils.RunnerFilterPCRerror import RunnerFilterPCRerror
+from vtam.utils.RunnerFilterRenkonen import RunnerFilterRenkonen
+from vtam.utils.VTAMexception import VTAMexception
+from vtam.wrapper.ReadCountAverageOverReplicates import read_count_average_over_replicates
+
+
+class RunnerFilterChain(object):
+    """Runs the filter rules from FilterLFN to MakeAsvTable in one process (vtam filter --fused)
+
+    The VariantReadCount occurrences and the variant sequences are read once from the DB and the DataFrames are
+    handed from one filter to the next in memory. Only the tables needed downstream (FilterChimeraBorderline,
+    FilterCodonStop and ReadCountAverageOverReplicates) and the intermediate tables in keep_table_list are written.
+
+    The filters from FilterLFN to FilterMinReplicateNumber3 only compare occurrences of the same run-marker, so
+    they run on each run-marker partition separately, in a pool of num_workers processes. FilterIndel, which takes
+    the majority sequence length of all variants, and the next steps run on the merged partitions.
+    """
+
+    # Output tables in the order of the filter wopfile
+    table_model_dic = {
+        'FilterLFN': FilterLFN,
+        'FilterMinReplicateNumber': FilterMinReplicateNumber,
+        'FilterPCRerror': FilterPCRerror,
+        'FilterChimera': FilterChimera,
+        'FilterChimeraBorderline': FilterChimeraBorderline,
+        'FilterMinReplicateNumber2': FilterMinReplicateNumber2,
+        'FilterRenkonen': FilterRenkonen,
+        'FilterMinReplicateNumber3': FilterMinReplicateNumber3,
+        'FilterIndel': FilterIndel,
+        'FilterCodonStop': FilterCodonStop,
+        'ReadCountAverageOverReplicates': ReadCountAverageOverReplicates,
+    }
+
+    # Tables read by the ASV table or by later commands: always written
+    final_table_list = ['FilterChimeraBorderline', 'FilterCodonStop', 'ReadCountAverageOverReplicates']
+
+    # Tables computed per run-marker partition
+    partition_table_list = ['FilterLFN', 'FilterMinReplicateNumber', 'FilterPCRerror', 'FilterChimera',
+                            'FilterChimeraBorderline', 'FilterMinReplicateNumber2', 'FilterRenkonen',
+                            'FilterMinReplicateNumber3']
+
+    # Parameters of the filters of the run-marker partitions
+    partition_param_list = ['lfn_variant_cutoff', 'lfn_variant_replicate_cutoff', 'lfn_sample_replicate_cutoff',
+                            'lfn_read_count_cutoff', 'min_replicate_number', 'pcr_error_var_prop',
+                            'uchime3_denovo_abskew', 'renkonen_distance_quantile']
+
+    # Seconds a worker waits for the SQLite lock of the FilterChimeraCache table held by another worker
+    worker_db_timeout = 60
+
+    def __init__(self, engine, sortedinfo_tsv, params_dic, keep_table_list=None, num_workers=1,
+                 incremental=False):
+        """
+        :param engine: sqlalchemy engine of the vtam DB, where SampleInformation and VariantReadCount are filled
+        :param sortedinfo_tsv: Path to the sortedinfo TSV file
+        :param params_dic: dictionary with the CLI arguments and numerical parameters (See RunnerWopmars)
+        :param keep_table_list: list of intermediate table names to write to the DB
+        :param num_workers: number of worker processes running the run-marker partitions
+        :param incremental: if True, the run-marker partitions whose input occurrences and parameters did not change
+            since the last run reuse their rows of FilterMinReplicateNumber3, which is then always written
+        """
+
+        self.engine = engine
+        self.sample_info_tsv_obj = FileSampleInformation(tsv_path=sortedinfo_tsv)
+        self.params_dic = params_dic
+        self.num_workers = num_workers
+        self.incremental = incremental
+
+        if keep_table_list is None:
+            keep_table_list = []
+        if incremental:
+            keep_table_list = keep_table_list + ['FilterMinReplicateNumber3']
+        self.persist_table_list = self.final_table_list + [
+            table_name for table_name in keep_table_list if table_name not in self.final_table_list]
+
+    def run(self, asvtable_tsv_path, asvtable_format='wide'):
+        """Runs the filter chain and writes the ASV table
+
+        :param asvtable_tsv_path: Path to the ASV table TSV output
+        :param asvtable_format: one of RunnerAsvTable.asvtable_format_list
+        :return: bool, False if the filters deleted all the variants and no ASV table was written
+        """
+
+        for model in list(self.table_model_dic.values()) + [FilterChimeraCache, FilterCodonStopCache]:
+            model.__table__.create(bind=self.engine, checkfirst=True)
+
+        ############################################################################################
+        #
+        # Read the input occurrences and the variant sequences once
+        #
+        ############################################################################################
+
+        variant_read_count_df = self.sample_info_tsv_obj.get_nijk_df(
+            variant_read_count_like_model=VariantReadCount, engine=self.engine, filter_id=None)
+        variant_df = self.get_variant_df(variant_read_count_df.variant_id.unique().tolist())
+        lfn_specific_cutoff_df_tuple = self.get_lfn_specific_cutoff_df_tuple()
+
+        ############################################################################################
+        #
+        # Find the run-marker partitions to compute and delete the previous results of these samples
+        #
+        ############################################################################################
+
+        run_marker_list = variant_read_count_df[['run_id', 'marker_id']].drop_duplicates().apply(
+            tuple, axis=1).tolist()
+        changed_run_marker_set = set(run_marker_list)
+        partition_fingerprint_obj = None
+        fingerprint_dic = {}
+        if self.incremental:
+            partition_fingerprint_obj = ModelPartitionFingerprint(engine=self.engine, step=self.__class__.__name__)
+            fingerprint_dic = self.get_run_marker_fingerprint_dic(
+                variant_read_count_df, lfn_specific_cutoff_df_tuple)
+            changed_run_marker_set = partition_fingerprint_obj.get_changed_run_marker_set(fingerprint_dic)
+            Logger.instance().info("{}: {} of {} run-markers changed".format(
+                self.__class__.__name__, len(changed_run_marker_set), len(run_marker_list)))
+        else:
+            ModelPartitionFingerprint(engine=self.engine, step=self.__class__.__name__).delete(run_marker_list)
+
+        sample_record_list = self.sample_info_tsv_obj.to_identifier_df(engine=self.engine)[[
+            'run_id', 'marker_id', 'sample_id', 'replicate']].to_dict('records')
+        changed_sample_record_list = [sample_record for sample_record in sample_record_list if (
+            sample_record['run_id'], sample_record['marker_id']) in changed_run_marker_set]
+        for table_name, model in self.table_model_dic.items():
+            if table_name in self.partition_table_list:
+                if len(changed_sample_record_list) == 0:
+                    continue
+                ModelVariantReadCountLike(
+                    engine=self.engine, variant_read_count_like_model=model).delete_from_db(changed_sample_record_list)
+            else:
+                ModelVariantReadCountLike(
+                    engine=self.engine, variant_read_count_like_model=model).delete_from_db(sample_record_list)
+
+        ############################################################################################
+        #
+        # Run the filters of the run-marker partitions, in parallel if num_workers > 1
+        #
+        ############################################################################################
+
+        partition_list = [((run_id, marker_id), variant_read_count_partition_df, variant_df.loc[
+            variant_df.index.isin(variant_read_count_partition_df.variant_id.unique())])
+            for (run_id, marker_id), variant_read_count_partition_df in variant_read_count_df.groupby(
+            ['run_id', 'marker_id'], sort=False) if (run_id, marker_id) in changed_run_marker_set]
+
+        if self.num_workers > 1 and len(partition_list) > 1:
+            num_workers = min(self.num_workers, len(partition_list))
+            if os.getenv('VTAM_THREADS') is None:
+                num_threads = multiprocessing.cpu_count()
+            else:
+                num_threads = int(os.getenv('VTAM_THREADS'))
+            # The thread budget is shared by the workers
+            num_threads_per_worker = max(1, num_threads // num_workers)
+            # Each worker opens its own connection. An in-memory DB cannot be shared, so the caches are skipped
+            db_url = str(self.engine.url)
+            if self.engine.url.database in [None, '', ':memory:']:
+                db_url = None
+            Logger.instance().debug(
+                "Running {} run-marker partitions in {} worker processes".format(len(partition_list), num_workers))
+            with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers) as executor:
+                future_list = [executor.submit(
+                    self.run_partition_filters_in_worker, db_url, num_threads_per_worker, self.params_dic,
+                    variant_read_count_partition_df, variant_partition_df, lfn_specific_cutoff_df_tuple,
+                    self.persist_table_list)
+                    for run_marker, variant_read_count_partition_df, variant_partition_df in partition_list]
+                # Results are merged in the order of the partitions
+                partition_result_list = [future.result() for future in future_list]
+        else:
+            partition_result_list = [self.run_partition_filters(
+                self.engine, self.params_dic, variant_read_count_partition_df, variant_partition_df,
+                lfn_specific_cutoff_df_tuple, self.persist_table_list)
+                for run_marker, variant_read_count_partition_df, variant_partition_df in partition_list]
+
+        ############################################################################################
+        #
+        # Merge the partitions. Unchanged partitions reuse their FilterMinReplicateNumber3 rows
+        #
+        ############################################################################################
+
+        for table_name in self.table_model_dic:
+            table_df_list = [partition_result[0][table_name] for partition_result in partition_result_list
+                             if table_name in partition_result[0]]
+            if len(table_df_list) > 0:
+                self.persist(table_name, pandas.concat(table_df_list, axis=0))
+        if partition_fingerprint_obj is not None:
+            partition_fingerprint_obj.update({run_marker: fingerprint_dic[run_marker]
+                                              for run_marker in changed_run_marker_set})
+
+        passed_df_dic = {partition[0]: partition_result[1]
+                         for partition, partition_result in zip(partition_list, partition_result_list)}
+        unchanged_sample_record_list = [sample_record for sample_record in sample_record_list if (
+            sample_record['run_id'], sample_record['marker_id']) not in changed_run_marker_set]
+        if len(unchanged_sample_record_list) > 0:
+            reused_df = self.get_passed_df_from_db(FilterMinReplicateNumber3, unchanged_sample_record_list)
+            for run_marker, reused_partition_df in reused_df.groupby(['run_id', 'marker_id'], sort=False):
+                passed_df_dic[run_marker] = reused_partition_df
+
+        variant_read_count_df = pandas.concat(
+            [passed_df_dic[run_marker] for run_marker in run_marker_list if run_marker in passed_df_dic]
+            + [variant_read_count_df.iloc[0:0]], axis=0).reset_index(drop=True)
+        if variant_read_count_df.shape[0] == 0:
+            # Name of the last filter that deleted all the variants of a partition
+            table_name = max([partition_result[2] for partition_result in partition_result_list
+                              if partition_result[2] is not None] + ['FilterLFN'],
+                             key=list(self.table_model_dic).index)
+            self.check_passed_df(table_name, variant_read_count_df)
+            return False
+
+        ############################################################################################
+        #
+        # Run the filters that need all the variants
+        #
+        ############################################################################################
+
+        filter_delete_df = RunnerFilterIndel(variant_read_count_df).get_variant_read_count_delete_df(
+            variant_df.loc[variant_df.index.isin(variant_read_count_df.variant_id.unique())].copy(),
+            self.params_dic['skip_filter_indel'])
+        variant_read_count_df = self.persist_and_pass('FilterIndel', filter_delete_df)
+        if not self.check_passed_df('FilterIndel', variant_read_count_df):
+            return False
+
+        filter_delete_df = RunnerFilterCodonStop(
+            variant_read_count_df=variant_read_count_df, engine=self.engine).get_variant_read_count_delete_df(
+            variant_df=variant_df.loc[variant_df.index.isin(variant_read_count_df.variant_id.unique())].copy(),
+            genetic_code=self.params_dic['genetic_code'],
+            skip_filter_codon_stop=self.params_dic['skip_filter_codon_stop'])
+        variant_read_count_df = self.persist_and_pass('FilterCodonStop', filter_delete_df)
+        if not self.check_passed_df('FilterCodonStop', variant_read_count_df):
+            return False
+
+        read_count_average_df = read_count_average_over_replicates(variant_read_count_df)
+        self.persist('ReadCountAverageOverReplicates', read_count_average_df)
+
+        ############################################################################################
+        #
+        # ASV table
+        #
+        ############################################################################################
+
+        known_occurrences_tsv = self.params_dic.get('known_occurrences', None)
+        if known_occurrences_tsv is None or str(known_occurrences_tsv) == 'None':
+            known_occurrences_df = None
+        else:
+            known_occurrences_df = FileKnownOccurrences(known_occurrences_tsv).to_identifier_df(self.engine)
+            known_occurrences_df = known_occurrences_df.loc[
+                (known_occurrences_df.mock == 1) & (known_occurrences_df.action == 'keep'), ]
+
+        sample_list = self.sample_info_tsv_obj.read_tsv_into_df()['sample'].drop_duplicates(keep='first').tolist()
+        asvtable_runner = RunnerAsvTable(variant_read_count_df=variant_read_count_df,
+                                         engine=self.engine, sample_list=sample_list,
+                                         cluster_identity=float(self.params_dic['cluster_identity']),
+                                         known_occurrences_df=known_occurrences_df)
+        asvtable_runner.write(asvtable_path=asvtable_tsv_path, asvtable_format=asvtable_format)
+
+        return True
+
+    @classmethod
+    def run_partition_filters(cls, engine, params_dic, variant_read_count_df, variant_df,
+                              lfn_specific_cutoff_df_tuple, persist_table_list):
+        """Runs the filters from FilterLFN to FilterMinReplicateNumber3, which only compare occurrences within
+        a run-marker, on one run-marker partition
+
+        :param engine: sqlalchemy engine used for the FilterChimeraCache table or None
+        :param params_dic: dictionary with the numerical parameters
+        :param variant_read_count_df: DataFrame (run_id, marker_id, sample_id, replicate, variant_id, read_count)
+        :param variant_df: DataFrame (id, sequence) with id as index
+        :param lfn_specific_cutoff_df_tuple: tuple of the variant and variant-replicate specific cutoff DataFrames
+        :param persist_table_list: list of the table names to return
+        :return: tuple (dictionary table_name: DataFrame to write, DataFrame with the occurrences passing these
+            filters, name of the filter that deleted all the occurrences or None)
+        """
+
+        table_df_dic = {}
+
+        def persist_and_pass(table_name, filter_delete_df):
+            if table_name in persist_table_list:
+                table_df_dic[table_name] = filter_delete_df
+            return cls.get_passed_df(filter_delete_df)
+
+        lfn_delete_df = cls.run_filter_lfn(params_dic, variant_read_count_df, *lfn_specific_cutoff_df_tuple)
+        persist_and_pass('FilterLFN', lfn_delete_df)
+        # Variants passing all the LFN filters
+        variant_read_count_df = cls.get_passed_df(lfn_delete_df.loc[lfn_delete_df.filter_id == 8])
+        if variant_read_count_df.shape[0] == 0:
+            return table_df_dic, variant_read_count_df, 'FilterLFN'
+
+        filter_delete_df = RunnerFilterMinReplicateNumber(variant_read_count_df)\
+            .get_variant_read_count_delete_df(params_dic['min_replicate_number'])
+        variant_read_count_df = persist_and_pass('FilterMinReplicateNumber', filter_delete_df)
+        if variant_read_count_df.shape[0] == 0:
+            return table_df_dic, variant_read_count_df, 'FilterMinReplicateNumber'
+
+        filter_delete_df = RunnerFilterPCRerror.get_variant_read_count_delete_df_per_sample(
+            variant_df=variant_df, variant_read_count_df=variant_read_count_df,
+            pcr_error_var_prop=params_dic['pcr_error_var_prop'])
+        variant_read_count_df = persist_and_pass('FilterPCRerror', filter_delete_df)
+        if variant_read_count_df.shape[0] == 0:
+            return table_df_dic, variant_read_count_df, 'FilterPCRerror'
+
+        filter_delete_df, filter_borderline_delete_df = RunnerFilterChimera(
+            variant_read_count_df=variant_read_count_df, engine=engine).get_variant_read_count_delete_df(
+            variant_df=variant_df, uchime3_denovo_abskew=params_dic['uchime3_denovo_abskew'])
+        persist_and_pass('FilterChimeraBorderline', filter_borderline_delete_df)
+        variant_read_count_df = persist_and_pass('FilterChimera', filter_delete_df)
+        if variant_read_count_df.shape[0] == 0:
+            return table_df_dic, variant_read_count_df, 'FilterChimera'
+
+        filter_delete_df = RunnerFilterMinReplicateNumber(variant_read_count_df)\
+            .get_variant_read_count_delete_df(params_dic['min_replicate_number'])
+        variant_read_count_df = persist_and_pass('FilterMinReplicateNumber2', filter_delete_df)
+        if variant_read_count_df.shape[0] == 0:
+            return table_df_dic, variant_read_count_df, 'FilterMinReplicateNumber2'
+
+        filter_delete_df = RunnerFilterRenkonen.get_variant_read_count_delete_df_per_run_marker(
+            variant_read_count_df=variant_read_count_df,
+            renkonen_distance_quantile=params_dic['renkonen_distance_quantile'])
+        variant_read_count_df = persist_and_pass('FilterRenkonen', filter_delete_df)
+        if variant_read_count_df.shape[0] == 0:
+            return table_df_dic, variant_read_count_df, 'FilterRenkonen'
+
+        filter_delete_df = RunnerFilterMinReplicateNumber(variant_read_count_df)\
+            .get_variant_read_count_delete_df(params_dic['min_replicate_number'])
+        variant_read_count_df = persist_and_pass('FilterMinReplicateNumber3', filter_delete_df)
+        if variant_read_count_df.shape[0] == 0:
+            return table_df_dic, variant_read_count_df, 'FilterMinReplicateNumber3'
+
+        return table_df_dic, variant_read_count_df, None
+
+    @classmethod
+    def run_partition_filters_in_worker(cls, db_url, num_threads, *args):
+        """Entry point of the worker processes: opens a DB connection and a temporary directory for this process
+        and runs run_partition_filters"""
+
+        PathManager.instance().tempdir = tempfile.mkdtemp(dir=PathManager.instance().get_tempdir())
+        os.environ['VTAM_THREADS'] = str(num_threads)
+        engine = None
+        if db_url is not None:
+            # The workers write the FilterChimeraCache table of the same DB file
+            engine = sqlalchemy.create_engine(db_url, echo=False, connect_args={'timeout': cls.worker_db_timeout})
+        return cls.run_partition_filters(engine, *args)
+
+    def get_lfn_specific_cutoff_df_tuple(self):
+        """Returns the variant and variant-replicate specific cutoff DataFrames like the FilterLFN wrapper, or None"""
+
+        lfn_variant_cutoff = self.params_dic.get('lfn_variant_cutoff', None)
+        lfn_variant_specific_cutoff = self.params_dic.get('lfn_variant_specific_cutoff', None)
+        lfn_variant_replicate_cutoff = self.params_dic.get('lfn_variant_replicate_cutoff', None)
+        lfn_variant_replicate_specific_cutoff = self.params_dic.get('lfn_variant_replicate_specific_cutoff', None)
+
+        lfn_variant_specific_cutoff_df = None
+        if not (lfn_variant_cutoff is None) and not (lfn_variant_specific_cutoff is None) \
+                and pathlib.Path(lfn_variant_specific_cutoff).stat().st_size > 0:
+            lfn_variant_specific_cutoff_df = FileCutoffSpecific(lfn_variant_specific_cutoff).to_identifier_df(
+                engine=self.engine, is_lfn_variant_replicate=False)
+
+        lfn_variant_replicate_specific_cutoff_df = None
+        if not (lfn_variant_replicate_cutoff is None) and not (lfn_variant_replicate_specific_cutoff is None) \
+                and pathlib.Path(lfn_variant_replicate_specific_cutoff).stat().st_size > 0:
+            lfn_variant_replicate_specific_cutoff_df = FileCutoffSpecific(
+                lfn_variant_replicate_specific_cutoff).to_identifier_df(
+                engine=self.engine, is_lfn_variant_replicate=True)
+
+        return lfn_variant_specific_cutoff_df, lfn_variant_replicate_specific_cutoff_df
+
+    @staticmethod
+    def run_filter_lfn(params_dic, variant_read_count_df, lfn_variant_specific_cutoff_df,
+                       lfn_variant_replicate_specific_cutoff_df):
+        """Runs RunnerFilterLFN with the same cutoffs as the FilterLFN wrapper"""
+
+        return RunnerFilterLFN(variant_read_count_df).get_variant_read_count_delete_df(
+            lfn_variant_cutoff=params_dic.get('lfn_variant_cutoff', None),
+            lfn_variant_specific_cutoff=lfn_variant_specific_cutoff_df,
+            lfn_variant_replicate_cutoff=params_dic.get('lfn_variant_replicate_cutoff', None),
+            lfn_variant_replicate_specific_cutoff=lfn_variant_replicate_specific_cutoff_df,
+            lfn_sample_replicate_cutoff=params_dic['lfn_sample_replicate_cutoff'],
+            lfn_read_count_cutoff=params_dic['lfn_read_count_cutoff'])
+
+    def get_run_marker_fingerprint_dic(self, variant_read_count_df, lfn_specific_cutoff_df_tuple):
+        """Returns the dictionary (run_id, marker_id): fingerprint of the inputs of the partition filters, that is
+        the occurrences, the parameters, the specific cutoffs and the written tables"""
+
+        param_list = [(param, self.params_dic.get(param, None)) for param in self.partition_param_list]
+
+        fingerprint_dic = {}
+        for (run_id, marker_id), variant_read_count_partition_df in variant_read_count_df.groupby(
+                ['run_id', 'marker_id'], sort=False):
+            cutoff_specific_fingerprint_list = []
+            for lfn_specific_cutoff_df in lfn_specific_cutoff_df_tuple:
+                if lfn_specific_cutoff_df is None:
+                    cutoff_specific_fingerprint_list.append(None)
+                else:
+                    cutoff_specific_fingerprint_list.append(ModelPartitionFingerprint.get_df_fingerprint(
+                        lfn_specific_cutoff_df.loc[(lfn_specific_cutoff_df.run_id == run_id)
+                                                   & (lfn_specific_cutoff_df.marker_id == marker_id)]))
+            fingerprint_dic[(run_id, marker_id)] = ModelPartitionFingerprint.get_df_fingerprint(
+                variant_read_count_partition_df, param_list, cutoff_specific_fingerprint_list,
+                sorted(self.persist_table_list))
+        return fingerprint_dic
+
+    def get_passed_df_from_db(self, variant_read_count_like_model, sample_record_list):
+        """Returns the occurrences of these samples that are not deleted in this filter table"""
+
+        column_list = ['run_id', 'marker_id', 'sample_id', 'replicate', 'variant_id', 'read_count']
+        variant_read_count_like_table = variant_read_count_like_model.__table__
+        record_list = []
+        with self.engine.connect() as conn:
+            for run_id, marker_id in {(sample_record['run_id'], sample_record['marker_id'])
+                                      for sample_record in sample_record_list}:
+                stmt_select = sqlalchemy.select(
+                    [variant_read_count_like_table.c[column] for column in column_list]).distinct()\
+                    .where(variant_read_count_like_table.c.run_id == run_id)\
+                    .where(variant_read_count_like_table.c.marker_id == marker_id)\
+                    .where(variant_read_count_like_table.c.filter_delete == 0)
+                record_list += conn.execute(stmt_select).fetchall()
+
+        passed_df = pandas.DataFrame.from_records(record_list, columns=column_list)
+        return passed_df.merge(pandas.DataFrame(sample_record_list)[
+            ['run_id', 'marker_id', 'sample_id', 'replicate']], on=['run_id', 'marker_id', 'sample_id', 'replicate'])
+
+    def get_variant_df(self, variant_id_list):
+        """Returns the variant_df (id, sequence) with id as index of these variants"""
+
+        variant_model_table = Variant.__table__
+        record_list = []
+        with self.engine.connect() as conn:
+            # Chunks keep the IN clause below the sqlite variable limit
+            for i in range(0, len(variant_id_list), 900):
+                stmt_select = sqlalchemy.select([variant_model_table.c.id, variant_model_table.c.sequence]).where(
+                    variant_model_table.c.id.in_(variant_id_list[i:i + 900]))
+                for row in conn.execute(stmt_select).fetchall():
+                    record_list.append({'id': row[0], 'sequence': row[1]})
+
+        return pandas.DataFrame.from_records(record_list, index='id', columns=['id', 'sequence'])
+
+    @staticmethod
+    def get_passed_df(filter_delete_df):
+        """Returns the occurrences (run_id, marker_id, sample_id, replicate, variant_id, read_count) that are not
+        deleted, like FileSampleInformation.get_nijk_df would read them from the output table"""
+
+        column_list = ['run_id', 'marker_id', 'sample_id', 'replicate', 'variant_id', 'read_count']
+        passed_df = filter_delete_df.loc[~filter_delete_df.filter_delete.astype(bool), column_list]
+        return passed_df.drop_duplicates().reset_index(drop=True)
+
+    def persist(self, table_name, variant_read_count_like_df):
+        """Writes this step to its table if it is a final table or a table kept by the user"""
+
+        if table_name not in self.persist_table_list:
+            return
+        record_list = ModelVariantReadCountLike.filter_delete_df_to_dict(variant_read_count_like_df)
+        with self.engine.connect() as conn:
+            conn.execute(self.table_model_dic[table_name].__table__.insert(), record_list)
+        FileVariantReadCountSnapshot.write_if_enabled(
+            engine=self.engine, variant_read_count_like_model=self.table_model_dic[table_name])
+
+    def persist_and_pass(self, table_name, filter_delete_df):
+        """Writes this step if needed and returns the occurrences passing it"""
+
+        self.persist(table_name, filter_delete_df)
+        return self.get_passed_df(filter_delete_df)
+
+    @staticmethod
+    def check_passed_df(table_name, variant_read_count_df):
+        """Returns False and warns if this filter deleted all the variants"""
+
+        Logger.instance().debug(
+            "{}: {} occurrences passed".format(table_name, variant_read_count_df.shape[0]))
+        if variant_read_count_df.shape[0] == 0:
+            Logger.instance().warning(
+                VTAMexception(
+                    "This filter has deleted all the variants: {}. "
+                    "The analysis will stop here.".format(table_name)))
+            return False
+        return True
@@ -1,8 +1,13 @@
+import concurrent.futures
+import hashlib
+import multiprocessing
 import os
+import pandas
 import pathlib
+import sqlalchemy
+import sys
 
-from Bio import SeqIO
-
+from vtam.models.FilterChimeraCache import FilterChimeraCache
 from vtam.utils.Logger import Logger
 from vtam.utils.PathManager import PathManager
 from vtam.utils.DataframeVariant import DataframeVariant
@@ -12,34 +17,71 @@ from vtam.utils.RunnerVSearch import RunnerVSearch
 
 class RunnerFilterChimera(object):
 
-    def __init__(self, variant_read_count_df):
-        """Carries out a chimera analysis"""
+    # Maximal number of values in one IN clause, below the SQLite limit of host parameters
+    in_clause_size = 900
+
+    def __init__(self, variant_read_count_df, num_threads=None, engine=None):
+        """Carries out a chimera analysis
+
+        :param variant_read_count_df: DataFrame (run_id, marker_id, sample_id, replicate, variant_id, read_count)
+        :param num_threads: Number of concurrent uchime3_denovo jobs. Default VTAM_THREADS or the number of CPUs
+        :param engine: sqlalchemy engine with the FilterChimeraCache table. If None, uchime3_denovo is always run
+        """
 
         self.variant_read_count_df = variant_read_count_df
+        self.engine = engine
+
+        if num_threads is None:
+            if os.getenv('VTAM_THREADS') is None:
+                num_threads = multiprocessing.cpu_count()
+            else:
+                num_threads = int(os.getenv('VTAM_THREADS'))
+        self.num_threads = num_threads
 
     def get_variant_read_count_delete_df(
             self, variant_df, uchime3_denovo_abskew):
 
+        chimera_key_set, borderline_key_set = self.get_chimera_borderline_key_sets(
+            variant_df=variant_df, uchime3_denovo_abskew=uchime3_denovo_abskew)
+
+        ###################################################################
+        #
+        # Mark chimeras and borderline variants for deletion in one pass
+        #
+        ###################################################################
+
+        key_column_list = ['run_id', 'marker_id', 'sample_id', 'variant_id']
+        variant_read_count_df_obj = DataframeVariantReadCountLike(
+            variant_read_count_df=self.variant_read_count_df)
+        filter_output_chimera_df = variant_read_count_df_obj.get_filter_delete_df(
+            delete_key_df=pandas.DataFrame(sorted(chimera_key_set), columns=key_column_list))
+        filter_output_borderline_df = variant_read_count_df_obj.get_filter_delete_df(
+            delete_key_df=pandas.DataFrame(sorted(borderline_key_set), columns=key_column_list))
+
+        return filter_output_chimera_df, filter_output_borderline_df
+
+    def get_chimera_borderline_key_sets(self, variant_df, uchime3_denovo_abskew):
+        """Runs uchime3_denovo for each run-marker-sample in a pool of concurrent jobs
+
+        :param variant_df: DataFrame (id, sequence) with id as index
+        :param uchime3_denovo_abskew: vsearch abskew parameter
+        :return: tuple with two sets of (run_id, marker_id, sample_id, variant_id) keys: chimeras and borderline
+        """
+
         temp_dir = os.path.join(
             PathManager.instance().get_tempdir(),
             os.path.basename(__file__))
         pathlib.Path(temp_dir).mkdir(exist_ok=True)
 
-        filter_output_chimera_df = self.variant_read_count_df.copy()
-        filter_output_chimera_df['filter_delete'] = False
+        ###################################################################
         #
-        filter_output_borderline_df = self.variant_read_count_df.copy()
-        filter_output_borderline_df['filter_delete'] = False
-
-        run_marker_sample_df = self.variant_read_count_df[[
-            'run_id', 'marker_id', 'sample_id']].drop_duplicates(inplace=False)
-        for row in run_marker_sample_df.itertuples():
-            run_id = row.run_id
-            marker_id = row.marker_id
-            sample_id = row.sample_id
+        # Sort variants by abundance and write one fasta_path per sample
+        #
+        ###################################################################
 
-            variant_read_count_df = self.variant_read_count_df.loc[(self.variant_read_count_df.run_id == run_id) & (
-                self.variant_read_count_df.marker_id == marker_id) & (self.variant_read_count_df.sample_id == sample_id)]
+        job_list = []
+        for (run_id, marker_id, sample_id), variant_read_count_df in self.variant_read_count_df.groupby(
+                ['run_id', 'marker_id', 'sample_id'], sort=False):
 
             variant_read_count_df_obj = DataframeVariantReadCountLike(
                 variant_read_count_df=variant_read_count_df)
@@ -52,74 +94,168 @@ class RunnerFilterChimera(object):
             variant_size_df.rename(columns={'N_i': 'size'}, inplace=True)
             variant_size_df.set_index('variant_id', inplace=True)
 
-            ###################################################################
-            #
-            # Sort variants by abundance and write to fasta_path
-            #
-            ###################################################################
-
             variant_size_df.sort_values(
                 by='size', ascending=False, inplace=True)
 
-            variant_df_utils_obj = DataframeVariant(variant_size_df)
-
             uchime_fasta_path = os.path.join(
                 temp_dir, 'run_{}_marker_{}_sample_{}.fasta' .format(
                     run_id, marker_id, sample_id))
-            variant_df_utils_obj.to_fasta(
+            DataframeVariant(variant_size_df).to_fasta(
                 fasta_path=uchime_fasta_path, add_column="size")
 
-            ###################################################################
-            #
-            # Run uchime_denovo
-            #
-            ###################################################################
-
-            uchime_borderline_fasta_path = os.path.join(
-                temp_dir, 'run_{}_marker_{}_sample_{}_borderline.fasta' .format(
-                    run_id, marker_id, sample_id))
-            uchime_nonchimeras_fasta_path = os.path.join(
-                temp_dir, 'run_{}_marker_{}_sample_id_{}_nonchimeras.fasta' .format(
-                    run_id, marker_id, sample_id))
-            uchime_chimeras_fasta_path = os.path.join(
-                temp_dir, 'run_{}_marker_{}_sample_{}_chimeras.fasta' .format(
+            uchimeout_path = os.path.join(
+                temp_dir, 'run_{}_marker_{}_sample_{}_uchimeout.tsv' .format(
                     run_id, marker_id, sample_id))
+            uchime_input_hash = self.get_uchime_input_hash(
+                uchime_fasta_path=uchime_fasta_path, uchime3_denovo_abskew=uchime3_denovo_abskew)
+            job_list.append(((run_id, marker_id, sample_id), uchime_fasta_path, uchimeout_path, uchime_input_hash))
 
-            #
-            # Create object and run_name vsearch
-            vsearch_parameters = {'uchime3_denovo': uchime_fasta_path,
-                                  'borderline': uchime_borderline_fasta_path,
-                                  'nonchimeras': uchime_nonchimeras_fasta_path,
-                                  'chimeras': uchime_chimeras_fasta_path,
-                                  'abskew': uchime3_denovo_abskew,
-                                  }
-            vsearch_cluster = RunnerVSearch(parameters=vsearch_parameters)
-            vsearch_cluster.run()
-
-            ###################################################################
-            #
-            # 4. Delete variant from replicate/sample if chimeras
-            #
-            ###################################################################
-
-            Logger.instance().debug(
-                "Vsearch uchime chimera tsv_path: {}".format(uchime_chimeras_fasta_path))
-            with open(uchime_chimeras_fasta_path, "r") as handle:
-                for chimera_seqrecord in SeqIO.parse(handle, "fasta"):
-                    variant_id = int(chimera_seqrecord.id.split(';')[0])
-                    filter_output_chimera_df.loc[(filter_output_chimera_df['run_id'] == run_id)
-                                                 & (filter_output_chimera_df['marker_id'] == marker_id)
-                                                 & (filter_output_chimera_df['sample_id'] == sample_id)
-                                                 & (filter_output_chimera_df['variant_id'] == variant_id), 'filter_delete'] = True
-
-            Logger.instance().debug("Vsearch uchime chimera borderline tsv_path: {}".format(
-                uchime_borderline_fasta_path))
-            with open(uchime_borderline_fasta_path, "r") as handle:
-                for chimera_seqrecord in SeqIO.parse(handle, "fasta"):
-                    variant_id = int(chimera_seqrecord.id.split(';')[0])
-                    filter_output_borderline_df.loc[(filter_output_borderline_df['run_id'] == run_id)
-                                                    & (filter_output_borderline_df['marker_id'] == marker_id)
-                                                    & (filter_output_borderline_df['sample_id'] == sample_id)
-                                                    & (filter_output_borderline_df['variant_id'] == variant_id), 'filter_delete'] = True
+        ###################################################################
+        #
+        # Reuse cached results of identical uchime3_denovo inputs
+        #
+        ###################################################################
 
-        return filter_output_chimera_df, filter_output_borderline_df
+        chimera_key_set = set()
+        borderline_key_set = set()
+
+        cache_dic = self.get_cache_dic(
+            uchime_input_hash_list=[job[3] for job in job_list])
+        for run_marker_sample, uchime_fasta_path, uchimeout_path, uchime_input_hash in job_list:
+            if uchime_input_hash in cache_dic:
+                chimera_variant_id_set, borderline_variant_id_set = cache_dic[uchime_input_hash]
+                chimera_key_set.update(
+                    run_marker_sample + (variant_id,) for variant_id in chimera_variant_id_set)
+                borderline_key_set.update(
+                    run_marker_sample + (variant_id,) for variant_id in borderline_variant_id_set)
+        Logger.instance().debug(
+            "Uchime3_denovo cache hits: {} of {} samples".format(
+                sum(job[3] in cache_dic for job in job_list), len(job_list)))
+        job_list = [job for job in job_list if job[3] not in cache_dic]
+
+        ###################################################################
+        #
+        # Run remaining uchime3_denovo jobs concurrently
+        #
+        ###################################################################
+
+        cache_new_dic = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.num_threads) as executor:
+            future_to_run_marker_sample = {
+                executor.submit(
+                    self.run_uchime3_denovo, uchime_fasta_path, uchimeout_path, uchime3_denovo_abskew):
+                    (run_marker_sample, uchime_input_hash)
+                for run_marker_sample, uchime_fasta_path, uchimeout_path, uchime_input_hash in job_list}
+            for future in concurrent.futures.as_completed(future_to_run_marker_sample):
+                run_marker_sample, uchime_input_hash = future_to_run_marker_sample[future]
+                chimera_variant_id_set, borderline_variant_id_set = future.result()
+                cache_new_dic[uchime_input_hash] = (chimera_variant_id_set, borderline_variant_id_set)
+                chimera_key_set.update(
+                    run_marker_sample + (variant_id,) for variant_id in chimera_variant_id_set)
+                borderline_key_set.update(
+                    run_marker_sample + (variant_id,) for variant_id in borderline_variant_id_set)
+
+        self.insert_cache(cache_dic=cache_new_dic)
+
+        return chimera_key_set, borderline_key_set
+
+    @staticmethod
+    def get_uchime_input_hash(uchime_fasta_path, uchime3_denovo_abskew):
+        """Returns the sha256 hex digest of the uchime3_denovo input FASTA (ids, sizes and sequences in abundance
+        order) together with the abskew parameter"""
+
+        uchime_input_hash = hashlib.sha256()
+        with open(uchime_fasta_path, 'rb') as fin:
+            for chunk in iter(lambda: fin.read(1 << 20), b''):
+                uchime_input_hash.update(chunk)
+        uchime_input_hash.update('abskew={}'.format(float(uchime3_denovo_abskew)).encode())
+        return uchime_input_hash.hexdigest()
+
+    def get_cache_dic(self, uchime_input_hash_list):
+        """Returns a dictionary uchime_input_hash: (chimera_variant_id_set, borderline_variant_id_set) with the
+        cached results of these hashes"""
+
+        cache_dic = {}
+        if self.engine is None or len(uchime_input_hash_list) == 0:
+            return cache_dic
+
+        uchime_input_hash_list = list(dict.fromkeys(uchime_input_hash_list))
+        cache_declarative_table = FilterChimeraCache.__table__
+        with self.engine.connect() as conn:
+            for i in range(0, len(uchime_input_hash_list), self.in_clause_size):
+                stmt = sqlalchemy.select([
+                    cache_declarative_table.c.uchime_input_hash,
+                    cache_declarative_table.c.chimera_variant_id_list,
+                    cache_declarative_table.c.borderline_variant_id_list])\
+                    .where(cache_declarative_table.c.uchime_input_hash.in_(
+                        uchime_input_hash_list[i:i + self.in_clause_size]))
+                for row in conn.execute(stmt).fetchall():
+                    cache_dic[row[0]] = (
+                        {int(variant_id) for variant_id in row[1].split(',') if variant_id != ''},
+                        {int(variant_id) for variant_id in row[2].split(',') if variant_id != ''})
+        return cache_dic
+
+    def insert_cache(self, cache_dic):
+        """Stores new uchime3_denovo results in the FilterChimeraCache table. Hashes already stored by another
+        process since get_cache_dic are ignored"""
+
+        if self.engine is None or len(cache_dic) == 0:
+            return
+
+        record_list = []
+        for uchime_input_hash, (chimera_variant_id_set, borderline_variant_id_set) in cache_dic.items():
+            record_list.append({
+                'uchime_input_hash': uchime_input_hash,
+                'chimera_variant_id_list': ','.join(map(str, sorted(chimera_variant_id_set))),
+                'borderline_variant_id_list': ','.join(map(str, sorted(borderline_variant_id_set)))})
+        with self.engine.connect() as conn:
+            conn.execute(FilterChimeraCache.__table__.insert().prefix_with('OR IGNORE'), record_list)
+
+    @classmethod
+    def run_uchime3_denovo(cls, uchime_fasta_path, uchimeout_path, uchime3_denovo_abskew):
+        """Runs single-threaded vsearch uchime3_denovo on one abundance-sorted fasta_path
+
+        :return: tuple with two sets of variant_id: chimeras and borderline
+        """
+
+        # An uchimeout left by an earlier run must not be read if vsearch fails
+        if os.path.isfile(uchimeout_path):
+            os.remove(uchimeout_path)
+        vsearch_parameters = {'uchime3_denovo': uchime_fasta_path,
+                              'uchimeout': uchimeout_path,
+                              'abskew': uchime3_denovo_abskew,
+                              'threads': 1,
+                              }
+        vsearch_cluster = RunnerVSearch(parameters=vsearch_parameters)
+        run_result = vsearch_cluster.run()
+        if run_result.returncode != 0 or not os.path.isfile(uchimeout_path):
+            Logger.instance().error("vsearch --uchime3_denovo failed with return code {}: {}".format(
+                run_result.returncode, uchime_fasta_path))
+            sys.exit(1)
+
+        Logger.instance().debug(
+            "Vsearch uchime chimera tsv_path: {}".format(uchimeout_path))
+        return cls.read_uchimeout(uchimeout_path)
+
+    @staticmethod
+    def read_uchimeout(uchimeout_path):
+        """Reads line by line the vsearch --uchimeout table, where the query label is the second column
+        (variant_id;size=N) and the chimera flag the last column: Y (chimera), N (non-chimera), ? (borderline)
+
+        :param uchimeout_path: Path to the --uchimeout tsv_path
+        :return: tuple with two sets of variant_id: chimeras and borderline
+        """
+
+        chimera_variant_id_set = set()
+        borderline_variant_id_set = set()
+        with open(uchimeout_path, "r") as fin:
+            for line in fin:
+                line_list = line.rstrip('\n').split('\t')
+                if len(line_list) < 3:
+                    continue
+                variant_id = int(line_list[1].split(';')[0])
+                if line_list[-1] == 'Y':
+                    chimera_variant_id_set.add(variant_id)
+                elif line_list[-1] == '?':
+                    borderline_variant_id_set.add(variant_id)
+        return chimera_variant_id_set, borderline_variant_id_set
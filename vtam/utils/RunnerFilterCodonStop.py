@@ -1,12 +1,25 @@
 import Bio
+import numpy
+import sqlalchemy
+
+from vtam.models.FilterCodonStopCache import FilterCodonStopCache
 
 
 class RunnerFilterCodonStop(object):
 
-    def __init__(self, variant_read_count_df):
-        """Carries out a chimera analysis"""
+    # Number of sequences scanned at once by the vectorized stop codon scanner
+    scan_chunk_size = 10000
+    # Maximal number of values in one IN clause, below the SQLite limit of host parameters
+    in_clause_size = 900
+
+    def __init__(self, variant_read_count_df, engine=None):
+        """Carries out a chimera analysis
+
+        :param engine: sqlalchemy engine with the FilterCodonStopCache table. If None, all variants are scanned
+        """
         self.variant_read_count_df = variant_read_count_df
         self.genetic_code = None
+        self.engine = engine
 
     def get_variant_read_count_delete_df(
             self,
@@ -43,22 +56,111 @@ class RunnerFilterCodonStop(object):
         variant_df['sequence'] = variant_df['sequence'].str.upper()
 
         variant_has_stop_codon_df = variant_df.copy()
-        variant_has_stop_codon_df['has_stop_codon'] = 0
-
-        for row in variant_df.iterrows():
-            id = row[0]
-            sequence = row[1].sequence
-            #
-            variant_has_stop_codon_frame1 = self.seq_has_codon_stop(sequence=sequence, frame=1, genetic_code=genetic_code)
-            variant_has_stop_codon_frame2 = self.seq_has_codon_stop(sequence=sequence, frame=2, genetic_code=genetic_code)
-            variant_has_stop_codon_frame3 = self.seq_has_codon_stop(sequence=sequence, frame=3, genetic_code=genetic_code)
-
-            # Check if all frames have stop codons
-            if variant_has_stop_codon_frame1 and variant_has_stop_codon_frame2 and variant_has_stop_codon_frame3:
-                variant_has_stop_codon_df.loc[variant_has_stop_codon_df.index ==
-                                              id, 'has_stop_codon'] = 1
+
+        #######################################################################
+        #
+        # Reuse cached has_stop_codon of known variants and scan the others
+        #
+        #######################################################################
+
+        cache_dic = self.get_cache_dic(
+            variant_id_list=variant_has_stop_codon_df.index.tolist(), genetic_code=genetic_code)
+        is_cached = variant_has_stop_codon_df.index.isin(list(cache_dic.keys()))
+        has_stop_codon_array = numpy.zeros(variant_has_stop_codon_df.shape[0], dtype=bool)
+        has_stop_codon_array[is_cached] = [
+            cache_dic[variant_id] for variant_id in variant_has_stop_codon_df.index[is_cached]]
+
+        variant_to_scan_df = variant_has_stop_codon_df.loc[~is_cached]
+        has_stop_codon_array[~is_cached] = self.scan_stop_codon_in_all_frames(
+            sequence_list=variant_to_scan_df.sequence.tolist(), genetic_code=genetic_code)
+        variant_has_stop_codon_df['has_stop_codon'] = has_stop_codon_array.astype(int)
+
+        self.insert_cache(variant_id_list=variant_to_scan_df.index.tolist(),
+                          has_stop_codon_list=has_stop_codon_array[~is_cached].tolist(), genetic_code=genetic_code)
+
         return variant_has_stop_codon_df
 
+    @classmethod
+    def scan_stop_codon_in_all_frames(cls, sequence_list, genetic_code):
+        """Takes a list of sequences and returns whether each of them has stop codons in the three reading frames.
+        Sequences are scanned in chunks as a padded 2D byte array, where each position is encoded as a codon.
+
+        Parameters
+        ----------
+        sequence_list: list
+            DNA sequences in upper case
+        genetic_code : int
+            NCBI genetic_codes: https://www.ncbi.nlm.nih.gov/Taxonomy/Utils/wprintgc.cgi
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean array, True if the three frames have at least one stop codon
+
+        """
+
+        # Nucleotides to 0-3, other characters (Including padding) to 4
+        nucleotide_code_array = numpy.full(256, 4, dtype=numpy.uint8)
+        for nucleotide_code, nucleotide in enumerate(b'ACGT'):
+            nucleotide_code_array[nucleotide] = nucleotide_code
+        nucleotide_code_array[ord('U')] = 3
+
+        stop_codon_list = Bio.Data.CodonTable.generic_by_id[genetic_code].__dict__[
+            'stop_codons']
+        stop_codon_code_array = numpy.array(
+            [sum(int(nucleotide_code_array[ord(nucleotide)]) * 5 ** (2 - i) for i, nucleotide in enumerate(codon))
+             for codon in stop_codon_list])
+
+        has_stop_codon_array = numpy.zeros(len(sequence_list), dtype=bool)
+        for chunk_start in range(0, len(sequence_list), cls.scan_chunk_size):
+            chunk_sequence_list = sequence_list[chunk_start:chunk_start + cls.scan_chunk_size]
+            max_length = max(len(sequence) for sequence in chunk_sequence_list)
+            if max_length < 3:
+                continue
+            sequence_array = numpy.frombuffer(
+                b''.join(sequence.encode().ljust(max_length, b'N') for sequence in chunk_sequence_list),
+                dtype=numpy.uint8).reshape(len(chunk_sequence_list), max_length)
+            sequence_array = nucleotide_code_array[sequence_array].astype(numpy.int16)
+            # Codon starting at each position, padding codons never match a stop codon
+            codon_array = sequence_array[:, :-2] * 25 + sequence_array[:, 1:-1] * 5 + sequence_array[:, 2:]
+            is_stop_codon_array = numpy.isin(codon_array, stop_codon_code_array)
+            has_stop_codon_array[chunk_start:chunk_start + len(chunk_sequence_list)] = \
+                is_stop_codon_array[:, 0::3].any(axis=1) \
+                & is_stop_codon_array[:, 1::3].any(axis=1) \
+                & is_stop_codon_array[:, 2::3].any(axis=1)
+        return has_stop_codon_array
+
+    def get_cache_dic(self, variant_id_list, genetic_code):
+        """Returns a dictionary variant_id: has_stop_codon with the cached variants of variant_id_list for this
+        genetic_code"""
+
+        cache_dic = {}
+        if self.engine is None:
+            return cache_dic
+        variant_id_list = list(dict.fromkeys(int(variant_id) for variant_id in variant_id_list))
+        cache_declarative_table = FilterCodonStopCache.__table__
+        with self.engine.connect() as conn:
+            for i in range(0, len(variant_id_list), self.in_clause_size):
+                stmt = sqlalchemy.select([
+                    cache_declarative_table.c.variant_id,
+                    cache_declarative_table.c.has_stop_codon])\
+                    .where(cache_declarative_table.c.genetic_code == genetic_code)\
+                    .where(cache_declarative_table.c.variant_id.in_(variant_id_list[i:i + self.in_clause_size]))
+                cache_dic.update(conn.execute(stmt).fetchall())
+        return cache_dic
+
+    def insert_cache(self, variant_id_list, has_stop_codon_list, genetic_code):
+        """Stores has_stop_codon of newly scanned variants in the FilterCodonStopCache table. Variants already stored
+        by another process since get_cache_dic are ignored"""
+
+        if self.engine is None or len(variant_id_list) == 0:
+            return
+        record_list = [{'variant_id': int(variant_id), 'genetic_code': genetic_code,
+                        'has_stop_codon': bool(has_stop_codon)}
+                       for variant_id, has_stop_codon in zip(variant_id_list, has_stop_codon_list)]
+        with self.engine.connect() as conn:
+            conn.execute(FilterCodonStopCache.__table__.insert().prefix_with('OR IGNORE'), record_list)
+
     def seq_has_codon_stop(self, sequence, frame, genetic_code):
         """Takes one sequence and returns whether it has a stop codon or not
 
@@ -1,3 +1,8 @@
+import pandas
+
+from vtam.utils.DataframeVariantReadCountLike import DataframeVariantReadCountLike
+
+
 class RunnerFilterIndel:
 
     def __init__(self, variant_read_count_df):
@@ -17,20 +22,17 @@ class RunnerFilterIndel:
 
         else:
 
-            variant_read_count_delete_df = self.variant_read_count_df.copy()
-            variant_read_count_delete_df['filter_delete'] = False
-            #
             df = variant_df.copy()
             df['sequence_length_module_3'] = variant_df.sequence.apply(
                 lambda x: len(x) % 3)  # compute module for each variant
-            #  most common remaining of modulo 3
+            #  most common remaining of modulo 3
             majority_sequence_length_module_3 = df.sequence_length_module_3.mode()
             # select id of variant that do not pass on a list
             df = df.loc[df['sequence_length_module_3'] !=
                         majority_sequence_length_module_3.values[0]]
             #
-            for id in df.index.tolist():
-                variant_read_count_delete_df.loc[variant_read_count_delete_df['variant_id']
-                                                 == id, 'filter_delete'] = True
+            delete_key_df = pandas.DataFrame({'variant_id': df.index.tolist()})
+            variant_read_count_delete_df = DataframeVariantReadCountLike(
+                self.variant_read_count_df).get_filter_delete_df(delete_key_df=delete_key_df)
 
         return variant_read_count_delete_df
@@ -117,8 +117,8 @@ class RunnerFilterLFN:
 
         if lfn_denominator == 'N_i':  # variant
             this_filter_id = 2
-            N_df = self.variant_read_count_lfn_df.get_N_i_df()  #  Compute N_i_df
-            filter_df = self.variant_read_count_df.merge(N_df, on=['run_id', 'marker_id', 'variant_id'])
+            filter_df = self.variant_read_count_df.reset_index(drop=True)
+            filter_df['N_i'] = self.variant_read_count_lfn_df.get_N_column('N_i')  # Compute N_i
             filter_df['filter_id'] = this_filter_id
             filter_df['cutoff'] = cutoff
 
@@ -136,9 +136,8 @@ class RunnerFilterLFN:
 
         elif lfn_denominator == 'N_ik':  # variant_replicate
             this_filter_id = 3
-            N_df = self.variant_read_count_lfn_df.get_N_ik_df()  #  Compute N_ik_df
-            filter_df = self.variant_read_count_df.merge(
-                N_df, on=['run_id', 'marker_id', 'variant_id', 'replicate'])
+            filter_df = self.variant_read_count_df.reset_index(drop=True)
+            filter_df['N_ik'] = self.variant_read_count_lfn_df.get_N_column('N_ik')  # Compute N_ik
             filter_df['lfn_ratio'] = filter_df.read_count / filter_df.N_ik
             filter_df['filter_id'] = this_filter_id
             filter_df['cutoff'] = cutoff
@@ -157,11 +156,8 @@ class RunnerFilterLFN:
 
         elif lfn_denominator == 'N_jk':  # sample_replicate
             this_filter_id = 6
-            N_df = self.variant_read_count_lfn_df.get_N_jk_df()  #  Compute N_jk_df
-            filter_df = self.variant_read_count_df.merge(
-                N_df, left_on=[
-                    'run_id', 'marker_id', 'sample_id', 'replicate'], right_on=[
-                    'run_id', 'marker_id', 'sample_id', 'replicate'])
+            filter_df = self.variant_read_count_df.reset_index(drop=True)
+            filter_df['N_jk'] = self.variant_read_count_lfn_df.get_N_column('N_jk')  # Compute N_jk
             filter_df['lfn_ratio'] = filter_df.read_count / filter_df.N_jk
             filter_df['filter_id'] = this_filter_id
             filter_df['cutoff'] = cutoff
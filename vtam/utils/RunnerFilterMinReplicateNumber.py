@@ -1,4 +1,4 @@
-import pandas
+from vtam.utils.VariantReadCountFrame import VariantReadCountFrame
 
 
 class RunnerFilterMinReplicateNumber:
@@ -34,22 +34,13 @@ class RunnerFilterMinReplicateNumber:
         :rtype: None
         """
         #
-        variant_read_count_delete_df = self.variant_read_count_df.copy()
-        # replicate count
-        df_grouped = self.variant_read_count_df.groupby(
-            by=['run_id', 'marker_id', 'variant_id', 'sample_id']).count().reset_index()
-        df_grouped = df_grouped[['run_id',
-                                 'marker_id',
-                                 'variant_id',
-                                 'sample_id',
-                                 'replicate']]  # keep columns
-        df_grouped = df_grouped.rename(
-            columns={'replicate': 'replicate_count'})
+        variant_read_count_delete_df = self.variant_read_count_df.reset_index(drop=True)
+        # replicate count of each row
+        variant_read_count_delete_df['replicate_count'] = VariantReadCountFrame(
+            self.variant_read_count_df).transform_read_count(
+            column_list=['run_id', 'marker_id', 'variant_id', 'sample_id'], func='count')
         #
         variant_read_count_delete_df['filter_delete'] = False
-        variant_read_count_delete_df = pandas.merge(
-            variant_read_count_delete_df, df_grouped, on=[
-                'run_id', 'marker_id', 'variant_id', 'sample_id'], how='inner')
         variant_read_count_delete_df.loc[variant_read_count_delete_df.replicate_count <
                                          min_replicate_number, 'filter_delete'] = True
         #
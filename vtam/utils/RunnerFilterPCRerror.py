@@ -35,19 +35,44 @@ class RunnerFilterPCRerror(object):
 
         variant_unexpected_to_expected_ratio_df = self.get_variant_unexpected_to_expected_ratio_df()
 
-        # Initiates filter_output_df
-        filter_output_df = self.__variant_read_count_df.copy()
-        filter_output_df['filter_delete'] = False
-
-        for row in variant_unexpected_to_expected_ratio_df.itertuples():
-            if float(getattr(row, 'N_ij_unexpected_to_expected_ratio')
-                     ) < pcr_error_var_prop:
-                filter_output_df.loc[(filter_output_df['run_id'] == row.run_id)
-                                     & (filter_output_df['marker_id'] == row.marker_id)
-                                     & (filter_output_df['sample_id'] == row.sample_id)
-                                     & (filter_output_df['variant_id'] == row.variant_id_unexpected), 'filter_delete'] = True
+        # Keys (run_id, marker_id, sample_id, variant_id) of the unexpected variants to delete
+        delete_key_df = variant_unexpected_to_expected_ratio_df.loc[
+            variant_unexpected_to_expected_ratio_df.N_ij_unexpected_to_expected_ratio.astype(float) < pcr_error_var_prop,
+            ['run_id', 'marker_id', 'sample_id', 'variant_id_unexpected']]
+        delete_key_df = delete_key_df.rename(columns={'variant_id_unexpected': 'variant_id'})
+
+        filter_output_df = DataframeVariantReadCountLike(
+            self.__variant_read_count_df).get_filter_delete_df(delete_key_df=delete_key_df)
         return filter_output_df
 
+    @classmethod
+    def get_variant_read_count_delete_df_per_sample(
+            cls, variant_df, variant_read_count_df, pcr_error_var_prop):
+        """Runs the PCR error filter separately for each run-marker-sample, where the expected and unexpected
+        variants are the variants of this sample
+
+        :param variant_df: DataFrame (id, sequence) with id as index
+        :param variant_read_count_df: DataFrame (run_id, marker_id, sample_id, replicate, variant_id, read_count)
+        :param pcr_error_var_prop: float
+        :return: DataFrame variant_read_count_df with filter_delete column
+        """
+
+        filter_output_df_list = []
+        for (run_id, marker_id, sample_id), variant_read_count_per_sample_df in variant_read_count_df.groupby(
+                ['run_id', 'marker_id', 'sample_id'], sort=False):
+
+            variant_per_sample_df = variant_df.loc[variant_df.index.isin(
+                variant_read_count_per_sample_df.variant_id.unique().tolist())]
+
+            filter_pcr_error_runner = cls(
+                variant_expected_df=variant_per_sample_df,
+                variant_unexpected_df=variant_per_sample_df,
+                variant_read_count_df=variant_read_count_per_sample_df)
+            filter_output_df_list.append(
+                filter_pcr_error_runner.get_variant_read_count_delete_df(pcr_error_var_prop))
+
+        return pandas.concat(filter_output_df_list, axis=0)
+
     def get_vsearch_alignement_df(self):
         """
         This function runs vsearch to detect PCR errors (1 mism or gap) between the "db" and the "query" sets
@@ -1,6 +1,9 @@
 import itertools
+import numpy
 import pandas
 
+from vtam.utils.DataframeVariantReadCountLike import DataframeVariantReadCountLike
+
 
 class RunnerFilterRenkonen(object):
     """Has attributes and methods to run_name the Renkonen error Filter"""
@@ -15,9 +18,6 @@ class RunnerFilterRenkonen(object):
 
     def get_variant_read_count_delete_df(self, renkonen_distance_quantile):
 
-        filter_out_df = self.variant_read_count_df.copy()
-        filter_out_df['filter_delete'] = False
-
         nb_of_replicates_df = self.variant_read_count_df[['run_id', 'marker_id', 'sample_id', 'replicate']]\
             .drop_duplicates().groupby(
             ['run_id', 'marker_id', 'sample_id']).count().reset_index()
@@ -31,108 +31,135 @@ class RunnerFilterRenkonen(object):
 
         renkonen_distance_df[
             'above_renkonen_distance_quantile'] = renkonen_distance_df.renkonen_distance > renkonen_distance_cutoff
-        for run_marker_sample_replicate_row_i, run_marker_sample_replicate_row in self.variant_read_count_df[[
-                'run_id', 'marker_id', 'sample_id', 'replicate']].drop_duplicates().iterrows():
-            run_id = run_marker_sample_replicate_row.run_id
-            marker_id = run_marker_sample_replicate_row.marker_id
-            sample_id = run_marker_sample_replicate_row.sample_id
-            replicate = run_marker_sample_replicate_row.replicate
-
-            run_marker_sample_replicate_renkonen_df = renkonen_distance_df.loc[
-                (renkonen_distance_df.run_id == run_id) & (
-                    renkonen_distance_df.marker_id == marker_id) & (
-                    renkonen_distance_df.sample_id == sample_id) & (
-                    (renkonen_distance_df.replicate_left == replicate) | (
-                        renkonen_distance_df.replicate_right == replicate))]
-
-            nb_replicates = int(nb_of_replicates_df.loc[
-                (nb_of_replicates_df.run_id == run_id) & (nb_of_replicates_df.marker_id == marker_id) & (
-                    nb_of_replicates_df.sample_id == sample_id), 'nb_replicates'].values)
-
-            delete_replicate = run_marker_sample_replicate_renkonen_df.above_renkonen_distance_quantile.sum(
-            ) > (nb_replicates - 1) / 2
-            filter_out_df.loc[(filter_out_df.run_id == run_id) & (filter_out_df.marker_id == marker_id) &
-                              (filter_out_df.sample_id == sample_id) &
-                              (filter_out_df.replicate == replicate), 'filter_delete'] = delete_replicate
+
+        #######################################################################
+        #
+        # Count for each replicate the pairs above the quantile, where this replicate is either left or right
+        # Delete replicate if this count is above (nb_replicates - 1) / 2
+        #
+        #######################################################################
+
+        replicate_above_quantile_df = pandas.concat([
+            renkonen_distance_df[['run_id', 'marker_id', 'sample_id', 'replicate_left',
+                                  'above_renkonen_distance_quantile']].rename(
+                {'replicate_left': 'replicate'}, axis=1),
+            renkonen_distance_df[['run_id', 'marker_id', 'sample_id', 'replicate_right',
+                                  'above_renkonen_distance_quantile']].rename(
+                {'replicate_right': 'replicate'}, axis=1)], axis=0)
+        replicate_above_quantile_df = replicate_above_quantile_df.groupby(
+            ['run_id', 'marker_id', 'sample_id', 'replicate']).above_renkonen_distance_quantile.sum().reset_index()
+        replicate_above_quantile_df = replicate_above_quantile_df.merge(
+            nb_of_replicates_df, on=['run_id', 'marker_id', 'sample_id'])
+
+        delete_key_df = replicate_above_quantile_df.loc[
+            replicate_above_quantile_df.above_renkonen_distance_quantile
+            > (replicate_above_quantile_df.nb_replicates - 1) / 2,
+            ['run_id', 'marker_id', 'sample_id', 'replicate']]
+
+        filter_out_df = DataframeVariantReadCountLike(
+            self.variant_read_count_df).get_filter_delete_df(delete_key_df=delete_key_df)
         return filter_out_df
 
-    def get_renkonen_distance_for_one_replicate_pair(
-            self, run_marker_sample_df, replicate_left, replicate_right):
-        """ Given run_name, marker_name, sample and left and right replicates computes renkonen distance
+    @classmethod
+    def get_variant_read_count_delete_df_per_run_marker(
+            cls, variant_read_count_df, renkonen_distance_quantile):
+        """Runs the Renkonen filter separately for each run-marker. Run-markers with a single replicate are kept.
 
-        :type
+        :param variant_read_count_df: DataFrame (run_id, marker_id, sample_id, replicate, variant_id, read_count)
+        :param renkonen_distance_quantile: float
+        :return: DataFrame variant_read_count_df with filter_delete column
         """
 
-        replicate_pair_vertical_df = run_marker_sample_df.loc[(run_marker_sample_df.replicate == replicate_left) | (
-            run_marker_sample_df.replicate == replicate_right)]
+        filter_output_df_list = []
+        for (run_id, marker_id), variant_read_count_per_run_marker_df in variant_read_count_df.groupby(
+                ['run_id', 'marker_id'], sort=False):
 
-        N_j_k_df = replicate_pair_vertical_df[['run_id',
-                                               'marker_id',
-                                               'sample_id',
-                                               'replicate',
-                                               'read_count']] .groupby(by=['run_id',
-                                                                           'marker_id',
-                                                                           'sample_id',
-                                                                           'replicate']).sum().reset_index()
-        replicate_pair_vertical_df = replicate_pair_vertical_df.merge(
-            N_j_k_df, left_on=[
-                'run_id', 'marker_id', 'sample_id', 'replicate'], right_on=[
-                'run_id', 'marker_id', 'sample_id', 'replicate'])
-        replicate_pair_vertical_df.rename(
-            {'read_count_x': 'N_i_j_k', 'read_count_y': 'N_j_k'}, axis=1, inplace=True)
-        replicate_pair_vertical_df['N_i_j_k/N_j_k'] = replicate_pair_vertical_df['N_i_j_k'] / \
-            replicate_pair_vertical_df['N_j_k']
-        replicate_left_df = replicate_pair_vertical_df.loc[
-            replicate_pair_vertical_df.replicate == replicate_left]
-        replicate_right_df = replicate_pair_vertical_df.loc[
-            replicate_pair_vertical_df.replicate == replicate_right]
-        replicate_pair_horizontal_df = replicate_left_df.merge(
-            replicate_right_df, on=[
-                'run_id', 'marker_id', 'sample_id', 'variant_id'], how='outer')
-        replicate_pair_horizontal_df.fillna(0, inplace=True)
-        replicate_pair_horizontal_df['min'] = replicate_pair_horizontal_df.apply(
-            lambda x: min(x['N_i_j_k/N_j_k_x'], x['N_i_j_k/N_j_k_y']), axis=1)
-        renkonen_distance = 1 - replicate_pair_horizontal_df['min'].sum()
+            if variant_read_count_per_run_marker_df.replicate.unique().shape[0] > 1:  # if more than one replicate
+                filter_output_i_df = cls(variant_read_count_per_run_marker_df)\
+                    .get_variant_read_count_delete_df(renkonen_distance_quantile)
+            else:  # Just one replicate
+                filter_output_i_df = variant_read_count_per_run_marker_df.copy()
+                filter_output_i_df['filter_delete'] = False
+            filter_output_df_list.append(filter_output_i_df)
 
-        return renkonen_distance
+        return pandas.concat(filter_output_df_list, axis=0)
 
-    def get_renkonen_distance_df_for_all_sample_replicates(self):
+    @staticmethod
+    def get_replicate_variant_matrix(run_marker_sample_df):
+        """Pivots the variant read counts of one run-marker-sample into a dense replicates x variants matrix of
+        relative abundances N_ijk/N_jk
 
-        renkonen_distance_df = pandas.DataFrame()
+        :param run_marker_sample_df: DataFrame (run_id, marker_id, sample_id, replicate, variant_id, read_count)
+        :return: tuple (replicate array in order of appearance, numpy.ndarray replicates x variants)
+        """
 
-        for pos, row in self.variant_read_count_df[[
-                'run_id', 'marker_id', 'sample_id']].drop_duplicates().iterrows():
+        replicate_codes, replicate_array = pandas.factorize(run_marker_sample_df.replicate)
+        variant_codes, variant_array = pandas.factorize(run_marker_sample_df.variant_id)
 
-            run_id = row.run_id
-            marker_id = row.marker_id
-            sample_id = row.sample_id
+        replicate_variant_matrix = numpy.zeros((len(replicate_array), len(variant_array)))
+        numpy.add.at(replicate_variant_matrix, (replicate_codes, variant_codes),
+                     run_marker_sample_df.read_count.to_numpy(dtype=float))
 
-            run_marker_sample_df = self.variant_read_count_df.loc[(self.variant_read_count_df.run_id == run_id) & (
-                self.variant_read_count_df.marker_id == marker_id) & (self.variant_read_count_df.sample_id == sample_id)]
+        N_jk = replicate_variant_matrix.sum(axis=1, keepdims=True)
+        replicate_variant_matrix = numpy.divide(
+            replicate_variant_matrix, N_jk, out=numpy.zeros_like(replicate_variant_matrix), where=N_jk > 0)
 
-            replicate_pairs = list(
-                itertools.combinations(
-                    run_marker_sample_df.replicate.unique(), 2))
+        return replicate_array, replicate_variant_matrix
 
-            for replicate_left, replicate_right in replicate_pairs:
+    def get_renkonen_distance_for_one_replicate_pair(
+            self, run_marker_sample_df, replicate_left, replicate_right):
+        """ Given run_name, marker_name, sample and left and right replicates computes renkonen distance
 
-                renkonen_distance = self.get_renkonen_distance_for_one_replicate_pair(
-                    run_marker_sample_df, replicate_left=replicate_left, replicate_right=replicate_right)
+        :type
+        """
 
-                renkonen_distance_df = pandas.concat(
-                    [
-                        renkonen_distance_df,
-                        pandas.DataFrame(
-                            {
-                                'run_id': run_id,
-                                'marker_id': marker_id,
-                                'sample_id': sample_id,
-                                'replicate_left': replicate_left,
-                                'replicate_right': replicate_right,
-                                'renkonen_distance': renkonen_distance},
-                            index=[0])],
-                    axis=0)
+        replicate_pair_df = run_marker_sample_df.loc[(run_marker_sample_df.replicate == replicate_left) | (
+            run_marker_sample_df.replicate == replicate_right)]
+        replicate_array, replicate_variant_matrix = self.get_replicate_variant_matrix(replicate_pair_df)
+
+        replicate_list = replicate_array.tolist()
+        renkonen_distance = 1 - numpy.minimum(
+            replicate_variant_matrix[replicate_list.index(replicate_left)],
+            replicate_variant_matrix[replicate_list.index(replicate_right)]).sum()
+
+        return renkonen_distance
+
+    def get_renkonen_distance_df_for_all_sample_replicates(self):
 
-        renkonen_distance_df = renkonen_distance_df.reset_index(drop=True)
+        run_id_list = []
+        marker_id_list = []
+        sample_id_list = []
+        replicate_left_list = []
+        replicate_right_list = []
+        renkonen_distance_list = []
+
+        for (run_id, marker_id, sample_id), run_marker_sample_df in self.variant_read_count_df.groupby(
+                ['run_id', 'marker_id', 'sample_id'], sort=False):
+
+            replicate_array, replicate_variant_matrix = self.get_replicate_variant_matrix(run_marker_sample_df)
+
+            replicate_pair_list = list(itertools.combinations(range(len(replicate_array)), 2))
+            if len(replicate_pair_list) == 0:
+                continue
+            left_index, right_index = (numpy.array(index_list) for index_list in zip(*replicate_pair_list))
+
+            # All pairwise renkonen distances of this sample at once
+            renkonen_distance_array = 1 - numpy.minimum(
+                replicate_variant_matrix[left_index], replicate_variant_matrix[right_index]).sum(axis=1)
+
+            run_id_list += [run_id] * len(replicate_pair_list)
+            marker_id_list += [marker_id] * len(replicate_pair_list)
+            sample_id_list += [sample_id] * len(replicate_pair_list)
+            replicate_left_list += replicate_array[left_index].tolist()
+            replicate_right_list += replicate_array[right_index].tolist()
+            renkonen_distance_list += renkonen_distance_array.tolist()
+
+        renkonen_distance_df = pandas.DataFrame({
+            'run_id': run_id_list,
+            'marker_id': marker_id_list,
+            'sample_id': sample_id_list,
+            'replicate_left': replicate_left_list,
+            'replicate_right': replicate_right_list,
+            'renkonen_distance': renkonen_distance_list})
 
         return renkonen_distance_df
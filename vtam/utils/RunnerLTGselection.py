@@ -1,17 +1,29 @@
+import multiprocessing
+import numpy
 import pandas
 
 from vtam.utils.FileParams import FileParams
+from vtam.utils.Logger import Logger
 from vtam.utils.constants import rank_hierarchy, identity_list
 
 
 class RunnerLTGselection(object):
     """Takes a DF with columns: variant_id, %identity, 'target_tax_id', 'no rank', 'species', ...
-    and the returns the LTG for each variant"""
+    and the returns the LTG for each variant
 
-    def __init__(self, variant_identity_lineage_df, taxonomy_df, params):
+    With num_threads above one and enough hits, the variants are partitioned across forked processes, which read
+    the hit and lineage arrays of the parent process instead of receiving pickled copies."""
+
+    # Minimal number of hits for each process
+    process_hit_count = 100000
+    # Hit arrays of the parent process, read by the forked processes
+    fork_shared_dic = {}
+
+    def __init__(self, variant_identity_lineage_df, taxonomy_df, params, num_threads=1):
 
         self.variantid_identity_lineage_df = variant_identity_lineage_df
         self.taxonomy_df = taxonomy_df
+        self.num_threads = num_threads
 
         #######################################################################
         #
@@ -104,6 +116,10 @@ class RunnerLTGselection(object):
         """
         Main function that takes blast result with variant_id, target_id, identity and tax_id and returns ltg_tax_id and ltg_rank
 
+        The hits are grouped by variant once and, for each identity of identity_list, the modal tax_id of each rank
+        and its percentage of hits are computed for all the variants without LTG at the same time. The result is
+        the same as running one_variant_to_ltg for each variant.
+
         Example of the output variant_read_count_input_df:
         identity ltg_rank  ltg_tax_id  variant_id
     0       100  species      189839           3
@@ -121,24 +137,201 @@ class RunnerLTGselection(object):
 
         """
 
+        lineage_df = self.variantid_identity_lineage_df
+        # Variant codes in the order of the sorted variant_ids
+        variant_code_array, variant_id_array = pandas.factorize(lineage_df.variant_id, sort=True)
+        variant_count = len(variant_id_array)
+        # Hits sorted by variant, keeping the order of the hits of each variant for the ties of the modes
+        hit_order_array = numpy.argsort(variant_code_array, kind='stable')
+        variant_code_array = variant_code_array[hit_order_array]
+        identity_array = lineage_df.identity.to_numpy(dtype='float64')[hit_order_array]
+        target_tax_id_code_array = pandas.factorize(lineage_df.target_tax_id)[0][hit_order_array]
+        rank_list = [rank for rank in rank_hierarchy if rank in lineage_df.columns]
+        # Codes of the tax_ids of each rank in columns, with -1 for NaN
+        rank_code_array = numpy.zeros((lineage_df.shape[0], len(rank_list)), dtype='int64')
+        rank_tax_id_array_list = []
+        for rank_i, rank in enumerate(rank_list):
+            rank_code_array[:, rank_i], rank_tax_id_array = pandas.factorize(
+                lineage_df[rank].to_numpy()[hit_order_array])
+            rank_tax_id_array_list.append(rank_tax_id_array)
+
+        #######################################################################
         #
-        list_variant_id_to_ltg = []
-        variant_id_list = sorted(
-            self.variantid_identity_lineage_df.variant_id.unique().tolist())
+        # Compute the LTG codes, in one process or in partitions of variants across processes
         #
-        for variant_id in variant_id_list:  #  Loop sorted each variant
-
-            ltg_dic = self.one_variant_to_ltg(variant_id)
-            if not (ltg_dic == {}):  # if there is a ltg
-                list_variant_id_to_ltg.append({**{'variant_id': variant_id}, **ltg_dic})
+        #######################################################################
 
-        ltg_df = pandas.DataFrame(data=list_variant_id_to_ltg, columns=['variant_id', 'identity',
-                'ltg_tax_id', 'ltg_tax_name', 'ltg_rank'])
+        hit_array_tuple = (variant_code_array, identity_array, target_tax_id_code_array, rank_code_array)
+        # First hit of each variant, and total number of hits at the end
+        hit_offset_array = numpy.searchsorted(variant_code_array, numpy.arange(variant_count + 1))
+        process_count = min(self.num_threads, -(-variant_code_array.shape[0] // self.process_hit_count))
+        if process_count > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            # Each partition gets about the same number of hits
+            partition_boundary_array = numpy.unique(numpy.concatenate([[0], numpy.searchsorted(
+                hit_offset_array, numpy.linspace(0, variant_code_array.shape[0], process_count * 4 + 1)[1:-1]),
+                [variant_count]]))
+            partition_list = list(zip(partition_boundary_array[:-1].tolist(), partition_boundary_array[1:].tolist()))
+            Logger.instance().debug("Compute the LTG of {} variants in {} partitions with {} processes".format(
+                variant_count, len(partition_list), process_count))
+            # The forked processes read the hit arrays of the parent instead of receiving pickled copies
+            RunnerLTGselection.fork_shared_dic = {
+                'runner_ltg_selection': self, 'hit_array_tuple': hit_array_tuple,
+                'hit_offset_array': hit_offset_array}
+            try:
+                # The Pool of a fork context forks on every Python version, unlike ProcessPoolExecutor(mp_context)
+                # that needs Python 3.7
+                with multiprocessing.get_context('fork').Pool(processes=process_count) as pool:
+                    ltg_code_array_tuple_list = pool.map(self.get_partition_ltg_codes, partition_list)
+            finally:
+                RunnerLTGselection.fork_shared_dic = {}
+            ltg_identity_array, ltg_rank_array, ltg_rank_code_array = [numpy.concatenate(ltg_code_array_list)
+                for ltg_code_array_list in zip(*ltg_code_array_tuple_list)]
+        else:
+            ltg_identity_array, ltg_rank_array, ltg_rank_code_array = self.get_ltg_codes(
+                *hit_array_tuple, variant_count=variant_count)
+
+        is_ltg_array = ltg_rank_array >= 0
+        ltg_tax_id_array = numpy.zeros(variant_count, dtype='int64')
+        for rank_i, rank_tax_id_array in enumerate(rank_tax_id_array_list):
+            is_rank_array = ltg_rank_array == rank_i
+            ltg_tax_id_array[is_rank_array] = rank_tax_id_array[ltg_rank_code_array[is_rank_array]]
+        ltg_df = pandas.DataFrame(data={
+            'variant_id': variant_id_array[is_ltg_array],
+            'identity': ltg_identity_array[is_ltg_array],
+            'ltg_tax_id': ltg_tax_id_array[is_ltg_array],
+            'ltg_tax_name': self.taxonomy_df.loc[ltg_tax_id_array[is_ltg_array], 'name_txt'].to_numpy(),
+            'ltg_rank': numpy.array(rank_list + [None], dtype='object')[ltg_rank_array[is_ltg_array]],
+        }, columns=['variant_id', 'identity', 'ltg_tax_id', 'ltg_tax_name', 'ltg_rank'])
+        if ltg_df.shape[0] == 0:
+            ltg_df = pandas.DataFrame(columns=['variant_id', 'identity', 'ltg_tax_id', 'ltg_tax_name', 'ltg_rank'])
 
         ltg_df.ltg_tax_id = ltg_df.ltg_tax_id.astype('int')
 
         return ltg_df
 
+    @staticmethod
+    def get_partition_ltg_codes(partition):
+        """Computes in a forked process the LTG codes of the variants with codes in [start, end) from the hit
+        arrays shared by the parent process
+
+        :param partition: tuple (start, end) of variant codes
+        :return: tuple of numpy.ndarray, see get_ltg_codes
+        """
+
+        start, end = partition
+        fork_shared_dic = RunnerLTGselection.fork_shared_dic
+        hit_offset_array = fork_shared_dic['hit_offset_array']
+        hit_slice = slice(hit_offset_array[start], hit_offset_array[end])
+        variant_code_array, identity_array, target_tax_id_code_array, rank_code_array = [
+            hit_array[hit_slice] for hit_array in fork_shared_dic['hit_array_tuple']]
+        return fork_shared_dic['runner_ltg_selection'].get_ltg_codes(
+            variant_code_array - start, identity_array, target_tax_id_code_array, rank_code_array,
+            variant_count=end - start)
+
+    def get_ltg_codes(self, variant_code_array, identity_array, target_tax_id_code_array, rank_code_array,
+                      variant_count):
+        """Returns the LTG of each variant as codes
+
+        :param variant_code_array: numpy.ndarray with the variant code of each hit, from 0 to variant_count - 1
+        :param identity_array: numpy.ndarray with the identity of each hit
+        :param target_tax_id_code_array: numpy.ndarray with the code of the target_tax_id of each hit
+        :param rank_code_array: 2D numpy.ndarray with the tax_id code of each hit and rank, -1 for NaN
+        :param variant_count: number of variants
+        :return: tuple of numpy.ndarray with the identity, rank index (-1 without LTG) and tax_id code of the LTG of
+            each variant
+        """
+
+        ltg_identity_array = numpy.zeros(variant_count, dtype='int64')
+        ltg_rank_array = numpy.full(variant_count, -1, dtype='int64')
+        ltg_rank_code_array = numpy.zeros(variant_count, dtype='int64')
+
+        for identity in identity_list:  # For all the variants, loop each decreasing identity
+
+            # Hits above identity cutoff of the variants without LTG
+            is_hit_array = (identity_array >= identity) & (ltg_rank_array[variant_code_array] < 0)
+            if not is_hit_array.any():
+                continue
+            hit_variant_code_array = variant_code_array[is_hit_array]
+            hit_count_array = numpy.bincount(hit_variant_code_array, minlength=variant_count)
+
+            ###################################################################
+            #
+            # Check conditions to go for the LTG
+            #
+            ###################################################################
+
+            if identity >= self.ltg_rule_threshold:
+                is_candidate_array = hit_count_array > 0
+            else:
+                blast_target_count_array = numpy.bincount(self.get_group_unique_codes(
+                    hit_variant_code_array, target_tax_id_code_array[is_hit_array])[0], minlength=variant_count)
+                is_candidate_array = (hit_count_array > 0) & (blast_target_count_array >= self.min_number_of_taxa)
+
+            ###################################################################
+            #
+            # Run include_prop LTG method: lowest rank with a modal tax_id in include_prop percent of hits
+            #
+            ###################################################################
+
+            # Hits of the candidate variants only
+            is_hit_array[is_hit_array] = is_candidate_array[hit_variant_code_array]
+            hit_variant_code_array = variant_code_array[is_hit_array]
+            identity_ltg_rank_array = numpy.full(variant_count, -1, dtype='int64')
+            identity_ltg_rank_code_array = numpy.zeros(variant_count, dtype='int64')
+            for rank_i in range(rank_code_array.shape[1]):
+                hit_rank_code_array = rank_code_array[is_hit_array, rank_i]
+                is_not_na_array = hit_rank_code_array >= 0
+                modal_variant_code_array, modal_rank_code_array, modal_count_array = self.get_group_mode(
+                    hit_variant_code_array[is_not_na_array], hit_rank_code_array[is_not_na_array])
+                modal_percentage_array = modal_count_array / hit_count_array[modal_variant_code_array] * 100
+                is_ltg_array = modal_percentage_array >= self.include_prop
+                # Lower ranks come later and replace higher ranks
+                identity_ltg_rank_array[modal_variant_code_array[is_ltg_array]] = rank_i
+                identity_ltg_rank_code_array[modal_variant_code_array[is_ltg_array]] = \
+                    modal_rank_code_array[is_ltg_array]
+
+            is_ltg_array = is_candidate_array & (identity_ltg_rank_array >= 0)
+            ltg_identity_array[is_ltg_array] = identity
+            ltg_rank_array[is_ltg_array] = identity_ltg_rank_array[is_ltg_array]
+            ltg_rank_code_array[is_ltg_array] = identity_ltg_rank_code_array[is_ltg_array]
+
+        return ltg_identity_array, ltg_rank_array, ltg_rank_code_array
+
+    @staticmethod
+    def get_group_unique_codes(group_code_array, value_code_array):
+        """Returns the distinct (group, value) pairs of two non-negative code arrays
+
+        :return: tuple of numpy.ndarray: group codes, value codes, counts and first positions of the pairs
+        """
+
+        value_code_count = int(value_code_array.max(initial=0)) + 1
+        pair_key_array = group_code_array.astype('int64') * value_code_count + value_code_array
+        # First positions are those of the first occurrences, because numpy.unique sorts stably with return_index
+        pair_key_array, first_position_array, count_array = numpy.unique(
+            pair_key_array, return_index=True, return_counts=True)
+        return pair_key_array // value_code_count, pair_key_array % value_code_count, count_array, \
+            first_position_array
+
+    @staticmethod
+    def get_group_mode(group_code_array, value_code_array):
+        """Returns the most frequent value of each group, the first one in the arrays if several are tied, like
+        value_counts().index[0]
+
+        :param group_code_array: numpy.ndarray of non-negative group codes
+        :param value_code_array: numpy.ndarray of non-negative value codes
+        :return: tuple of numpy.ndarray: group codes, modal value codes and their counts
+        """
+
+        group_array, value_array, count_array, first_position_array = RunnerLTGselection.get_group_unique_codes(
+            group_code_array, value_code_array)
+        # For each group, highest count first and then first position
+        order_array = numpy.lexsort((first_position_array, -count_array, group_array))
+        group_array = group_array[order_array]
+        is_first_array = numpy.ones(len(group_array), dtype='bool')
+        is_first_array[1:] = group_array[1:] != group_array[:-1]
+        order_array = order_array[is_first_array]
+        return group_array[is_first_array], value_array[order_array], count_array[order_array]
+
     def select_ltg_include_prop(self, tax_lineage_df):
         """
         Selects LGT using the include_proc method.
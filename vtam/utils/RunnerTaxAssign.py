@@ -1,8 +1,13 @@
+import hashlib
 import inspect
+import numpy
 import os
 import pandas
 import pathlib
+import sqlalchemy
 
+from vtam.models.BlastHitCache import BlastHitCache
+from vtam.utils.BlastDbExactMatchIndex import BlastDbExactMatchIndex
 from vtam.utils.FileParams import FileParams
 
 from vtam.utils.Logger import Logger
@@ -12,10 +17,21 @@ from vtam.utils.RunnerLTGselection import RunnerLTGselection
 
 
 class RunnerTaxAssign(object):
-    """Will assign variants to a taxon"""
+    """Will assign variants to a taxon
+
+    If an engine is given, the filtered Blast hits of each variant sequence are stored in the BlastHitCache table
+    for this BLAST DB and qcov_hsp_perc, and only the variants without cached hits are blasted.
+
+    With exact_match, the variants contained in reference sequences, on either strand, get these references as hits
+    with 100% identity from the BlastDbExactMatchIndex and are not blasted. Their LTG is then computed from the
+    references that contain the whole variant only.
+    """
+
+    # Maximal number of values in one IN clause, below the SQLite limit of host parameters
+    in_clause_size = 900
 
     def __init__(self, sequence_list, taxonomy, blast_db_dir, blast_db_name,
-             num_threads, params):
+             num_threads, params, engine=None, exact_match=False):
         """
 
         Parameters
@@ -24,6 +40,10 @@ class RunnerTaxAssign(object):
             List of se
         param2 : str
             The second parameter.
+        engine : sqlalchemy engine
+            Database of the BlastHitCache table. If None, all the variants are blasted
+        exact_match : bool
+            If True, variants contained in reference sequences are resolved without Blast
 
         """
 
@@ -47,30 +67,82 @@ class RunnerTaxAssign(object):
 
         #######################################################################
         #
-        # 2 Create FASTA file with Variants
+        # Get cached Blast hits
         #
         #######################################################################
 
-        Logger.instance().debug(
-            "file: {}; line: {}; Create SortedReadFile from Variants".format(
-                __file__, inspect.currentframe().f_lineno))
-        variant_fasta = os.path.join(self.this_temp_dir, 'variant.fasta')
-        with open(variant_fasta, 'w') as fout:
-            for seq in sequence_list:
-                fout.write(">{}\n{}\n".format(seq, seq))
+        self.engine = engine
+        self.blast_db_fingerprint = RunnerBlast.get_blast_db_fingerprint(blast_db_dir, blast_db_name)
+        self.qcov_hsp_perc = float(qcov_hsp_perc)
+        if self.engine is not None:
+            BlastHitCache.__table__.create(bind=self.engine, checkfirst=True)
+
+        sequence_list = list(dict.fromkeys(sequence_list))  # Unique sequences in input order
+        sequence_hash_list = [hashlib.sha256(seq.encode()).hexdigest() for seq in sequence_list]
+        blast_hit_cache_dic = self.get_blast_hit_cache_dic(sequence_hash_list)
+        blast_sequence_list = [seq for seq, sequence_hash in zip(sequence_list, sequence_hash_list)
+                               if sequence_hash not in blast_hit_cache_dic]
+        Logger.instance().debug("Blast hit cache hits: {} of {} variants".format(
+            len(sequence_list) - len(blast_sequence_list), len(sequence_list)))
+
+        blast_output_df_list = [RunnerTaxAssign.hit_list_to_df(blast_hit_cache_dic, sequence_list,
+                                                                sequence_hash_list)]
 
         #######################################################################
         #
-        # 3 Run local blast
+        # Exact matches in the reference sequences
         #
         #######################################################################
 
-        runner_blast = RunnerBlast(variant_fasta, blast_db_dir, blast_db_name,
-            num_threads, qcov_hsp_perc)
-        # run blast
-        blast_output_tsv = runner_blast.run_local_blast()
-        # process blast results
-        blast_output_df = RunnerBlast.process_blast_result(blast_output_tsv)
+        if exact_match and len(blast_sequence_list) > 0:
+            exact_match_index = BlastDbExactMatchIndex(blast_db_dir=blast_db_dir, blast_db_name=blast_db_name)
+            if exact_match_index.is_up_to_date() or exact_match_index.build():
+                exact_match_hit_df = exact_match_index.get_hit_df(blast_sequence_list)
+                exact_match_sequence_set = set(exact_match_hit_df.variant_id.tolist())
+                blast_sequence_list = [seq for seq in blast_sequence_list if seq not in exact_match_sequence_set]
+                Logger.instance().debug("Exact matches in the BLAST DB: {} variants".format(
+                    len(exact_match_sequence_set)))
+                blast_output_df_list.append(exact_match_hit_df)
+
+        if len(blast_sequence_list) > 0:
+
+            #######################################################################
+            #
+            # 2 Create FASTA file with Variants
+            #
+            #######################################################################
+
+            Logger.instance().debug(
+                "file: {}; line: {}; Create SortedReadFile from Variants".format(
+                    __file__, inspect.currentframe().f_lineno))
+            variant_fasta = os.path.join(self.this_temp_dir, 'variant.fasta')
+            with open(variant_fasta, 'w') as fout:
+                for seq in blast_sequence_list:
+                    fout.write(">{}\n{}\n".format(seq, seq))
+
+            #######################################################################
+            #
+            # 3 Run local blast
+            #
+            #######################################################################
+
+            runner_blast = RunnerBlast(variant_fasta, blast_db_dir, blast_db_name,
+                num_threads, qcov_hsp_perc)
+            # run blast
+            blast_output_tsv = runner_blast.run_local_blast()
+            # process blast results
+            blast_new_output_df = RunnerBlast.read_blast_result(blast_output_tsv)
+            self.insert_blast_hit_cache(blast_new_output_df, blast_sequence_list)
+            blast_output_df_list.append(blast_new_output_df)
+
+        # Hits in the order of the variants, as with a single blast of all the variants
+        blast_output_df_list = [df for df in blast_output_df_list if df.shape[0] > 0] or blast_output_df_list[:1]
+        blast_output_df = pandas.concat(blast_output_df_list, axis=0, ignore_index=True)
+        sequence_order_sr = pandas.Series(numpy.arange(len(sequence_list)), index=sequence_list)
+        blast_output_df = blast_output_df.iloc[numpy.argsort(
+            sequence_order_sr.reindex(blast_output_df.variant_id).to_numpy(), kind='stable')]\
+            .reset_index(drop=True)
+        RunnerBlast.exit_if_no_hit(blast_output_df)
 
         #######################################################################
         #
@@ -128,5 +200,66 @@ Index(['variant_id', 'target_id', 'identity', 'evalue', 'coverage',
                 __file__, inspect.currentframe().f_lineno))
         runner_ltg_selection = RunnerLTGselection(
             variant_identity_lineage_df=variantid_identity_lineage_df,
-            taxonomy_df=self.taxonomy_df, params=params)
+            taxonomy_df=self.taxonomy_df, params=params, num_threads=self.num_threads)
         self.ltg_df = runner_ltg_selection.several_variants_to_ltg()
+
+    def get_blast_hit_cache_dic(self, sequence_hash_list):
+        """Returns a dictionary sequence_hash: hit_list with the cached Blast hits of these sequence hashes"""
+
+        blast_hit_cache_dic = {}
+        if self.engine is None:
+            return blast_hit_cache_dic
+
+        cache_declarative_table = BlastHitCache.__table__
+        with self.engine.connect() as conn:
+            for i in range(0, len(sequence_hash_list), self.in_clause_size):
+                stmt = sqlalchemy.select([cache_declarative_table.c.sequence_hash, cache_declarative_table.c.hit_list])\
+                    .where(cache_declarative_table.c.sequence_hash.in_(
+                        sequence_hash_list[i:i + self.in_clause_size]))\
+                    .where(cache_declarative_table.c.blast_db_fingerprint == self.blast_db_fingerprint)\
+                    .where(cache_declarative_table.c.qcov_hsp_perc == self.qcov_hsp_perc)
+                for sequence_hash, hit_list in conn.execute(stmt).fetchall():
+                    blast_hit_cache_dic[sequence_hash] = hit_list
+        return blast_hit_cache_dic
+
+    def insert_blast_hit_cache(self, blast_output_df, sequence_list):
+        """Stores the filtered Blast hits of these sequences in the BlastHitCache table, including the sequences
+        without hit. Sequences already stored by another process since get_blast_hit_cache_dic are ignored"""
+
+        if self.engine is None or len(sequence_list) == 0:
+            return
+
+        hit_line_sr = blast_output_df.target_id.astype(str) + '\t' + blast_output_df.identity.astype(str) \
+            + '\t' + blast_output_df.evalue.astype(str) + '\t' + blast_output_df.coverage.astype(str) \
+            + '\t' + blast_output_df.target_tax_id.astype(str)
+        hit_list_dic = hit_line_sr.groupby(blast_output_df.variant_id.to_numpy(), sort=False)\
+            .agg('\n'.join).to_dict()
+
+        record_list = [{
+            'sequence_hash': hashlib.sha256(seq.encode()).hexdigest(),
+            'blast_db_fingerprint': self.blast_db_fingerprint,
+            'qcov_hsp_perc': self.qcov_hsp_perc,
+            'hit_list': hit_list_dic.get(seq, '')} for seq in sequence_list]
+        with self.engine.connect() as conn:
+            conn.execute(BlastHitCache.__table__.insert().prefix_with('OR IGNORE'), record_list)
+
+    @staticmethod
+    def hit_list_to_df(blast_hit_cache_dic, sequence_list, sequence_hash_list):
+        """Returns the DF of cached hits with the columns of RunnerBlast.read_blast_result
+
+        :param blast_hit_cache_dic: dictionary sequence_hash: hit_list
+        :param sequence_list: variant sequences
+        :param sequence_hash_list: sha256 of the variant sequences
+        :return: pandas.DataFrame
+        """
+
+        hit_list_sr = pandas.Series({seq: blast_hit_cache_dic[sequence_hash]
+                                     for seq, sequence_hash in zip(sequence_list, sequence_hash_list)
+                                     if blast_hit_cache_dic.get(sequence_hash, '') != ''}, dtype='object')
+        hit_line_sr = hit_list_sr.str.split('\n').explode()
+        blast_output_df = pandas.DataFrame(
+            hit_line_sr.str.split('\t').tolist(),
+            columns=['target_id', 'identity', 'evalue', 'coverage', 'target_tax_id'])
+        blast_output_df.insert(0, 'variant_id', hit_line_sr.index.tolist())
+        return blast_output_df.astype({'identity': 'float', 'evalue': 'float', 'coverage': 'int',
+                                       'target_tax_id': 'int'})
@@ -34,7 +34,7 @@ class RunnerVSearch(object):
     def run(self):
         """Run the vsearch
 
-        :return: void
+        :return: subprocess.CompletedProcess of the vsearch command
         """
         cmd = self.create_command()
 
@@ -46,3 +46,4 @@ class RunnerVSearch(object):
                                     stderr=subprocess.STDOUT)
 
         Logger.instance().info(run_result.stdout.decode())
+        return run_result
@@ -1,62 +1,138 @@
+import hashlib
+import multiprocessing
 import os
+import pandas
 import shlex
+import sqlalchemy
 import subprocess
 import sys
 
-import pandas
+from vtam.models.SequenceClustererCache import SequenceClustererCache
+from vtam.utils.Logger import Logger
 from vtam.utils.PathManager import PathManager
 
 
 class SequenceClusterer(object):
 
-    def __init__(self, variant_info_df, cluster_identity):
+    def __init__(self, variant_info_df, cluster_identity, num_threads=None, engine=None):
 
-        """Takes as input df with at least these columns: variant_id, read_cout, sequence"""
+        """Takes as input df with at least these columns: variant_id, read_cout, sequence
+
+        :param num_threads: Number of vsearch threads. Default VTAM_THREADS or the number of CPUs
+        :param engine: sqlalchemy engine where cluster assignments are cached in the SequenceClustererCache table.
+            If None, vsearch is always run
+        """
 
         self.variant_info_df = variant_info_df
         self.cluster_identity = cluster_identity
+        self.engine = engine
+
+        if num_threads is None:
+            if os.getenv('VTAM_THREADS') is None:
+                num_threads = multiprocessing.cpu_count()
+            else:
+                num_threads = int(os.getenv('VTAM_THREADS'))
+        self.num_threads = num_threads
+
+        if self.engine is not None:
+            SequenceClustererCache.__table__.create(bind=self.engine, checkfirst=True)
 
     def compute_clusters(self):
 
+        """Returns DataFrame with columns clusterid, variant_id, clustersize where clusterid is the variant_id of the
+        cluster centroid. Variants are ordered by variant_id as strings, like the former vsearch OTU table columns"""
+
         tempcluster_dir = PathManager.instance().get_tempdir()
 
         i_fas = os.path.join(tempcluster_dir, 'cluster_input.fas')
+        fasta_str = ''.join('>' + self.variant_info_df.variant_id.astype(str)
+                            + ';size=' + self.variant_info_df.read_count.astype(str)
+                            + '\n' + self.variant_info_df.sequence + '\n')
         with open(i_fas, 'w') as fout:
-            for idx, row in self.variant_info_df.iterrows():
-                valdict = {}
-                valdict['variant_id'] = row.variant_id
-                valdict['read_count'] = row.read_count
-                valdict['sequence'] = row.sequence
-                fout.write(
-                    ">{variant_id};size={read_count}\n{sequence}\n".format(
-                        **valdict))
-        cmd = "vsearch --cluster_size cluster_input.fas --id {} --otutabout otutabout.txt --clusters test".format(self.cluster_identity)
+            fout.write(fasta_str)
+        cluster_input_hash = hashlib.sha256(fasta_str.encode()).hexdigest()
+
+        variant_id_clusterid_list = self.get_cache(cluster_input_hash)
+        if variant_id_clusterid_list is None:
+            variant_id_clusterid_list = self.run_vsearch_cluster_size(i_fas, tempcluster_dir)
+            self.insert_cache(cluster_input_hash, variant_id_clusterid_list)
+        else:
+            Logger.instance().debug("Cluster assignments found in {}".format(SequenceClustererCache.__tablename__))
+
+        cluster_count_df = pandas.DataFrame(variant_id_clusterid_list, columns=['variant_id', 'clusterid'])
+        cluster_count_df['clustersize'] = cluster_count_df.groupby('clusterid').variant_id.transform('size')
+        cluster_count_df = cluster_count_df.iloc[
+            cluster_count_df.variant_id.astype(str).argsort(kind='stable')].reset_index(drop=True)
+
+        return cluster_count_df[['clusterid', 'variant_id', 'clustersize']]
+
+    def run_vsearch_cluster_size(self, i_fas, tempcluster_dir):
+
+        """Runs vsearch cluster_size and returns the list of (variant_id, clusterid) read in the --uc mapping"""
+
+        uc_path = os.path.join(tempcluster_dir, 'cluster.uc')
+        # A mapping left by an earlier run must not be read if vsearch fails
+        if os.path.isfile(uc_path):
+            os.remove(uc_path)
+        cmd = "vsearch --cluster_size cluster_input.fas --id {} --uc cluster.uc --threads {}".format(
+            self.cluster_identity, self.num_threads)
         if sys.platform.startswith("win"):
             args = cmd
         else:
             args = shlex.split(cmd)
-        subprocess.run(args=args, cwd=tempcluster_dir)
-
-        otutabout_path = os.path.join(tempcluster_dir, "otutabout.txt")
-        otutabout_df = pandas.read_csv(otutabout_path, sep="\t")
-        otutabout_df.rename({'#OTU ID': 'centroid'}, axis=1, inplace=True)
-
-        otutabout_long_df = pandas.melt(otutabout_df, id_vars=['centroid'],
-                                        var_name='variant_id',
-                                        value_name='read_count')
-        otutabout_long_df.rename({'centroid': 'clusterid'}, axis=1,
-                                 inplace=True)
-        otutabout_long_df = otutabout_long_df.loc[
-            otutabout_long_df.read_count > 0]
-        otutabout_long_df.variant_id = otutabout_long_df.variant_id.astype(
-            'int')
-
-        cluster_count_df = otutabout_long_df[
-            ['clusterid', 'variant_id']].groupby('clusterid').count()
-        cluster_count_df.rename({'variant_id': 'clustersize'}, axis=1,
-                                inplace=True)
-        cluster_count_df = otutabout_long_df[
-            ['clusterid', 'variant_id']].merge(cluster_count_df,
-                                               on='clusterid')
-
-        return cluster_count_df
+        run_result = subprocess.run(args=args, cwd=tempcluster_dir)
+        if run_result.returncode != 0 or not os.path.isfile(uc_path):
+            Logger.instance().error("vsearch --cluster_size failed with return code {}: {}".format(
+                run_result.returncode, cmd))
+            sys.exit(1)
+
+        return self.read_uc(uc_path)
+
+    @staticmethod
+    def read_uc(uc_path):
+
+        """Returns the list of (variant_id, clusterid) of a vsearch --uc file where labels are 'variant_id;size=N'
+
+        The uc columns are the record type, cluster number, ..., query label (9th) and centroid label (10th).
+        S records are centroids and H records are hits of a centroid. C records summarize clusters and are skipped.
+        """
+
+        uc_df = pandas.read_csv(uc_path, sep="\t", header=None, usecols=[0, 8, 9],
+                                names=['record_type', 'query', 'target'], dtype=str)
+        uc_df = uc_df.loc[uc_df.record_type.isin(['S', 'H'])]
+        variant_id_list = uc_df['query'].str.split(';').str[0].astype(int).tolist()
+        centroid_label_sr = uc_df.target.where(uc_df.record_type == 'H', uc_df['query'])
+        clusterid_list = centroid_label_sr.str.split(';').str[0].astype(int).tolist()
+
+        return list(zip(variant_id_list, clusterid_list))
+
+    def get_cache(self, cluster_input_hash):
+
+        """Returns the cached list of (variant_id, clusterid) for this input and cluster_identity or None"""
+
+        if self.engine is None:
+            return None
+        cache_declarative_table = SequenceClustererCache.__table__
+        stmt = sqlalchemy.select([cache_declarative_table.c.variant_id_clusterid_list])\
+            .where(cache_declarative_table.c.cluster_input_hash == cluster_input_hash)\
+            .where(cache_declarative_table.c.cluster_identity == float(self.cluster_identity))
+        with self.engine.connect() as conn:
+            row = conn.execute(stmt).first()
+        if row is None:
+            return None
+        return [tuple(int(variant_id) for variant_id in variant_id_clusterid.split(':'))
+                for variant_id_clusterid in row[0].split(',') if variant_id_clusterid != '']
+
+    def insert_cache(self, cluster_input_hash, variant_id_clusterid_list):
+
+        """Stores the cluster assignments of this input and cluster_identity in the SequenceClustererCache table,
+        unless another process stored them since get_cache"""
+
+        if self.engine is None:
+            return
+        with self.engine.connect() as conn:
+            conn.execute(SequenceClustererCache.__table__.insert().prefix_with('OR IGNORE'), {
+                'cluster_input_hash': cluster_input_hash,
+                'cluster_identity': float(self.cluster_identity),
+                'variant_id_clusterid_list': ','.join(
+                    '{}:{}'.format(variant_id, clusterid) for variant_id, clusterid in variant_id_clusterid_list)})
@@ -1,15 +1,22 @@
+import numpy
 import pandas
 
+from vtam.utils.Taxonomy import Taxonomy
 from vtam.utils.constants import rank_hierarchy_asv_table
 
 
 class TaxLineage(object):
-    """This class construct a TaxLineage for a given tax_id and based on the taxonomic_tsv file"""
+    """This class construct a TaxLineage for a given tax_id and based on the taxonomic_tsv file
 
-    def __init__(self, taxonomic_tsv_path):
-        self.taxonomy_df = pandas.read_csv(
-            taxonomic_tsv_path, sep="\t", header=0, dtype={
-                'tax_id': 'int', 'parent_tax_id': 'int', 'old_tax_id': 'float'})
+    The lineages are read from the lineage array of the Taxonomy, which can be shared with other steps, eg the LTG
+    assignation, instead of being read again from the taxonomic_tsv file."""
+
+    def __init__(self, taxonomic_tsv_path=None, taxonomy=None):
+        """TaxLineage gets initialized either from a taxonomic_tsv path or a Taxonomy object"""
+
+        self.taxonomy = taxonomy
+        if self.taxonomy is None:
+            self.taxonomy = Taxonomy(tsv=taxonomic_tsv_path)
 
     def create_lineage_from_one_tax_id(self, tax_id, tax_name=False):
         """
@@ -22,8 +29,7 @@ class TaxLineage(object):
         Returns:
             Dictionnary: with taxonomy information for given tax_id,
             {'tax_id': 183142, 'species': 183142, 'genus': 10194, 'family': 10193, 'order': 84394,
-                             'superorder': 1709201, 'class': 10191, 'phylum': 10190, 'no rank': 131567, 'kingdom': 33208,
-                             'superkingdom': 2759}
+                             'superorder': 1709201, 'class': 10191, 'phylum': 10190, 'no rank': 131567}
 
         """
 
@@ -35,26 +41,19 @@ class TaxLineage(object):
         except TypeError:
             return None
 
-        tax_lineage_dic = {}
-        tax_lineage_dic['tax_id'] = tax_id
-        while tax_id != 1:
-            # try to use taxonomy_df.tax_id
-            tax_id_row = self.taxonomy_df.loc[self.taxonomy_df.tax_id == tax_id, ]
-            # if row empty, try to use old_tax_id
-            if tax_id_row.shape[0] == 0:
-                tax_id_row = self.taxonomy_df.loc[self.taxonomy_df.old_tax_id == tax_id, ]
-                # if row still empty, return None
-                if tax_id_row.shape[0] == 0:
-                    return None
-
-            rank = tax_id_row['rank'].values[0]
-            parent_tax_id = tax_id_row['parent_tax_id'].values[0]
-            tax_lineage_dic[rank] = tax_id
-            if tax_name:  # return tax_name instead of tax_id
-                tax_name = tax_id_row['name_txt'].values[0]
-                tax_lineage_dic[rank] = tax_name
-            tax_id = parent_tax_id
-
+        lineage_row_array = self.taxonomy.get_lineage_rows(numpy.array([tax_id]))[0]
+        if lineage_row_array[-1] >= 0:  # Lineage with a tax_id missing in the taxonomy
+            return None
+        lineage_tax_id_array = lineage_row_array[:-1]
+        lineage_value_array = lineage_tax_id_array.tolist()
+        if tax_name:  # return tax_name instead of tax_id
+            lineage_value_array = self.taxonomy.get_tax_name_array(lineage_tax_id_array).tolist()
+
+        tax_lineage_dic = {'tax_id': tax_id}
+        for rank, lineage_tax_id, lineage_value in zip(
+                self.taxonomy.lineage_rank_list, lineage_tax_id_array, lineage_value_array):
+            if lineage_tax_id != 0:
+                tax_lineage_dic[rank] = lineage_value
         return tax_lineage_dic
 
     def create_lineage_from_tax_id_list(self, tax_id_list, tax_name=False):
@@ -66,38 +65,42 @@ class TaxLineage(object):
             tax_name (String): Append tax_name to dictionary
 
         Returns:
-            Dictionnary: with taxonomy information for given tax_id,
-            {'tax_id': 183142, 'species': 183142, 'genus': 10194, 'family': 10193, 'order': 84394,
-                             'superorder': 1709201, 'class': 10191, 'phylum': 10190, 'no rank': 131567, 'kingdom': 33208,
-                             'superkingdom': 2759}
+            DataFrame: with the ranks of rank_hierarchy_asv_table found in the lineages and the tax_id in columns,
+            and one row for each tax_id with a complete lineage
 
         """
-        taxa_lineage_list = []
 
+        # Keep the tax_ids that convert to int
+        tax_id_int_list = []
         for tax_id in tax_id_list:
-
-            # if not math.isnan(tax_id):
-            # tax_lineage = TaxLineage(taxonomic_tsv_path=taxonomy_tsv_path)
-            tax_lineage_dic = self.create_lineage_from_one_tax_id(
-                tax_id=tax_id, tax_name=tax_name)
-            # tax_lineage_dic = create_lineage_from_one_tax_id(tax_id, taxonomy_df, tax_name=True)
-            if not (tax_lineage_dic is None):
-                taxa_lineage_list.append(tax_lineage_dic)
-
-        tax_lineage_df = pandas.DataFrame(data=taxa_lineage_list)
-        # lineage_list_df_columns_sorted = list(
-        #     filter(lambda x: x in lineage_df.columns.tolist(), rank_hierarchy_asv_table))
-        # lineage_list_df_columns_sorted = lineage_list_df_columns_sorted + ['tax_id']
-        # lineage_df = lineage_df[lineage_list_df_columns_sorted]
-
-        lineage_list_df_columns_sorted = list(
-            filter(
-                lambda x: x in tax_lineage_df.columns.tolist(),
-                rank_hierarchy_asv_table))
-        lineage_list_df_columns_sorted = lineage_list_df_columns_sorted + \
-            ['tax_id']
-        tax_lineage_df = tax_lineage_df[lineage_list_df_columns_sorted]
+            try:
+                tax_id_int_list.append(int(tax_id))
+            except (TypeError, ValueError):
+                pass
+
+        lineage_row_array = self.taxonomy.get_lineage_rows(numpy.array(tax_id_int_list, dtype='int64'))
+        # Drop lineages with a tax_id missing in the taxonomy
+        is_complete_array = lineage_row_array[:, -1] < 0
+        lineage_row_array = lineage_row_array[is_complete_array]
+        tax_id_int_list = [tax_id for tax_id, is_complete in zip(tax_id_int_list, is_complete_array) if is_complete]
+
+        lineage_list_df_columns_sorted = []
+        tax_lineage_df = pandas.DataFrame(index=pandas.RangeIndex(len(tax_id_int_list)))
+        for rank in rank_hierarchy_asv_table:
+            lineage_tax_id_array = lineage_row_array[:, self.taxonomy.lineage_rank_list.index(rank)]
+            is_rank_array = lineage_tax_id_array != 0
+            if not is_rank_array.any():
+                continue
+            lineage_list_df_columns_sorted.append(rank)
+            if tax_name:  # return tax_name instead of tax_id
+                tax_lineage_df[rank] = numpy.where(
+                    is_rank_array, self.taxonomy.get_tax_name_array(lineage_tax_id_array), numpy.nan)
+            elif is_rank_array.all():
+                tax_lineage_df[rank] = lineage_tax_id_array
+            else:
+                tax_lineage_df[rank] = numpy.where(is_rank_array, lineage_tax_id_array, numpy.nan)
         # do not move. required because sometimes tax_id is none
-        tax_lineage_df = tax_lineage_df.astype({'tax_id': 'object'})
+        tax_lineage_df['tax_id'] = pandas.Series(tax_id_int_list, dtype='object')
+        lineage_list_df_columns_sorted = lineage_list_df_columns_sorted + ['tax_id']
 
-        return tax_lineage_df
+        return tax_lineage_df[lineage_list_df_columns_sorted]
@@ -1,15 +1,30 @@
+import json
+import numpy
+import os
 import pandas
+import tempfile
 from vtam.utils.VTAMexception import VTAMexception
 
 from vtam.utils.Logger import Logger
+from vtam.utils.constants import rank_hierarchy
 
 
 class Taxonomy(object):
-    """A class for the taxonomy file"""
+    """A class for the taxonomy file
+
+    The lineages are precomputed once in a dense int32 array with one row per tax_id, including old tax_ids, and one
+    column per rank of rank_hierarchy, plus a last column with the first tax_id missing from the taxonomy along the
+    lineage or -1. If the taxonomy comes from a TSV, the array is stored next to it in '<tsv>.lineage.npy' and
+    memory-mapped by the next Taxonomy objects, as long as the TSV does not change.
+    """
+
+    lineage_rank_list = rank_hierarchy
 
     def __init__(self, tsv=None, df=None):
         """Taxonomy gets initialize either from a TSV path or a DataFrame"""
 
+        self.tsv = tsv
+        self.lineage_array = None
         self.df = df
         if not (tsv is None):
             self.df = pandas.read_csv(tsv, sep="\t", header=0, dtype={'tax_id': 'int', 'parent_tax_id': 'int', 'old_tax_id': 'float'}).drop_duplicates()
@@ -22,12 +37,130 @@ class Taxonomy(object):
         self.df = self.df.drop(['old_tax_id'], axis=1, inplace=False).drop_duplicates()
         self.df.set_index('tax_id', drop=True, inplace=True, verify_integrity=True)
 
+    def get_lineage_meta_dic(self):
+
+        tsv_stat = os.stat(self.tsv)
+        return {'tsv_size': tsv_stat.st_size, 'tsv_mtime_ns': tsv_stat.st_mtime_ns,
+                'rank_list': self.lineage_rank_list}
+
+    def get_lineage_array(self):
+        """Returns the lineage array, which is read from '<tsv>.lineage.npy' if it is up to date and built and
+        written otherwise
+
+        :return: numpy.ndarray of int32 with shape (max tax_id + 1, number of ranks + 1). Zero means no tax_id
+        """
+
+        if self.lineage_array is not None:
+            return self.lineage_array
+
+        if self.tsv is not None:
+            lineage_npy = self.tsv + '.lineage.npy'
+            lineage_json = self.tsv + '.lineage.json'
+            if os.path.isfile(lineage_json):
+                with open(lineage_json) as fin:
+                    if json.load(fin) == self.get_lineage_meta_dic():
+                        self.lineage_array = numpy.load(lineage_npy, mmap_mode='r')
+                        return self.lineage_array
+
+        self.lineage_array = self.build_lineage_array()
+
+        if self.tsv is not None:
+            try:
+                if os.path.isfile(lineage_json):
+                    os.remove(lineage_json)
+                # Other processes may have memory-mapped lineage_npy: the new array replaces the file instead of
+                # overwriting it
+                lineage_npy_fd, lineage_npy_tmp = tempfile.mkstemp(
+                    suffix='.npy', dir=os.path.dirname(os.path.abspath(lineage_npy)))
+                try:
+                    with os.fdopen(lineage_npy_fd, 'wb') as fout:
+                        numpy.save(fout, self.lineage_array)
+                    os.replace(lineage_npy_tmp, lineage_npy)
+                except OSError:
+                    if os.path.isfile(lineage_npy_tmp):
+                        os.remove(lineage_npy_tmp)
+                    raise
+                # Written last: a lineage array without its json file is not used
+                with open(lineage_json, 'w') as fout:
+                    json.dump(self.get_lineage_meta_dic(), fout)
+            except OSError as os_error:
+                Logger.instance().debug("The lineage array could not be written next to {}: {}".format(
+                    self.tsv, os_error))
+        return self.lineage_array
+
+    def build_lineage_array(self):
+        """Computes the lineage of every tax_id and old tax_id by walking up the parents of all the tax_ids at once
+
+        Like get_one_tax_id_lineage, an old tax_id has the lineage of its new tax_id with the old tax_id at its rank,
+        a rank seen several times keeps its highest tax_id and the walk stops at the first missing tax_id.
+        """
+
+        Logger.instance().debug("Build the lineage array of the taxonomy")
+
+        tax_id_array = self.df.index.to_numpy(dtype='int64')
+        parent_tax_id_array = self.df.parent_tax_id.to_numpy(dtype='int64')
+        rank_to_column_dic = {rank: column for column, rank in enumerate(self.lineage_rank_list)}
+        column_array = self.df['rank'].map(rank_to_column_dic).fillna(-1).to_numpy(dtype='int64')
+        # First new tax_id of each old tax_id
+        old_tax_df = self.old_tax_df.loc[~self.old_tax_df.index.duplicated(keep='first')]
+        old_tax_id_array = old_tax_df.index.to_numpy(dtype='int64')
+        new_tax_id_array = old_tax_df.tax_id.to_numpy(dtype='int64')
+
+        tax_id_max = int(max([1] + tax_id_array.tolist() + old_tax_id_array.tolist()))
+        # Row in self.df of each tax_id, with the row of the new tax_id for old tax_ids, or -1
+        row_array = numpy.full(tax_id_max + 1, -1, dtype='int64')
+        row_array[old_tax_id_array] = pandas.Index(tax_id_array).get_indexer(new_tax_id_array)
+        row_array[tax_id_array] = numpy.arange(len(tax_id_array))
+
+        lineage_array = numpy.zeros((tax_id_max + 1, len(self.lineage_rank_list) + 1), dtype='int32')
+        lineage_array[:, -1] = -1
+        node_array = numpy.flatnonzero(row_array >= 0)  # Tax_ids of the lineages being computed
+        ancestor_array = node_array.copy()  # Current ancestor of each of these lineages
+        while len(node_array) > 0:
+            is_active_array = ancestor_array != 1
+            node_array = node_array[is_active_array]
+            ancestor_array = ancestor_array[is_active_array]
+            ancestor_row_array = numpy.full(len(ancestor_array), -1, dtype='int64')
+            is_in_range_array = (ancestor_array >= 0) & (ancestor_array <= tax_id_max)
+            ancestor_row_array[is_in_range_array] = row_array[ancestor_array[is_in_range_array]]
+            # Missing ancestor: the lineage stops here
+            is_missing_array = ancestor_row_array < 0
+            lineage_array[node_array[is_missing_array], -1] = ancestor_array[is_missing_array]
+            node_array = node_array[~is_missing_array]
+            ancestor_array = ancestor_array[~is_missing_array]
+            ancestor_row_array = ancestor_row_array[~is_missing_array]
+            # Ranks are written from the lowest to the highest ancestor, so higher ancestors of the same rank win
+            ancestor_column_array = column_array[ancestor_row_array]
+            is_ranked_array = ancestor_column_array >= 0
+            lineage_array[node_array[is_ranked_array], ancestor_column_array[is_ranked_array]] = \
+                ancestor_array[is_ranked_array]
+            ancestor_array = parent_tax_id_array[ancestor_row_array]
+        # Tax_ids that are not in the taxonomy are missing themselves
+        is_unknown_array = row_array < 0
+        lineage_array[is_unknown_array, -1] = numpy.flatnonzero(is_unknown_array)
+        return lineage_array
+
+    def get_lineage_rows(self, tax_id_array):
+        """Returns the rows of the lineage array of these tax_ids with one fancy-index, with a missing tax_id in
+        the last column for tax_ids outside of the array
+
+        :param tax_id_array: numpy.ndarray of tax_ids
+        :return: numpy.ndarray of int64 with shape (len(tax_id_array), number of ranks + 1)
+        """
+
+        lineage_array = self.get_lineage_array()
+        tax_id_array = numpy.asarray(tax_id_array, dtype='int64')
+        is_in_range_array = (tax_id_array >= 0) & (tax_id_array < lineage_array.shape[0])
+        lineage_row_array = numpy.zeros((len(tax_id_array), lineage_array.shape[1]), dtype='int64')
+        lineage_row_array[is_in_range_array] = lineage_array[tax_id_array[is_in_range_array]]
+        lineage_row_array[~is_in_range_array, -1] = tax_id_array[~is_in_range_array]
+        return lineage_row_array
+
     def get_one_tax_id_lineage(self, tax_id):
         """
         Takes a tax_id and creates a dictionary with the taxonomy lineage in
         this form {'species': 183142, 'genus': 10194, 'family': 10193, 'order': 84394,
-     'superorder': 1709201, 'class': 10191, 'phylum': 10190, 'no rank': 131567, 'kingdom': 33208,
-     'superkingdom': 2759}
+     'superorder': 1709201, 'class': 10191, 'phylum': 10190, 'no rank': 131567}
 
         Parameters
         ----------
@@ -37,33 +170,23 @@ class Taxonomy(object):
         Returns
         -------
         dic
-        Dictionnary with taxonomy lineage for given tax_id
+        Dictionnary with taxonomy lineage for given tax_id and the ranks of rank_hierarchy
 
         """
 
-        # lineage_dic = {'tax_id': tax_id}
-        lineage_dic = {}
-        while tax_id != 1:
-            # tax_id is found as normal tax in the taxonomy file
-            if tax_id in self.df.index:
-                tax_id_row = self.df.loc[tax_id, ]
-            # tax_id is found as old_tax_id column in the taxonomy file
-            elif tax_id in self.old_tax_df.index.tolist():  # Try old tax id
-                tax_id_new = self.old_tax_df.loc[tax_id, 'tax_id']
-                tax_id_row = self.df.loc[tax_id_new, ]
-            # tax_id is not found in the taxonomy file.
-            # Return current lineage dic and exit the function
-            else:
-                Logger.instance().warning(
-                    "The taxon ID {} in the Blast database is missing in the taxonomy.tsv. "
-                    "Consider updating this file with the following command: vtam taxonomy --output taxonomy.tsv.".format(tax_id))
-                # raise VTAMexception("tax_id {} from Blast database not found in the taxonomy.tsv file".format(tax_id))
-                return lineage_dic
-            rank = tax_id_row['rank']
-            parent_tax_id = tax_id_row['parent_tax_id']
-            lineage_dic[rank] = tax_id
-            tax_id = parent_tax_id
-        return lineage_dic
+        lineage_row_array = self.get_lineage_rows(numpy.array([tax_id]))[0]
+        if lineage_row_array[-1] >= 0:
+            self.warn_missing_tax_id(lineage_row_array[-1])
+        return {rank: int(lineage_tax_id) for rank, lineage_tax_id in zip(
+            self.lineage_rank_list, lineage_row_array[:-1]) if lineage_tax_id != 0}
+
+    @staticmethod
+    def warn_missing_tax_id(tax_id):
+
+        Logger.instance().warning(
+            "The taxon ID {} in the Blast database is missing in the taxonomy.tsv. "
+            "Consider updating this file with the following command: vtam taxonomy --output taxonomy.tsv.".format(
+                tax_id))
 
     def get_several_tax_id_lineages(self, tax_id_list):
         """
@@ -86,14 +209,30 @@ tax_id (index)  no rank    species     genus     family     order     class
 
         """
 
-        lineage_list = []
-        for target_tax_id_i, target_tax_id in enumerate(tax_id_list):
-            if target_tax_id_i % 100 == 0:
-                Logger.instance().debug(
-                    "Get lineage of {}-th tax id {} (Total {} tax ids)".format(
-                        target_tax_id_i, target_tax_id, len(tax_id_list)))
-            lineage_list.append({**{'tax_id': target_tax_id},
-                                 **self.get_one_tax_id_lineage(tax_id=target_tax_id)})
-        tax_id_lineage_df = pandas.DataFrame(lineage_list)
-        tax_id_lineage_df.set_index('tax_id', drop=True, inplace=True, verify_integrity=True)
-        return tax_id_lineage_df
+        lineage_row_array = self.get_lineage_rows(numpy.array(tax_id_list, dtype='int64'))
+        for missing_tax_id in lineage_row_array[lineage_row_array[:, -1] >= 0, -1].tolist():
+            self.warn_missing_tax_id(missing_tax_id)
+        tax_id_lineage_df = pandas.DataFrame(
+            lineage_row_array[:, :-1], columns=self.lineage_rank_list,
+            index=pandas.Index(tax_id_list, name='tax_id')).replace(0, numpy.nan)
+        if not tax_id_lineage_df.index.is_unique:
+            raise ValueError("Index has duplicate keys: {}".format(
+                tax_id_lineage_df.index[tax_id_lineage_df.index.duplicated()].unique().tolist()))
+        # Keep the ranks found in these lineages
+        return tax_id_lineage_df.dropna(axis='columns', how='all')
+
+    def get_tax_name_array(self, tax_id_array):
+        """Returns the name_txt of these tax_ids, with the name of the new tax_id for old tax_ids and NaN for zero
+        or missing tax_ids
+
+        :param tax_id_array: numpy.ndarray of tax_ids
+        :return: numpy.ndarray of objects
+        """
+
+        tax_id_array = numpy.asarray(tax_id_array, dtype='int64')
+        old_tax_id_sr = self.old_tax_df.loc[~self.old_tax_df.index.duplicated(keep='first'), 'tax_id']
+        # Old tax_ids that are not current tax_ids are replaced by their new tax_id
+        new_tax_id_array = old_tax_id_sr.reindex(tax_id_array).to_numpy()
+        is_old_array = ~numpy.isin(tax_id_array, self.df.index.to_numpy()) & ~numpy.isnan(new_tax_id_array)
+        tax_id_array = numpy.where(is_old_array, numpy.nan_to_num(new_tax_id_array).astype('int64'), tax_id_array)
+        return self.df.name_txt.reindex(tax_id_array).to_numpy(dtype='object')
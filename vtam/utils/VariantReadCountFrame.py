@@ -0,0 +1,95 @@
+import numpy
+import pandas
+
+
+class VariantReadCountFrame(object):
+    """Compact integer-coded copy of a variant_read_count DataFrame (run_id, marker_id, sample_id, replicate,
+    variant_id, read_count) used for the N_i, N_ij, N_ik and N_jk aggregations
+
+    Each key column is stored as the codes of its sorted unique values in the smallest integer type and read_count
+    as uint32. Several key columns are packed into one 64-bit integer, so that a groupby works on one integer column
+    instead of several int64 or object columns. The packed key keeps the lexicographic order of the key columns.
+    """
+
+    key_column_list = ['run_id', 'marker_id', 'sample_id', 'replicate', 'variant_id']
+
+    def __init__(self, variant_read_count_df):
+        """
+        :param variant_read_count_df: DataFrame with columns run_id, marker_id, sample_id, replicate, variant_id,
+            read_count. The variant_id can also be the variant sequence, like in the VariantReadCount wrapper
+        """
+
+        self.code_df = pandas.DataFrame(index=pandas.RangeIndex(variant_read_count_df.shape[0]))
+        self.unique_dic = {}
+        self.bit_length_dic = {}
+        for column in self.key_column_list:
+            code_array, unique_array = pandas.factorize(variant_read_count_df[column].to_numpy(), sort=True)
+            self.code_df[column] = code_array.astype(numpy.min_scalar_type(max(len(unique_array) - 1, 0)))
+            self.unique_dic[column] = unique_array
+            self.bit_length_dic[column] = max(len(unique_array) - 1, 1).bit_length()
+        self.code_df['read_count'] = variant_read_count_df.read_count.to_numpy(dtype='uint32')
+
+    def is_packable(self, column_list):
+        """Returns True if the codes of these columns fit in one signed 64-bit integer"""
+
+        return sum(self.bit_length_dic[column] for column in column_list) <= 63
+
+    def get_key(self, column_list):
+        """Returns the packed int64 key of these columns for each row, or None if the codes do not fit in 64 bits
+
+        :param column_list: list of key columns, from the most to the least significant
+        :return: numpy.ndarray
+        """
+
+        if not self.is_packable(column_list):
+            return None
+        key_array = numpy.zeros(self.code_df.shape[0], dtype='int64')
+        for column in column_list:
+            key_array = (key_array << self.bit_length_dic[column]) | self.code_df[column].to_numpy(dtype='int64')
+        return key_array
+
+    def unpack_key(self, key_array, column_list):
+        """Returns the DataFrame of the original values of these columns coded in key_array"""
+
+        key_df = pandas.DataFrame(index=pandas.RangeIndex(len(key_array)))
+        for column in reversed(column_list):
+            bit_length = self.bit_length_dic[column]
+            key_df[column] = self.unique_dic[column][key_array & ((1 << bit_length) - 1)]
+            key_array = key_array >> bit_length
+        return key_df[column_list]
+
+    def aggregate_read_count(self, column_list, aggregate_name, func='sum'):
+        """Returns the aggregation of read_count over the rows with the same values of column_list, sorted by
+        column_list like a pandas groupby
+
+        :param column_list: list of key columns, eg ['run_id', 'marker_id', 'variant_id'] for N_i
+        :param aggregate_name: name of the aggregate column, eg N_i
+        :param func: 'sum' or 'count'
+        :return: DataFrame with column_list and aggregate_name columns, all int64
+        """
+
+        key_array = self.get_key(column_list)
+        if key_array is None:  # Too many distinct values to pack: group on the code columns
+            aggregate_df = getattr(self.code_df.groupby(column_list).read_count, func)().reset_index()
+            for column in column_list:
+                aggregate_df[column] = self.unique_dic[column][aggregate_df[column].to_numpy(dtype='int64')]
+            return aggregate_df.rename(columns={'read_count': aggregate_name}).astype('int64')
+
+        aggregate_sr = getattr(self.code_df.read_count.groupby(key_array), func)()
+        aggregate_df = self.unpack_key(aggregate_sr.index.to_numpy(dtype='int64'), column_list)
+        aggregate_df[aggregate_name] = aggregate_sr.to_numpy(dtype='int64')
+        return aggregate_df
+
+    def transform_read_count(self, column_list, func='sum'):
+        """Returns the aggregation of read_count over the rows with the same values of column_list, aligned with the
+        rows of the original DataFrame
+
+        :param column_list: list of key columns, eg ['run_id', 'marker_id', 'variant_id'] for N_i
+        :param func: 'sum' or 'count'
+        :return: numpy.ndarray of int64
+        """
+
+        key_array = self.get_key(column_list)
+        if key_array is None:
+            return self.code_df.groupby(column_list).read_count.transform(func).to_numpy(dtype='int64')
+        return self.code_df.read_count.groupby(key_array).transform(func).to_numpy(dtype='int64')
@@ -1,5 +1,6 @@
 import sys
 
+from vtam.models.FilterChimeraCache import FilterChimeraCache
 from vtam.utils.RunnerFilterChimera import RunnerFilterChimera
 from vtam.utils.Logger import Logger
 from vtam.utils.FileSampleInformation import FileSampleInformation
@@ -106,8 +107,10 @@ class FilterChimera(ToolWrapper):
 
         variant_df = sample_info_tsv_obj.get_variant_df(
             variant_read_count_like_model=input_filter_pcr_error_model, engine=engine)
+        # Persistent cache of uchime3_denovo results keyed by input hash
+        FilterChimeraCache.__table__.create(bind=engine, checkfirst=True)
         filter_chimera_runner = RunnerFilterChimera(
-            variant_read_count_df=variant_read_count_df)
+            variant_read_count_df=variant_read_count_df, engine=engine)
         filter_output_chimera_df, filter_borderline_output_df = \
             filter_chimera_runner.get_variant_read_count_delete_df(
                 variant_df=variant_df, uchime3_denovo_abskew=uchime3_denovo_abskew)
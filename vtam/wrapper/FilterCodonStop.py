@@ -1,3 +1,4 @@
+from vtam.models.FilterCodonStopCache import FilterCodonStopCache
 from vtam.utils.RunnerFilterCodonStop import RunnerFilterCodonStop
 from vtam.utils.Logger import Logger
 from vtam.utils.FileSampleInformation import FileSampleInformation
@@ -97,8 +98,10 @@ class FilterCodonStop(ToolWrapper):
 
         variant_df = sample_info_tsv_obj.get_variant_df(
             variant_read_count_like_model=input_filter_indel_model, engine=engine)
+        # Persistent cache of has_stop_codon per variant and genetic code
+        FilterCodonStopCache.__table__.create(bind=engine, checkfirst=True)
         variant_read_count_delete_df = RunnerFilterCodonStop(
-            variant_read_count_df=variant_read_count_df).get_variant_read_count_delete_df(
+            variant_read_count_df=variant_read_count_df, engine=engine).get_variant_read_count_delete_df(
             variant_df=variant_df,
             genetic_code=genetic_code,
             skip_filter_codon_stop=skip_filter_codon_stop)
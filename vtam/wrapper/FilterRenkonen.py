@@ -1,4 +1,3 @@
-import pandas
 import sys
 
 from vtam.utils.RunnerFilterRenkonen import RunnerFilterRenkonen
@@ -94,29 +93,9 @@ class FilterRenkonen(ToolWrapper):
         #
         ############################################################################################
 
-        variant_read_count_delete_df = pandas.DataFrame()
-        run_marker_df = variant_read_count_df[[
-            'run_id', 'marker_id']].drop_duplicates()
-
-        for row in run_marker_df.itertuples():
-            run_id = row.run_id
-            marker_id = row.marker_id
-
-            variant_read_count_per_run_marker_df = variant_read_count_df.loc[(
-                variant_read_count_df.run_id == run_id) & (variant_read_count_df.marker_id == marker_id)]
-
-            if variant_read_count_per_run_marker_df.replicate.unique(
-            ).shape[0] > 1:  # if more than one replicate
-                filter_renkonen_runner_obj = RunnerFilterRenkonen(
-                    variant_read_count_per_run_marker_df)
-                filter_output_i_df = filter_renkonen_runner_obj.get_variant_read_count_delete_df(
-                    renkonen_distance_quantile)
-            else:  # Just one replicate
-                filter_output_i_df = variant_read_count_df.copy()
-                filter_output_i_df['filter_delete'] = False
-
-            variant_read_count_delete_df = pandas.concat(
-                [variant_read_count_delete_df, filter_output_i_df], axis=0)
+        variant_read_count_delete_df = RunnerFilterRenkonen.get_variant_read_count_delete_df_per_run_marker(
+            variant_read_count_df=variant_read_count_df,
+            renkonen_distance_quantile=renkonen_distance_quantile)
 
         ############################################################################################
         #
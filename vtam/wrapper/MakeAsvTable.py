@@ -1,3 +1,5 @@
+import os
+
 from wopmars.models.ToolWrapper import ToolWrapper
 
 from vtam.utils.RunnerAsvTable import RunnerAsvTable
@@ -109,4 +111,6 @@ class MakeAsvTable(ToolWrapper):
                                          engine=engine, sample_list=sample_list,
                                          cluster_identity=cluster_identity,
                                          known_occurrences_df=known_occurrences_df)
-        asvtable_runner.to_tsv(asvtable_tsv_path)
+        # Set by 'vtam filter --asvtable_format'
+        asvtable_runner.write(asvtable_path=asvtable_tsv_path,
+                              asvtable_format=os.getenv('VTAM_ASVTABLE_FORMAT', 'wide'))
@@ -1,6 +1,4 @@
 
-import pandas
-
 from wopmars.models.ToolWrapper import ToolWrapper
 from vtam.utils.FileSampleInformation import FileSampleInformation
 from vtam.utils.ModelVariantReadCountLike import ModelVariantReadCountLike
@@ -162,33 +160,15 @@ class ReadCountAverageOverReplicates(ToolWrapper):
 def read_count_average_over_replicates(variant_read_count_df):
     """
         Function used to display the read average of the remaining variant
+
+    :param variant_read_count_df: DataFrame with columns run_id, marker_id, sample_id, replicate, variant_id, read_count
+    :return: DataFrame with columns run_id, marker_id, variant_id, sample_id, read_count, replicate_count,
+        read_count_average
     """
-    variants_sequences = variant_read_count_df['variant_id'].copy()
-    variants_sequences = list(set(variants_sequences))
-    read_average_columns = ['variant', 'read_average']
-    read_average_df = pandas.DataFrame(columns=read_average_columns)
-
-    # sum of read_count over variant_id and sample_id
-    read_count_sum_over_variant_id_and_sample_id_df = variant_read_count_df.groupby(
-        ['run_id', 'marker_id', 'variant_id', 'sample_id']).sum().reset_index()
-    read_count_sum_over_variant_id_and_sample_id_df.drop(
-        'replicate', axis=1, inplace=True)
-    read_count_sum_over_variant_id_and_sample_id_df = read_count_sum_over_variant_id_and_sample_id_df.rename(
-        columns={'read_count': 'read_count'})
-
-    #  count of replicate number per variant_id and sample_id
-    replicate_count_over_variant_id_and_sample_id_df = variant_read_count_df.groupby(
-        ['run_id', 'marker_id', 'variant_id', 'sample_id']).count().reset_index()
-    replicate_count_over_variant_id_and_sample_id_df.drop(
-        'read_count', axis=1, inplace=True)
-    replicate_count_over_variant_id_and_sample_id_df = replicate_count_over_variant_id_and_sample_id_df.rename(
-        columns={'replicate': 'replicate_count'})
-
-    # merge
-    df_out = read_count_sum_over_variant_id_and_sample_id_df.merge(
-        replicate_count_over_variant_id_and_sample_id_df, left_on=(
-            'run_id', 'marker_id', 'variant_id', 'sample_id'), right_on=(
-            'run_id', 'marker_id', 'variant_id', 'sample_id'))
+
+    # sum of read_count and count of replicates over variant_id and sample_id in one pass
+    df_out = variant_read_count_df.groupby(['run_id', 'marker_id', 'variant_id', 'sample_id']).agg(
+        read_count=('read_count', 'sum'), replicate_count=('replicate', 'count')).reset_index()
     df_out['read_count_average'] = df_out.read_count / df_out.replicate_count
     #
     return df_out
@@ -14,8 +14,10 @@ from sqlalchemy import select, bindparam, func
 
 
 #local imports
+from vtam.utils.FileVariantReadCountSnapshot import FileVariantReadCountSnapshot
 from vtam.utils.Logger import Logger
 from vtam.utils.FileSampleInformation import FileSampleInformation
+from vtam.utils.ModelPartitionFingerprint import ModelPartitionFingerprint
 from vtam.utils.VTAMexception import VTAMexception
 from vtam.utils.DataframeVariantReadCountLike import DataframeVariantReadCountLike
 from wopmars.models.ToolWrapper import ToolWrapper
@@ -77,6 +79,30 @@ class VariantReadCount(ToolWrapper):
             "global_read_count_cutoff": "int",
         }
 
+    @staticmethod
+    def get_run_marker_fingerprint_dic(sample_info_ids_df, read_dir, global_read_count_cutoff):
+        """Returns the dictionary (run_id, marker_id): fingerprint of the sorted FASTA files (name, size and
+        modification time) of each run-marker and of the global_read_count_cutoff parameter"""
+
+        sorted_fasta_stat_list = []
+        for row in sample_info_ids_df.itertuples():
+            read_fasta_path = os.path.join(read_dir, row.sortedfasta)
+            if os.path.exists(read_fasta_path):
+                read_fasta_stat = os.stat(read_fasta_path)
+                sorted_fasta_stat_list.append((read_fasta_stat.st_size, read_fasta_stat.st_mtime_ns))
+            else:
+                sorted_fasta_stat_list.append((-1, -1))
+        sorted_fasta_df = sample_info_ids_df[['run_id', 'marker_id', 'sample_id', 'replicate', 'sortedfasta']].copy()
+        sorted_fasta_df['sortedfasta'] = [os.path.abspath(os.path.join(read_dir, sortedfasta))
+                                          for sortedfasta in sorted_fasta_df.sortedfasta]
+        sorted_fasta_df['size'] = [stat[0] for stat in sorted_fasta_stat_list]
+        sorted_fasta_df['mtime_ns'] = [stat[1] for stat in sorted_fasta_stat_list]
+
+        return {(run_id, marker_id): ModelPartitionFingerprint.get_df_fingerprint(
+            sorted_fasta_run_marker_df, float(global_read_count_cutoff))
+            for (run_id, marker_id), sorted_fasta_run_marker_df in sorted_fasta_df.groupby(
+                ['run_id', 'marker_id'], sort=False)}
+
     @staticmethod
     def get_sorted_read_list(file_path, generic_dna=None):
         """
@@ -177,6 +203,46 @@ class VariantReadCount(ToolWrapper):
                                              'sample_id': sample_id,
                                              'replicate': replicate})
 
+        sample_info_tsv_obj = FileSampleInformation(
+            tsv_path=input_file_sortedinfo)
+        sample_info_ids_df = sample_info_tsv_obj.to_identifier_df(engine=engine)
+
+        #######################################################################
+        #
+        # With 'vtam filter --incremental', only recompute run-markers whose sorted reads or parameters changed
+        #
+        #######################################################################
+
+        partition_fingerprint_obj = None
+        fingerprint_dic = {}
+        if os.getenv('VTAM_INCREMENTAL') == '1':
+            partition_fingerprint_obj = ModelPartitionFingerprint(engine=engine, step='VariantReadCount')
+            fingerprint_dic = VariantReadCount.get_run_marker_fingerprint_dic(
+                sample_info_ids_df=sample_info_ids_df, read_dir=read_dir,
+                global_read_count_cutoff=global_read_count_cutoff)
+            changed_run_marker_set = partition_fingerprint_obj.get_changed_run_marker_set(fingerprint_dic)
+            Logger.instance().info(
+                "VariantReadCount: {} of {} run-markers changed".format(
+                    len(changed_run_marker_set), len(fingerprint_dic)))
+            fingerprint_dic = {run_marker: fingerprint for run_marker, fingerprint in fingerprint_dic.items()
+                               if run_marker in changed_run_marker_set}
+            sample_instance_list = [sample_instance for sample_instance in sample_instance_list if (
+                sample_instance['run_id'], sample_instance['marker_id']) in changed_run_marker_set]
+            sample_info_ids_df = sample_info_ids_df.loc[[
+                (run_id, marker_id) in changed_run_marker_set for run_id, marker_id in zip(
+                    sample_info_ids_df.run_id, sample_info_ids_df.marker_id)]]
+            if len(sample_instance_list) == 0:
+                # The tables are up to date, but the next rules need them touched and the snapshot available
+                if FileVariantReadCountSnapshot(
+                        engine=engine, variant_read_count_like_model=variant_read_count_model).read() is None:
+                    FileVariantReadCountSnapshot(
+                        engine=engine, variant_read_count_like_model=variant_read_count_model).write()
+                self.touch_output_tables()
+                return
+        else:
+            ModelPartitionFingerprint(engine=engine, step='VariantReadCount').delete(
+                sample_info_ids_df[['run_id', 'marker_id']].drop_duplicates().apply(tuple, axis=1).tolist())
+
         #######################################################################
         #
         # 2. Delete marker_name/run_name/sample/replicate from variant_read_count_model
@@ -187,6 +253,8 @@ class VariantReadCount(ToolWrapper):
             "file: {}; line: {}; Delete marker_name/run_name/sample/replicate".format(
                 __file__, inspect.currentframe().f_lineno))
 
+        # The snapshot is invalid as soon as rows are deleted
+        FileVariantReadCountSnapshot(engine=engine, variant_read_count_like_model=variant_read_count_model).invalidate()
         with engine.connect() as conn:
             stmt_del = variant_read_count_model.__table__.delete()
             stmt_del = stmt_del.where(
@@ -207,9 +275,6 @@ class VariantReadCount(ToolWrapper):
 
         # fasta_info_obj = FastaInformationTSV(input_file_sortedinfo, engine=engine)
         # sample_info_ids_df = fasta_info_obj.get_ids_df()
-        sample_info_tsv_obj = FileSampleInformation(
-            tsv_path=input_file_sortedinfo)
-        sample_info_ids_df = sample_info_tsv_obj.to_identifier_df(engine=engine)
 
         Logger.instance().debug(
             "file: {}; line: {}; Read demultiplexed FASTA files".format(
@@ -382,12 +447,24 @@ class VariantReadCount(ToolWrapper):
                 variant_read_count_model.__table__.insert(),
                 variant_read_count_instance_list)
 
+        # Columnar snapshot read by the filters instead of one query per sample replicate
+        FileVariantReadCountSnapshot(engine=engine, variant_read_count_like_model=variant_read_count_model).write()
+
+        if partition_fingerprint_obj is not None:
+            partition_fingerprint_obj.update(fingerprint_dic)
+
         #######################################################################
         #
         # Touch output tables, to update modification date
         #
         #######################################################################
 
+        self.touch_output_tables()
+
+    def touch_output_tables(self):
+        """Touch output tables, to update modification date"""
+
+        session = self.session
         for output_table_i in self.specify_output_table():
             declarative_meta_i = self.output_table(output_table_i)
             obj = session.query(declarative_meta_i).order_by(